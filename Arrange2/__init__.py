@@ -1,5 +1,11 @@
-from krita import Krita, Extension, Qt, QWidget, QDockWidget, QFrame, QHBoxLayout, QGridLayout, QRadioButton, QToolButton, QIcon, QLabel, QSpacerItem, QSizePolicy, QGraphicsOpacityEffect
+from krita import Krita, Extension, Qt, QWidget, QDockWidget, QFrame, QHBoxLayout, QGridLayout, QRadioButton, QToolButton, QIcon, QLabel, QSpacerItem, QSizePolicy, QGraphicsOpacityEffect, QCheckBox, QProgressBar, QPushButton, QSpinBox, QAction, QTimer
 from . import operators as op
+from . import applier
+from . import pixels
+from . import profiler
+from . import macros
+from . import speculative
+from . import preview
 import pathlib
 
 class extensionArrange2(Extension):
@@ -19,13 +25,84 @@ class extensionArrange2(Extension):
 		# Load plugin settings
 		# Default anchor value is None == all selected layers
 		self.anchor = Krita.instance().readSetting("", "pluginArrange2.Anchor", None)
+		# Arrange layers by their bounds, or by their visible pixels
+		self.visible = Krita.instance().readSetting("", "pluginArrange2.VisiblePixels", "false") == "true"
+		# Estimate visible pixels bounds, faster but may miss small isolated pixels
+		self.estimate = Krita.instance().readSetting("", "pluginArrange2.EstimatePixels", "false") == "true"
+		# Threads scanning visible pixels, 0 for one per CPU
+		pixels.workers = int(Krita.instance().readSetting("", "pluginArrange2.PixelWorkers", "0") or 0) or None
+		# Distribute every row or column of layers on its own
+		self.clusters = Krita.instance().readSetting("", "pluginArrange2.Clusters", "false") == "true"
+		# Sheet packing, width 0 lets the packer pick a roughly square sheet
+		self.pack_width = int(Krita.instance().readSetting("", "pluginArrange2.PackWidth", "0") or 0)
+		self.pack_padding = int(Krita.instance().readSetting("", "pluginArrange2.PackPadding", "0") or 0)
+		# Grid layout, 0 columns fits about as many columns as rows
+		self.grid_columns = int(Krita.instance().readSetting("", "pluginArrange2.GridColumns", "0") or 0)
+		self.grid_gutter = int(Krita.instance().readSetting("", "pluginArrange2.GridGutter", "0") or 0)
+		# Saved macros, name: steps. Steps are collected here while recording one.
+		self.macros = macros.load()
+		self.recording = None
+		# (operator, placement, params) of the last operation, for repeating it
+		self.last_operation = None
+		# Plan operations ahead while the selection doesn't change, see poll_selection()
+		self.plan_ahead = Krita.instance().readSetting("", "pluginArrange2.PlanAhead", "true") == "true"
+		self.poll_timer = None
+		# Outline targets on canvas while hovering buttons, from plans computed ahead
+		self.hover_preview = Krita.instance().readSetting("", "pluginArrange2.HoverPreview", "true") == "true"
+		self.preview = None
+		# Profiling is off unless turned on from the docker
+		profiler.enabled = Krita.instance().readSetting("", "pluginArrange2.Profile", "false") == "true"
+		profiler.listeners.append(self.show_profile)
+		# Large arrangements are applied in chunks, show how far they are
+		applier.progress_listeners.append(self.show_progress)
 	# ----------------------------------------------------------------------------------------------
 
 	def setup(self):
 		pass
 
 	def createActions(self, window):
-		pass
+		""" Register every operation as a Krita action, so they can be bound to shortcuts """
+		for name, text, action, placement, kwargs in self.operations():
+			qaction = window.createAction(f"arrange2_{name}", f"Arrange 2: {text}", "tools/scripts/arrange2")
+			qaction.triggered.connect(lambda checked=False, action=action, placement=placement, kwargs=kwargs: self.run_operation(action, placement, **kwargs))
+
+		# Packing and grids use the docker settings
+		for name, text, slot in (("pack", "Pack selected layers into a sheet", self.pack), ("grid", "Place selected layers in a grid", self.grid)):
+			qaction = window.createAction(f"arrange2_{name}", f"Arrange 2: {text}", "tools/scripts/arrange2")
+			qaction.triggered.connect(slot)
+
+		qaction = window.createAction("arrange2_repeat_last", "Arrange 2: Repeat last arrangement", "tools/scripts/arrange2")
+		qaction.triggered.connect(self.repeat_last)
+
+	def operations(self):
+		""" Operations available as actions.
+			@return: List of (name, text, operator, placement, params) """
+		anchor = {"anchor": self.get_anchor}
+		return [
+			("align_left", "Align left edges", op.align_nodes, "left", anchor),
+			("align_center_h", "Align horizontally", op.align_nodes, "h_center", anchor),
+			("align_right", "Align right edges", op.align_nodes, "right", anchor),
+			("align_top", "Align top edges", op.align_nodes, "top", anchor),
+			("align_center_v", "Align vertically", op.align_nodes, "v_center", anchor),
+			("align_bottom", "Align bottom edges", op.align_nodes, "bottom", anchor),
+			("dist_left", "Distribute left edges evenly", op.distribute_nodes, "left", {}),
+			("dist_center_h", "Distribute centers horizontally", op.distribute_nodes, "h_center", {}),
+			("dist_right", "Distribute right edges evenly", op.distribute_nodes, "right", {}),
+			("dist_top", "Distribute top edges evenly", op.distribute_nodes, "top", {}),
+			("dist_center_v", "Distribute centers vertically", op.distribute_nodes, "v_center", {}),
+			("dist_bottom", "Distribute bottom edges evenly", op.distribute_nodes, "bottom", {}),
+			("dist_h", "Make horizontal spacing equal", op.distribute_nodes, "horizontal", {}),
+			("dist_v", "Make vertical spacing equal", op.distribute_nodes, "vertical", {}),
+			("dist_edge_left", "Place edge-to-edge from the left", op.distribute_nodes, "horizontal", {"spacing": 0}),
+			("dist_edge_right", "Place edge-to-edge from the right", op.distribute_nodes, "horizontal", {"spacing": 0, "reverse": True}),
+			("dist_edge_top", "Place edge-to-edge from the top", op.distribute_nodes, "vertical", {"spacing": 0}),
+			("dist_edge_bottom", "Place edge-to-edge from the bottom", op.distribute_nodes, "vertical", {"spacing": 0, "reverse": True}),
+			("overlaps_h", "Push apart layers overlapping horizontally", op.distribute_nodes, "horizontal", {"overlaps": True}),
+			("overlaps_v", "Push apart layers overlapping vertically", op.distribute_nodes, "vertical", {"overlaps": True}),
+			("snap_h", "Snap selection to the nearest edge horizontally", op.snap_nodes, "horizontal", {}),
+			("snap_v", "Snap selection to the nearest edge vertically", op.snap_nodes, "vertical", {}),
+			("snap_both", "Snap selection to the nearest edges", op.snap_nodes, "both", {}),
+		]
 
 	def window_ready(self):
 		""" Connect notfiers for window that was just finished being created """
@@ -43,9 +120,10 @@ class extensionArrange2(Extension):
 		""" Enable or disable and update appearance of tool buttons, and update setting """
 
 		# Disable button if chosen mode doesn't apply to it
-		if value == "canvas" or value == "active":
+		if value == "canvas" or value == "active" or value == "selection":
 			# Canvas only works for alignment operations
 			# Active layer only works for alignment operations
+			# Pixel selection only works for alignment operations
 			for btn in self.btns_anchor_all_only:
 				# Signal button is disabled by fading it
 				btn.graphicsEffect().setEnabled(True)
@@ -63,6 +141,200 @@ class extensionArrange2(Extension):
 		# Save Setting
 		Krita.instance().writeSetting("", "pluginArrange2.Anchor", self.anchor)
 
+	def get_visible(self):
+		""" Retrieve how visible pixels are used: False, True or "estimate" """
+		if not self.visible:
+			return False
+		return "estimate" if self.estimate else True
+
+	def update_visible(self, value):
+		""" Arrange layers by their visible pixels or their bounds, and update setting """
+		self.visible = bool(value)
+		self.chk_estimate.setEnabled(self.visible)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.VisiblePixels", "true" if self.visible else "false")
+
+	def update_estimate(self, value):
+		""" Estimate visible pixels bounds or scan them exactly, and update setting """
+		self.estimate = bool(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.EstimatePixels", "true" if self.estimate else "false")
+
+	def update_clusters(self, value):
+		""" Distribute rows and columns of layers on their own or all together, and update setting """
+		self.clusters = bool(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.Clusters", "true" if self.clusters else "false")
+
+	def update_pack_width(self, value):
+		""" Update width of packed sheets, and update setting """
+		self.pack_width = int(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.PackWidth", str(self.pack_width))
+
+	def update_pack_padding(self, value):
+		""" Update padding between packed layers, and update setting """
+		self.pack_padding = int(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.PackPadding", str(self.pack_padding))
+
+	def repeat_last(self):
+		""" Run the last operation again on the current selection """
+		if self.last_operation is None:
+			return
+		action, placement, kwargs = self.last_operation
+		op.repeat_operation(action, placement, visible=self.get_visible(), clusters=self.clusters, **kwargs)
+
+	def poll_selection(self):
+		""" Plan docker operations ahead when the layer selection stops changing """
+		if not self.plan_ahead or not self.docker.isVisible():
+			return
+		if speculative.poll(self.planned_operations()):
+			interval = speculative.POLL_INTERVAL
+		else:
+			# Nothing changed, check less and less often
+			interval = min(self.poll_timer.interval() * 2, speculative.POLL_MAX_INTERVAL)
+		self.poll_timer.setInterval(interval)
+
+	def planned_operations(self):
+		""" Operations planned ahead, with the parameters a click would use.
+			Snapping isn't, it reads the whole document.
+			@return: List of (operator, placement, params) """
+		operations = [(action, placement, kwargs) for name, text, action, placement, kwargs in self.operations() if action is not op.snap_nodes]
+		operations += [self.pack_operation(), self.grid_operation()]
+		return [(action, placement, self.operation_params(kwargs)) for action, placement, kwargs in operations]
+
+	def operation_params(self, kwargs):
+		""" Parameters an operation runs with when clicked right now """
+		# Bounds mode is read when clicked, it applies to every operation
+		return dict(kwargs, visible=self.get_visible(), clusters=self.clusters)
+
+	def pack_operation(self):
+		""" Packing with the current docker settings.
+			@return: (operator, width, params) """
+		return (op.pack_nodes, self.pack_width or None, {"padding": self.pack_padding})
+
+	def pack(self):
+		""" Pack selected layers into a sheet with the current docker settings """
+		action, placement, kwargs = self.pack_operation()
+		self.run_operation(action, placement, **kwargs)
+
+	def update_grid_columns(self, value):
+		""" Update number of grid columns, and update setting """
+		self.grid_columns = int(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.GridColumns", str(self.grid_columns))
+
+	def update_grid_gutter(self, value):
+		""" Update space between grid cells, and update setting """
+		self.grid_gutter = int(value)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.GridGutter", str(self.grid_gutter))
+
+	def grid_operation(self):
+		""" Grid with the current docker settings.
+			@return: (operator, placement, params) """
+		return (op.distribute_nodes, "grid", {"columns": self.grid_columns or None, "gutter": self.grid_gutter})
+
+	def grid(self):
+		""" Place selected layers in a grid with the current docker settings """
+		action, placement, kwargs = self.grid_operation()
+		self.run_operation(action, placement, **kwargs)
+
+	def run_operation(self, action, placement, **kwargs):
+		""" Run an operation clicked in the docker or triggered by a shortcut,
+			adding it to the macro being recorded """
+		params = self.operation_params(kwargs)
+		# Plans computed ahead skip reading layers again
+		if not speculative.take(action, placement, **params):
+			action(placement, **params)
+		self.last_operation = (action, placement, kwargs)
+
+		name = macros.step_name(action)
+		if self.recording is not None and name is not None:
+			params = dict(kwargs)
+			if name == "distribute":
+				params["clusters"] = self.clusters
+			if "anchor" in params:
+				# Store the anchor chosen right now, not the function reading it
+				params["anchor"] = params["anchor"]()
+			self.recording.append((name, placement, params))
+			self.btn_record.setText(f"Stop ({len(self.recording)})")
+
+	def update_recording(self, value):
+		""" Start recording a macro, or stop and save it as a new button """
+		if value:
+			self.recording = []
+			self.btn_record.setText("Stop (0)")
+			return
+
+		steps = self.recording or []
+		self.recording = None
+		self.btn_record.setText("Record")
+		if not steps:
+			return
+
+		count = len(self.macros) + 1
+		while f"Macro {count}" in self.macros:
+			count += 1
+		name = f"Macro {count}"
+		self.macros[name] = steps
+		macros.save(self.macros)
+		self.add_macro_button(name)
+
+	def add_macro_button(self, name):
+		""" Add the button running a saved macro, right click deletes it """
+		btn = QToolButton()
+		btn.setText(name)
+		btn.setToolTip(f"Run as a single operation:\n{macros.describe(self.macros[name])}")
+		btn.setObjectName(f"btn_macro_{name}")
+		btn.clicked.connect(lambda: macros.run_macro(name, self.macros[name], visible=self.get_visible()))
+
+		btn.setContextMenuPolicy(Qt.ActionsContextMenu)
+		action = QAction("Delete macro", btn)
+		action.triggered.connect(lambda: self.delete_macro(name, btn))
+		btn.addAction(action)
+
+		self.macro_bar.layout().addWidget(btn)
+
+	def delete_macro(self, name, btn):
+		""" Forget a saved macro and remove its button """
+		self.macros.pop(name, None)
+		macros.save(self.macros)
+		btn.deleteLater()
+
+	def update_profiling(self, value):
+		""" Turn profiling of operations on or off, and update setting """
+		profiler.enabled = bool(value)
+		self.lbl_profile.setVisible(profiler.enabled)
+
+		# Save Setting
+		Krita.instance().writeSetting("", "pluginArrange2.Profile", "true" if profiler.enabled else "false")
+
+	def show_profile(self, report):
+		""" Show the summary of the last profiled operation in the docker """
+		if hasattr(self, "lbl_profile"):
+			self.lbl_profile.setText(report.summary())
+
+	def show_progress(self, done, total, rollback):
+		""" Show progress of layers being moved in chunks, hide it once done """
+		if not hasattr(self, "progress_wrapper"):
+			return
+
+		self.progress_bar.setMaximum(total)
+		self.progress_bar.setValue(done)
+		self.progress_bar.setFormat("Restoring %v/%m" if rollback else "Moving %v/%m")
+		# Can't cancel a rollback
+		self.btn_cancel.setEnabled(not rollback)
+		self.progress_wrapper.setVisible(done < total)
+
 	def update_icons_theme(self):
 		""" Update the color of custom icons to match the theme """
 		# Filtering themes names because I couldn't find a setting making direct references to icon color :|
@@ -82,10 +354,43 @@ class extensionArrange2(Extension):
 			btn.setIcon(icon)
 		btn.setToolTip(tooltip)
 		btn.setObjectName(id)
-		btn.clicked.connect(lambda: action(placement, **kwargs))
+		btn.clicked.connect(lambda: self.run_operation(action, placement, **kwargs))
+		self.preview_button(btn, lambda: (action, placement, kwargs))
 
 		return btn
 
+	def preview_button(self, btn, operation):
+		""" Outline targets of a button's operation on canvas while hovering it.
+			@param operation: Function returning (operator, placement, params) """
+		if not self.hover_preview:
+			return
+
+		def clicked():
+			action, placement, kwargs = operation()
+			return (action, placement, self.operation_params(kwargs))
+
+		self.preview.watch(btn, clicked)
+
+	def add_button_row(self, layout, rc, title, buttons):
+		""" Add a subheading and a row of text buttons or other widgets to the panel layout.
+			@return: Row count after the new rows """
+		rc += 1
+		subheading = QLabel(title)
+		subheading.setProperty("class", "subheading")
+		layout.addWidget(subheading, rc, 0, 1, 7)
+
+		rc += 1
+		sublayout_wrapper = QWidget()
+		sublayout = QHBoxLayout()
+		sublayout.setContentsMargins(0, 0, 0, 0)
+		for btn in buttons:
+			sublayout.addWidget(btn)
+		sublayout.addStretch(1)
+		sublayout_wrapper.setLayout(sublayout)
+		layout.addWidget(sublayout_wrapper, rc, 0, 1, 7)
+
+		return rc
+
 	def create_panel(self, window):
 		""" Generate GUI alignment panel for the new window being created """
 		qwin = window.qwindow()
@@ -97,6 +402,9 @@ class extensionArrange2(Extension):
 
 		app = Krita.instance()
 
+		if self.preview is None:
+			self.preview = preview.HoverPreview(qdock)
+
 		# --- Create buttons
 		btn_align_left = self.create_align_button("btn_align_left", app.icon('object-align-horizontal-left-calligra'), "Align left edges", op.align_nodes, "left", anchor=self.get_anchor)
 		btn_align_center_h = self.create_align_button("btn_align_center_h", app.icon('object-align-horizontal-center-calligra'), "Align horizontally", op.align_nodes, "h_center", anchor=self.get_anchor)
@@ -123,6 +431,89 @@ class extensionArrange2(Extension):
 		btn_dist_edge_top = self.create_align_button("btn_dist_edge_top", None, "Place edge-to-edge from the top", op.distribute_nodes, "vertical", spacing=0)
 		btn_dist_edge_bottom = self.create_align_button("btn_dist_edge_bottom", None, "Place edge-to-edge from the bottom", op.distribute_nodes, "vertical", spacing=0, reverse=True)
 
+		# Snap to the closest edge of other layers, replaces manual edge snapping
+		btn_snap_h = self.create_align_button("btn_snap_h", None, "Snap selection to the nearest edge horizontally", op.snap_nodes, "horizontal")
+		btn_snap_h.setText("Horizontal")
+		btn_snap_v = self.create_align_button("btn_snap_v", None, "Snap selection to the nearest edge vertically", op.snap_nodes, "vertical")
+		btn_snap_v.setText("Vertical")
+		btn_snap_both = self.create_align_button("btn_snap_both", None, "Snap selection to the nearest edges", op.snap_nodes, "both")
+		btn_snap_both.setText("Both")
+
+		# Push apart overlapping layers only, layers with room around them stay
+		btn_overlaps_h = self.create_align_button("btn_overlaps_h", None, "Push apart layers overlapping horizontally", op.distribute_nodes, "horizontal", overlaps=True)
+		btn_overlaps_h.setText("Horizontal")
+		btn_overlaps_v = self.create_align_button("btn_overlaps_v", None, "Push apart layers overlapping vertically", op.distribute_nodes, "vertical", overlaps=True)
+		btn_overlaps_v.setText("Vertical")
+
+		# Pack into a sheet, settings are read when clicked
+		btn_pack = QToolButton()
+		btn_pack.setText("Pack")
+		btn_pack.setToolTip("Pack selected layers into a compact sheet, starting at their top left corner")
+		btn_pack.setObjectName("btn_pack")
+		btn_pack.clicked.connect(self.pack)
+		self.preview_button(btn_pack, self.pack_operation)
+
+		spin_pack_width = QSpinBox()
+		spin_pack_width.setRange(0, 100000)
+		spin_pack_width.setSingleStep(100)
+		spin_pack_width.setPrefix("Width ")
+		spin_pack_width.setSuffix(" px")
+		spin_pack_width.setSpecialValueText("Auto width")
+		spin_pack_width.setToolTip("Width of the sheet, auto makes it about as wide as tall")
+		spin_pack_width.setObjectName("spin_pack_width")
+		spin_pack_width.setValue(self.pack_width)
+		spin_pack_width.valueChanged.connect(self.update_pack_width)
+
+		spin_pack_padding = QSpinBox()
+		spin_pack_padding.setRange(0, 10000)
+		spin_pack_padding.setPrefix("Padding ")
+		spin_pack_padding.setSuffix(" px")
+		spin_pack_padding.setToolTip("Space between packed layers")
+		spin_pack_padding.setObjectName("spin_pack_padding")
+		spin_pack_padding.setValue(self.pack_padding)
+		spin_pack_padding.valueChanged.connect(self.update_pack_padding)
+
+		# Grid of uniform cells, settings are read when clicked
+		btn_grid = QToolButton()
+		btn_grid.setText("Grid")
+		btn_grid.setToolTip("Place selected layers in a grid of uniform cells, ordered from left to right")
+		btn_grid.setObjectName("btn_grid")
+		btn_grid.clicked.connect(self.grid)
+		self.preview_button(btn_grid, self.grid_operation)
+
+		spin_grid_columns = QSpinBox()
+		spin_grid_columns.setRange(0, 1000)
+		spin_grid_columns.setPrefix("Columns ")
+		spin_grid_columns.setSpecialValueText("Auto columns")
+		spin_grid_columns.setToolTip("Number of columns, auto makes about as many columns as rows")
+		spin_grid_columns.setObjectName("spin_grid_columns")
+		spin_grid_columns.setValue(self.grid_columns)
+		spin_grid_columns.valueChanged.connect(self.update_grid_columns)
+
+		spin_grid_gutter = QSpinBox()
+		spin_grid_gutter.setRange(0, 10000)
+		spin_grid_gutter.setPrefix("Gutter ")
+		spin_grid_gutter.setSuffix(" px")
+		spin_grid_gutter.setToolTip("Space between grid cells")
+		spin_grid_gutter.setObjectName("spin_grid_gutter")
+		spin_grid_gutter.setValue(self.grid_gutter)
+		spin_grid_gutter.valueChanged.connect(self.update_grid_gutter)
+
+		# Macros, operations clicked while recording are saved as a single button
+		self.btn_record = QToolButton()
+		self.btn_record.setText("Record")
+		self.btn_record.setCheckable(True)
+		self.btn_record.setToolTip("Record the next align and distribute operations as a macro, click again to save it")
+		self.btn_record.setObjectName("btn_record")
+		self.btn_record.toggled.connect(self.update_recording)
+
+		self.macro_bar = QWidget()
+		sublayout = QHBoxLayout()
+		sublayout.setContentsMargins(0, 0, 0, 0)
+		self.macro_bar.setLayout(sublayout)
+		for name in self.macros:
+			self.add_macro_button(name)
+
 		# Store these to enable/disable on anchor type selection
 		self.btns_anchor_all_only = [
 			btn_dist_left,
@@ -137,6 +528,8 @@ class extensionArrange2(Extension):
 			btn_dist_edge_right,
 			btn_dist_edge_top,
 			btn_dist_edge_bottom,
+			btn_overlaps_h,
+			btn_overlaps_v,
 		]
 
 		# Setup opacity effect for when buttons are disabled
@@ -170,12 +563,18 @@ class extensionArrange2(Extension):
 		rbtn_selected_layers.setToolTip("Align selection relative to selected layers")
 		rbtn_selected_layers.setObjectName("rbtn_selected_layers")
 
+		rbtn_selection = QRadioButton("Selection")
+		rbtn_selection.toggled.connect(lambda: self.update_anchor("selection"))
+		rbtn_selection.setToolTip("Align selection relative to the selected pixels (edges only)")
+		rbtn_selection.setObjectName("rbtn_selection")
 
 		# Set according to stored setting
 		if self.anchor == "canvas":
 			rbtn_canvas.setChecked(True)
 		elif self.anchor == "active":
 			rbtn_active_layer.setChecked(True)
+		elif self.anchor == "selection":
+			rbtn_selection.setChecked(True)
 		else:
 			rbtn_selected_layers.setChecked(True)
 
@@ -192,10 +591,33 @@ class extensionArrange2(Extension):
 		sublayout.addWidget(rbtn_active_layer)
 		sublayout.addWidget(rbtn_selected_layers)
 		sublayout.addWidget(rbtn_canvas)
+		sublayout.addWidget(rbtn_selection)
 		sublayout_wrapper.setLayout(sublayout)
 
 		layout.addWidget(sublayout_wrapper, rc, 0, 1, 7)
 
+		rc += 1
+		chk_visible = QCheckBox("Visible pixels")
+		chk_visible.setToolTip("Arrange layers by their visible pixels, ignoring transparent areas in their bounds")
+		chk_visible.setObjectName("chk_visible")
+		chk_visible.setChecked(self.visible)
+		chk_visible.toggled.connect(self.update_visible)
+
+		self.chk_estimate = QCheckBox("Fast")
+		self.chk_estimate.setToolTip("Estimate visible pixels bounds, faster on big layers but may miss small isolated pixels")
+		self.chk_estimate.setObjectName("chk_estimate")
+		self.chk_estimate.setChecked(self.estimate)
+		self.chk_estimate.setEnabled(self.visible)
+		self.chk_estimate.toggled.connect(self.update_estimate)
+
+		sublayout_wrapper = QWidget()
+		sublayout = QHBoxLayout()
+		sublayout.setContentsMargins(0, 0, 0, 3)
+		sublayout.addWidget(chk_visible)
+		sublayout.addWidget(self.chk_estimate)
+		sublayout_wrapper.setLayout(sublayout)
+		layout.addWidget(sublayout_wrapper, rc, 0, 1, 7)
+
 		rc += 1
 		layout.addWidget(btn_align_left, rc, 0)
 		layout.addWidget(btn_align_center_h, rc, 1)
@@ -210,6 +632,13 @@ class extensionArrange2(Extension):
 		subheading.setProperty("class", "subheading")
 		layout.addWidget(subheading, rc, 0, 1, 7)
 		rc += 1
+		chk_clusters = QCheckBox("Each row or column on its own")
+		chk_clusters.setToolTip("Distribute layers overlapping on the other axis together, so every row or column of a board is distributed separately")
+		chk_clusters.setObjectName("chk_clusters")
+		chk_clusters.setChecked(self.clusters)
+		chk_clusters.toggled.connect(self.update_clusters)
+		layout.addWidget(chk_clusters, rc, 0, 1, 7)
+		rc += 1
 		layout.addWidget(btn_dist_left, rc, 0)
 		layout.addWidget(btn_dist_center_h, rc, 1)
 		layout.addWidget(btn_dist_right, rc, 2)
@@ -231,6 +660,46 @@ class extensionArrange2(Extension):
 		layout.addWidget(btn_dist_edge_top, rc, 5)
 		layout.addWidget(btn_dist_edge_bottom, rc, 6)
 
+		rc = self.add_button_row(layout, rc, "Remove Overlaps", [btn_overlaps_h, btn_overlaps_v])
+		rc = self.add_button_row(layout, rc, "Snap to Nearest Edge", [btn_snap_h, btn_snap_v, btn_snap_both])
+		rc = self.add_button_row(layout, rc, "Arrange into Sheet", [btn_pack, spin_pack_width, spin_pack_padding])
+		rc = self.add_button_row(layout, rc, "Arrange into Grid", [btn_grid, spin_grid_columns, spin_grid_gutter])
+		rc = self.add_button_row(layout, rc, "Macros", [self.btn_record, self.macro_bar])
+
+		# --- Progress of large arrangements, hidden until one is running
+		rc += 1
+		self.progress_bar = QProgressBar()
+		self.progress_bar.setObjectName("progress_bar")
+		self.btn_cancel = QPushButton("Cancel")
+		self.btn_cancel.setToolTip("Stop moving layers and put back the ones already moved")
+		self.btn_cancel.setObjectName("btn_cancel")
+		self.btn_cancel.clicked.connect(applier.cancel_pending)
+
+		self.progress_wrapper = QWidget()
+		sublayout = QHBoxLayout()
+		sublayout.setContentsMargins(0, 3, 0, 0)
+		sublayout.addWidget(self.progress_bar)
+		sublayout.addWidget(self.btn_cancel)
+		self.progress_wrapper.setLayout(sublayout)
+		self.progress_wrapper.hide()
+		layout.addWidget(self.progress_wrapper, rc, 0, 1, 7)
+
+		# --- Profiling, counts and times calls to Krita for each operation
+		rc += 1
+		chk_profile = QCheckBox("Profile operations")
+		chk_profile.setToolTip(f"Time calls made to Krita by each operation, full reports go to {profiler.log_path}")
+		chk_profile.setObjectName("chk_profile")
+		chk_profile.setChecked(profiler.enabled)
+		chk_profile.toggled.connect(self.update_profiling)
+		layout.addWidget(chk_profile, rc, 0, 1, 7)
+
+		rc += 1
+		self.lbl_profile = QLabel("")
+		self.lbl_profile.setObjectName("lbl_profile")
+		self.lbl_profile.setWordWrap(True)
+		self.lbl_profile.setVisible(profiler.enabled)
+		layout.addWidget(self.lbl_profile, rc, 0, 1, 7)
+
 		# Grow last column to push layout to the left
 		layout.setColumnStretch(7, 1)
 
@@ -274,6 +743,13 @@ class extensionArrange2(Extension):
 		qdock.setMinimumHeight(self.frame.height())
 		qdock.adjustSize()
 
+		# Krita has no signal for layer selection changes, check it regularly
+		if self.poll_timer is None:
+			self.poll_timer = QTimer(qdock)
+			self.poll_timer.setInterval(speculative.POLL_INTERVAL)
+			self.poll_timer.timeout.connect(self.poll_selection)
+			self.poll_timer.start()
+
 
 # And add the extension to Krita's list of extensions:
 Krita.instance().addExtension(extensionArrange2(Krita.instance()))
@@ -0,0 +1,252 @@
+######################## Plan Application ##########################
+
+# The only place where plans computed by the planner touch the document.
+
+import time
+from krita import QTimer
+from . import profiler
+from .snapshot import correct_clone_bounds, visual_shift
+
+# Batches moving more layers than this are applied in chunks on Qt's event loop
+CHUNKED_THRESHOLD = 1000
+# Time spent moving layers before giving control back to Krita, in seconds
+CHUNK_BUDGET = 0.03
+
+# Chunked batch being applied right now, if any
+running = None
+# Functions called with (done, total, rollback) while a chunked batch progresses
+progress_listeners = []
+# Functions called with (snap, moves) once layers were moved, moves being (uid, x, y)
+move_listeners = []
+
+# Layer types filling the whole canvas
+canvas_sized_types = {"filllayer", "filterlayer"}
+
+
+class MoveBatch:
+	""" Collect target positions of layers and apply them all at once.
+		Every layer moves at most once and layers already in place don't move,
+		then the canvas is refreshed a single time for the whole batch.
+		@param snap: GeometrySnapshot the plans were computed from. """
+
+	def __init__(self, snap):
+		self.snap = snap
+		self.targets = {}  # uid: (x, y), last target wins
+
+		# Layers moved by the last apply()
+		self.moved = 0
+
+	def __len__(self):
+		return len(self.targets)
+
+	def add(self, plan):
+		""" Add a plan to the batch. Later plans override earlier targets.
+			@param plan: List of (uid, x, y) target positions. """
+		targets = self.targets
+		for uid, x, y in plan:
+			targets[uid] = (x, y)
+
+	def pending(self):
+		""" Targets that actually change a layer's position.
+			@return: List of (uid, x, y). """
+		records = self.snap.records
+		return [(uid, x, y) for uid, (x, y) in self.targets.items() if records[uid].position != (x, y)]
+
+	def apply(self, doc=None, chunked=None):
+		""" Move layers into place and refresh the canvas once if anything moved.
+			@param doc: Document to refresh, default None (don't refresh).
+			@param chunked: Move layers a few at a time without blocking Krita,
+				default None (only when there are more than CHUNKED_THRESHOLD).
+			@return: Number of layers moved, or to be moved when chunked. """
+		records = self.snap.records
+		pending = self.pending()
+		# Nothing to redraw when only empty layers moved
+		redraw = changes_pixels(self.snap, pending)
+
+		if chunked is None:
+			chunked = len(pending) > CHUNKED_THRESHOLD
+		if chunked and pending:
+			# Refresh happens once the last chunk is done
+			self.moved = len(pending)
+			self.targets = {}
+			ChunkedMoves(self.snap, pending, doc if redraw else None).start()
+			return self.moved
+
+		profiler.mark("move")
+		for uid, x, y in pending:
+			records[uid].node.move(x, y)
+			# Its groups and clones must be read again if needed
+			self.snap.invalidate(uid)
+		_notify_moved(self.snap, pending)
+
+		self.moved = len(pending)
+		self.targets = {}
+
+		if redraw and doc is not None:
+			profiler.mark("refresh")
+			refresh_document(doc)
+
+		return self.moved
+
+
+class ChunkedMoves:
+	""" Move layers a slice of time at a time from Qt's event loop, so Krita
+		stays responsive while thousands of layers are moved. Can be cancelled,
+		moving back the layers that were already moved.
+		@param snap: GeometrySnapshot the moves were computed from.
+		@param moves: List of (uid, x, y) positions that differ from the current ones.
+		@param doc: Document to refresh at the end, default None.
+		@param rollback: Whether this is undoing a cancelled run, default False. """
+
+	def __init__(self, snap, moves, doc=None, rollback=False):
+		self.snap = snap
+		self.moves = moves
+		self.doc = doc
+		self.rollback = rollback
+		self.done = 0  # Moves applied so far
+
+		# Positions before moving, to go back on cancel
+		records = snap.records
+		self.originals = [] if rollback else [(uid, *records[uid].position) for uid, x, y in moves]
+
+	def start(self):
+		""" Schedule the first chunk. A run already going on is finished first. """
+		global running
+		finish_pending()
+		running = self
+		self._notify()
+		QTimer.singleShot(0, self._step)
+
+	def _step(self):
+		if running is not self:
+			# Cancelled or finished in the meantime
+			return
+
+		deadline = time.perf_counter() + CHUNK_BUDGET
+		if self._move(deadline):
+			self._end()
+		else:
+			self._notify()
+			QTimer.singleShot(0, self._step)
+
+	def _move(self, deadline=None):
+		""" Apply moves until the deadline, or all of them without one.
+			@return: True when every move is done. """
+		records = self.snap.records
+		moves = self.moves
+		count = len(moves)
+		while self.done < count:
+			uid, x, y = moves[self.done]
+			records[uid].node.move(x, y)
+			self.snap.invalidate(uid)
+			self.done += 1
+			if deadline is not None and time.perf_counter() >= deadline:
+				break
+
+		return self.done >= count
+
+	def _end(self):
+		global running
+		running = None
+		self._notify()
+		_notify_moved(self.snap, self.moves[:self.done])
+		if self.done and self.doc is not None:
+			refresh_document(self.doc)
+
+	def _notify(self):
+		for listener in progress_listeners:
+			listener(self.done, len(self.moves), self.rollback)
+
+	def finish(self):
+		""" Apply the remaining moves right away. """
+		if running is self:
+			self._move()
+			self._end()
+
+	def cancel(self):
+		""" Stop moving and move already moved layers back where they were. """
+		global running
+		if running is not self or self.rollback:
+			return
+
+		running = None
+		restore = self.originals[:self.done]
+		restore.reverse()
+		if restore:
+			ChunkedMoves(self.snap, restore, self.doc, rollback=True).start()
+		else:
+			self._notify()
+
+
+def finish_pending():
+	""" Complete the chunked batch being applied, if any, so the document is settled. """
+	if running is not None:
+		running.finish()
+
+
+def cancel_pending():
+	""" Cancel the chunked batch being applied, if any, restoring moved layers. """
+	if running is not None:
+		running.cancel()
+
+
+def _notify_moved(snap, moves):
+	if moves:
+		for listener in move_listeners:
+			listener(snap, moves)
+
+
+def changes_pixels(snap, moves):
+	""" Check if moving layers changes anything on canvas: some moved layer, or
+		clone of one, has pixels. Krita only refreshes the whole canvas, clones
+		that weren't read in the snapshot are redrawn whenever anything else is.
+		@param snap: GeometrySnapshot the moves were computed from.
+		@param moves: List of (uid, x, y) target positions.
+		@return: False when only empty layers move. """
+	records = snap.records
+	# uid: (dx, dy) visual translation
+	shifts = {}
+	for uid, x, y in moves:
+		p = records[uid].position
+		shifts[uid] = (x - p[0], y - p[1])
+
+	# Clones show their source's pixels, they move along with it
+	pending = [records[uid] for uid in shifts]
+	seen = set(shifts)
+	while pending:
+		record = pending.pop()
+		for clone in snap.clones(record):
+			if clone.uid not in seen:
+				seen.add(clone.uid)
+				pending.append(clone)
+
+		dx, dy = visual_shift(snap.records, record, shifts)
+		if not (dx or dy):
+			continue
+		if record.type == "grouplayer":
+			# Groups don't move their children, moved children are in moves
+			continue
+		if record.type in canvas_sized_types:
+			return True
+
+		b = record.bounds
+		if record.type == "clonelayer":
+			b = correct_clone_bounds(b, record.position)
+		if b[2] > 0 and b[3] > 0:
+			return True
+
+	return False
+
+
+def refresh_document(doc):
+	""" Update the canvas after layers were moved.
+		@param doc: Document to refresh. """
+	# Refresh canvas (will lose active layer outline, but it's worth it)
+	doc.refreshProjection()
+	# When using move() on layers with a visible active outline in canvas
+	# the outline won't update with the refresh and the layers themselves
+	# will jump to the previous position once moved manually by the user.
+	# waitForDone() fixes the coordinates problem. How? It's a mystery ~!
+	# It blocks until the refresh is done, but nothing tells which moves are
+	# 	safe without it, so it always runs.
+	doc.waitForDone()
@@ -0,0 +1,107 @@
+######################## Operation Macros ##########################
+
+# Several align and distribute steps run as a single operation. Layers are read
+# 	once, every step is planned from where the previous ones left the layers in
+# 	memory, and only the final positions are applied to the document, with a
+# 	single refresh.
+
+import json
+from krita import Krita
+from . import operators as op
+from . import profiler
+from .applier import finish_pending
+
+# Operators that can be chained, by step name. Snapping isn't, it works with
+# 	the document's edges as they are.
+STEP_OPERATORS = {
+	"align": op.align_nodes,
+	"distribute": op.distribute_nodes,
+	"pack": op.pack_nodes,
+}
+
+
+def step_name(action):
+	""" Name of the step running an operator, None when it can't be chained. """
+	for name, operator in STEP_OPERATORS.items():
+		if operator is action:
+			return name
+	return None
+
+
+def plan_step(snap, doc, step):
+	""" Calculate target positions of a single step.
+		@param snap: GeometrySnapshot of the selection, in the state left by previous steps.
+		@param doc: Document, for the canvas and pixel selection anchors.
+		@param step: (name, mode, params) of the step.
+		@return: List of (uid, x, y) target positions, None when the step does nothing. """
+	name, mode, params = step
+	if name not in STEP_OPERATORS:
+		return None
+	return op.plan_operation(snap, doc, STEP_OPERATORS[name], mode, params)
+
+
+@profiler.profiled("macro")
+def run_macro(name, steps, **params):
+	""" Run several steps as one operation, moving every layer once.
+		@param name: Macro name, for the profiler.
+		@param steps: List of (name, mode, params), see plan_step().
+		@param params: visible True to arrange visible pixels instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds """
+
+	visible = False if "visible" not in params else params["visible"]
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
+
+	app = Krita.instance()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view =  profiler.instrument(app.activeWindow().activeView())
+	selected_nodes = view.selectedNodes()
+
+	if not selected_nodes:
+		return False
+
+	# Read every layer involved only once, the binding is slow
+	snap = op.read_selection(doc, selected_nodes, visible)
+	state = snap.state()
+
+	# --- Plan every step from where the previous ones left layers, in memory
+	for step in steps:
+		plan = plan_step(snap, doc, step)
+		if plan:
+			snap.translate(plan)
+
+	# Final positions of layers that changed, from the state Krita is in
+	plan = [(uid, *record.position) for uid, record in snap.records.items() if record.position != state[uid][1]]
+	snap.restore(state)
+
+	# --- Move layers, their children and clones into place
+	op.apply_plan(snap, plan, doc)
+
+
+def describe(steps):
+	""" Human readable list of steps, for tooltips. """
+	lines = []
+	for name, mode, params in steps:
+		details = ", ".join(f"{key} {value}" for key, value in params.items())
+		lines.append(f"{name} {mode}" + (f" ({details})" if details else ""))
+	return "\n".join(lines)
+
+
+def load():
+	""" Saved macros.
+		@return: dict of name: list of steps """
+	data = Krita.instance().readSetting("", "pluginArrange2.Macros", "") or "{}"
+	try:
+		macros = json.loads(data)
+	except ValueError:
+		# Broken setting, start over
+		return {}
+	return {name: [tuple(step) for step in steps] for name, steps in macros.items()}
+
+
+def save(macros):
+	""" Store macros in Krita settings.
+		@param macros: dict of name: list of steps """
+	Krita.instance().writeSetting("", "pluginArrange2.Macros", json.dumps(macros))
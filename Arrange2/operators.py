@@ -1,54 +1,102 @@
-from krita import Krita, QRect, QPoint
+from krita import Krita
+from .snapshot import GeometrySnapshot, SelectionIndex, CloneGraph, correct_clone_bounds
+from .planner import plan_align, plan_distribute, cluster_spans, plan_overlaps, plan_pack, plan_grid, plan_moves
+from .applier import MoveBatch, finish_pending
+from .pixels import use_visible_bounds, selection_bounds
+from . import profiler
+from . import spatial
+from . import applier
 
 exclusion_list = {"filterlayer", "filllayer"}
 exclusion_list_with_masks = {"filterlayer", "filllayer", "transparencymask", "filtermask", "colorizemask", "transformmask", "selectionmask"}
 masks_list = {"transparencymask", "filtermask", "colorizemask", "transformmask", "selectionmask"}
 
+# Last plan applied: {"snap", "plan", "moved"}, see apply_plan()
+last_applied = None
+# What repeating the last operation needs to skip work, see repeat_operation()
+_repeat = None
+
 
 ######################## Operator Methods ##########################
 
+@profiler.profiled("align")
 def align_nodes(mode="left", **params):
 	""" Align selected layers in a given direction relative to the anchor bounds.
-		The anchor can be a layer, a selection of layers, or the canvas.
+		The anchor can be a layer, a selection of layers, the pixel selection or the canvas.
 		@param mode: Edge to which layers will be aligned, default left.
-		@param params: anchor function to retrieve selected anchor at runtime """
+		@param params: anchor function to retrieve selected anchor at runtime,
+			visible True to align visible pixels instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds """
 
 	anchor = params["anchor"]()
+	visible = False if "visible" not in params else params["visible"]
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
 
 	app = Krita.instance()
-	doc = app.activeDocument()
-	view =  app.activeWindow().activeView()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view =  profiler.instrument(app.activeWindow().activeView())
 
 	selected_nodes = view.selectedNodes()
-	active_node = doc.activeNode()
 	nodes_count = len(selected_nodes)
 
-	# Align requires 1+ layer in canvas mode or 2+ in the other modes
-	if not (anchor == "canvas" or nodes_count > 1):
+	# Align requires 1+ layer in canvas and pixel selection modes or 2+ in the other modes
+	if not (anchor in ("canvas", "selection") or nodes_count > 1):
 		return False
 
-	active_type = active_node.type()
+	# Read every layer involved only once, the binding is slow
+	snap = read_selection(doc, selected_nodes, visible)
+
+	plan = align_plan(snap, doc, mode, anchor)
+	if plan is None:
+		return False
 
-	# Anchor can be the active node, the canvas, or None (average selected nodes positions)
-	if (anchor == "canvas" or active_type in exclusion_list):
+	# --- Move layers, their children and clones into place
+	# 	Layers already in place are skipped, canvas is refreshed once.
+	apply_plan(snap, plan, doc)
+
+
+def align_plan(snap, doc, mode="left", anchor=None):
+	""" Calculate target positions aligning the selected layers of a snapshot.
+		@param snap: GeometrySnapshot of the selection, see read_selection().
+		@param doc: Document, for the canvas and pixel selection anchors.
+		@param mode: Edge to which layers will be aligned, default left.
+		@param anchor: active, canvas, selection or None (selected layers).
+		@return: List of (uid, x, y) target positions, None when there's nothing to align to. """
+	selected_nodes = snap.selection()
+	active_node = snap.active
+	active_type = active_node.type
+
+	profiler.mark("anchor")
+
+	# Anchor can be the active node, the canvas, the pixel selection,
+	# 	or None (average selected nodes positions)
+	if anchor == "selection":
+		''' Anchor is the pixel selection, masking out the area to align to '''
+		rect = selection_bounds(doc)
+		if rect is None:
+			# Nothing selected
+			return None
+	elif (anchor == "canvas" or active_type in exclusion_list):
 		''' Anchor is the canvas or a boundless layer '''
 		# 	Happens with fill, filter layers. Use doc rect instead.
-		anchor = doc
-		rect = anchor.bounds() # Rect for anchoring
+		b = doc.bounds()
+		rect = (b.x(), b.y(), b.width(), b.height()) # Rect for anchoring
 	elif anchor == "active":
 		''' Anchor is the active layer, which should never move '''
 		anchor = active_node
-		anchor_type = anchor.type()
-		rect = anchor.bounds()
+		anchor_type = anchor.type
+		rect = anchor.bounds
 		if anchor_type == "clonelayer":
 			''' The active layer is a clone layer '''
 			# BUG FIX: A hopefully temporary fix for clone layer buggy bounds
-			rect = correct_clone_bounds(anchor, rect)
+			rect = correct_clone_bounds(rect, anchor.position)
 			# Don't remove it from selected nodes because it'll need a position fix
 		elif anchor_type == "grouplayer":
 			''' The active layer is a group layer that could contain clones, must fix rect '''
-			stack = anchor.findChildNodes("", True)
-			rect = calculate_group_bounds(stack)
+			rect = snap.group_bounds(anchor)
 			# Add any possible clones to list of clone layers to be processed
 			# clone_nodes += anchor.findChildNodes("", True, False, "clonelayer")
 			# Don't remove it from selected nodes due possible clone again.
@@ -65,161 +113,105 @@ def align_nodes(mode="left", **params):
 	# --- Retrieve all possible clone layers in selection, sorted by ancestrors
 	# 	and process them after regular layers because otherwise they
 	# 	would move off-position if a source is moved after them.
-	clone_nodes = [x for x in selected_nodes if x.type() == "clonelayer"]
-	# Retrieve clones in groups as well
-	for node in selected_nodes:
-		clone_nodes += node.findChildNodes("", True, False, "clonelayer")
-	# Build a list of all clones and sources to keep track of their movements
-	partial_clones_list = {}
-	for node in clone_nodes:
-		partial_clones_list = get_clone_sources(node, selected_nodes, partial_clones_list, [], 0)
-	clone_nodes = partial_clones_list
+	# Build a graph of all clones and sources to keep track of their movements
+	profiler.mark("clone graph")
+	clone_nodes = CloneGraph(snap, find_clone_nodes(snap, selected_nodes))
 
 	is_moving_clones = bool(len(clone_nodes))
 
-	# --- Loop through selected layers, aligning them
+	# The active layer never moves, neither do its children
+	selection_index = SelectionIndex(snap, selected_nodes + [active_node])
+
+	# --- Loop through selected layers, collecting their bounds
+	profiler.mark("plan")
+	units = []
+	bounds = []
 	for node in selected_nodes:
-		node_type = node.type()
-		parent = node.parentNode()
+		node_type = node.type
 
 		# --- Check for excluding charactertics
-		if node_type == "clonelayer":
-			# Process later
-			continue
-		elif (parent in selected_nodes or parent == active_node or
+		if (selection_index.has_selected_ancestor(node) or
 			node_type in masks_list or
-			node.locked() or
-			not node.visible() or
+			node.locked or
+			not node.visible or
 			node_type in exclusion_list_with_masks):
-			# Don't move nodes when their parents (masks or groups) are also selected.
+			# Don't move nodes when their parents (masks or groups) or any
+			# 	further ancestor are also selected, they move with them.
 			# 	Also skip when their parents are the active node
 			#	(won't be in selection list and will never move).
 			# Never move masks on their own.
 			# Don't move edition locked nodes.
 			# Don't move invisble nodes.
 			# Don't move nodes in unsupported list (fills, filters etc).
-			# Don't move nodes when their parents (masks or groups) are also selected.
 			continue
 
-		# Calculate new position based on align mode and boundaries
-		x, y = calculate_layer_position(mode, rect, node, node_type, is_moving_clones)
-
-		# --- Process masks and layers in groups
-		stack = node.findChildNodes("", True)
-
-		# Node has masks or is a group with children.
-		#  Move them with parent regardless of their visibility.
-		if len(stack) > 0:
-			# Retrieve parent position before move
-			p = node.position()
-			# Calculate translation done by parent
-			translate_x = x - p.x()
-			translate_y = y - p.y()
-
-			for child in stack:
-				if (child.locked()):
-					# Only skip locked layers, move invisible ones
-					continue
-
-				pchild = child.position()
-
-				# --- Repeat translation of parent so they move as one
-				x = pchild.x() + translate_x
-				y = pchild.y() + translate_y
-				child.move(x, y)
-
-				# When there are clones in layer selection check if this child node is a source
-				# 	and if yes, store translation to apply in child clones calculations.
-				if is_moving_clones:
-					uid = child.uniqueId()
-					if uid in clone_nodes:
-						clone_nodes[uid]["move_with_group"] = True
-						b = clone_nodes[uid]["real_bounds"]
-						# Update properties
-						clone_nodes[uid]["position"] = QPoint(x, y)
-						clone_nodes[uid]["real_bounds"] = QRect(
-								b.x() + translate_x,
-								b.y() + translate_y,
-								b.width(),
-								b.height()
-							)
-						clone_nodes[uid]["translation_x"] += translate_x
-						clone_nodes[uid]["translation_y"] += translate_y
-
-		# -- Store translation done by sources of clone layers in selection
-		if is_moving_clones:
-			uid = node.uniqueId()
-			if uid in clone_nodes:
-				p = node.position()
-				clone_nodes[uid]["translation_x"] += x - p.x()
-				clone_nodes[uid]["translation_y"] += y - p.y()
-
-		# --- Finally move current layer into place
-		node.move(x, y)
-
-	# -- Process list of clones in selection by moving them and
-	# 	countering translation of sources so they end in correct position.
-	if is_moving_clones:
-		for uid in clone_nodes:
-			entry = clone_nodes[uid]
-
-			# Skip ancestral nodes. They're not clones and have been already moved
-			if entry["is_ancestral"]:
-				continue
-
-			node = entry["node"]
-
-			# Was already checked for visibility and such when building list,
-			# 	no need for additional checks here.
-
-			# Retrieve target coordinates, using original position when there's
-			# 	none (node is the first or last, not supposed to move).
-			if not entry["move_with_group"]:
-				x, y = calculate_layer_position(mode, rect, entry, "clonelayer")
-			else:
-				x = entry["position"].x()
-				y = entry["position"].y()
-
-			# Calculate sources movements. This node must make the inverse
-			# 	translation to remain in place and make use of the calculated co.
-			translation_x = 0
-			translation_y = 0
-
-			for source_uid in entry["ancestors"]:
-				translation_x += clone_nodes[source_uid]["translation_x"]
-				translation_y += clone_nodes[source_uid]["translation_y"]
+		if node_type == "clonelayer":
+			# BUG FIX: Use fixed bounds calculated before any movement happend.
+			# 	Because sometimes the doc updates bounds in the middle
+			# 	of math (breaking formulas!), sometimes it doesn't.
+			b = clone_nodes[node.uid]["real_bounds"]
+		elif is_moving_clones and node_type == "grouplayer":
+			# BUG FIX: Fix bounds of groups with clone children >(
+			b = snap.group_bounds(node)
+		else:
+			b = node.bounds
 
-			# --- Move any masks with clone node
-			p = entry["position"]
-			move_masks_with_node(node, x - p.x(), y - p.y())
+		units.append(node)
+		bounds.append(b)
 
-			# --- Move clone layer
-			x = x - translation_x
-			y = y - translation_y
-			node.move(x, y)
+	# Calculate new positions based on align mode and boundaries
+	targets = plan_align(mode, rect, bounds, [node.position for node in units])
 
-			# Take note of movement to apply to clones of this if needed
-			clone_nodes[uid]["translation_x"] += x - p.x()
-			clone_nodes[uid]["translation_y"] += y - p.y()
+	translations = {}
+	for node, (x, y) in zip(units, targets):
+		p = node.position
+		translations[node.uid] = (x - p[0], y - p[1])
 
-	# Refresh canvas (will lose active layer outline, but it's worth it)
-	doc.refreshProjection()
-	# When using move() on layers with a visible active outline in canvas
-	# the outline won't update with the refresh and the layers themselves
-	# will jump to the previous position once moved manually by the user.
-	# waitForDone() fixes the coordinates problem. How? It's a mystery ~!
-	doc.waitForDone()
+	return plan_moves(snap, units, translations, clone_nodes)
 
 
+@profiler.profiled("distribute")
 def distribute_nodes(placement="horizontal", **params):
 	""" Distribute selected layers in a given direction and spacing mode.
-		@param placement: horizontal or vertical, default horizontal.
-		@param params: spacing (only zero for now) when doing edge-to-edge """
+		@param placement: horizontal or vertical, default horizontal,
+			or grid to place layers in uniform cells.
+		@param params: spacing (only zero for now) when doing edge-to-edge,
+			columns or rows of the grid, default about as many of each,
+			gutter between grid cells, default 0,
+			clusters True to distribute every row or column of layers on its own,
+			overlaps True to only push apart overlapping layers, spacing being
+			the minimum gap between them then,
+			visible True to distribute visible pixels instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds """
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
 
 	app = Krita.instance()
-	doc = app.activeDocument()
-	view =  app.activeWindow().activeView()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view =  profiler.instrument(app.activeWindow().activeView())
 	selected_nodes = view.selectedNodes()
+	visible = False if "visible" not in params else params["visible"]
+
+	# Read every layer involved only once, the binding is slow
+	snap = read_selection(doc, selected_nodes, visible)
+
+	plan = distribute_plan(snap, placement, **params)
+	if plan is None:
+		return
+
+	# --- Move layers, their children and clones into place
+	# 	Layers already in place are skipped, canvas is refreshed once.
+	apply_plan(snap, plan, doc)
+
+
+def distribute_plan(snap, placement="horizontal", **params):
+	""" Calculate target positions distributing the selected layers of a snapshot.
+		@param snap: GeometrySnapshot of the selection, see read_selection().
+		@param placement: Same as distribute_nodes().
+		@param params: Same as distribute_nodes(), but visible.
+		@return: List of (uid, x, y) target positions, None when there are too few layers. """
 
 	# Derive movement axis from placement
 	axis = "vertical" if placement in ("top", "bottom", "v_center", "vertical", "vertical_zero") else "horizontal"
@@ -228,325 +220,526 @@ def distribute_nodes(placement="horizontal", **params):
 	# Set spacing mode for new zero spacing (edge-to-edge) mode
 	spacing = None if "spacing" not in params else params["spacing"]
 	reverse = False if "reverse" not in params else params["reverse"]
-	backwards = False
-	center = False
+	overlaps = False if "overlaps" not in params else params["overlaps"]
+	columns = None if "columns" not in params else params["columns"]
+	rows = None if "rows" not in params else params["rows"]
+	gutter = 0 if "gutter" not in params else params["gutter"]
+	clusters = False if "clusters" not in params else params["clusters"]
+
+	if placement == "grid":
+		# Grids fill rows from the left, or columns from the top when given rows
+		axis = "vertical" if rows and not columns else "horizontal"
 
 	# Trim incompatible types from list
-	selected_nodes = [node for node in selected_nodes if node.type() not in exclusion_list_with_masks]
+	selected_nodes = [node for node in snap.selection() if node.type not in exclusion_list_with_masks]
 
 	# List of relevant nodes properties sorted by x, y positions. Layers are
 	# 	already checked for visibility, locked status and type and removed here.
 	# Structure: [ (x, width) ] or [ (y, height) ]
-	nodes_props = sort_selected_layers_positions(selected_nodes, axis)
+	profiler.mark("sort")
+	nodes_props = sort_selected_layers_positions(snap, selected_nodes, axis)
 
 	nodes_count = len(nodes_props)
 
-	if nodes_count < 2 or nodes_count < 3 and placement != "gaps":
+	if nodes_count < 2 or nodes_count < 3 and placement not in ("gaps", "grid"):
 		# Must have at least 3 layers to perform any kind of distribution
-		# 	or 2 when doing edge-to-edge.
+		# 	or 2 when doing edge-to-edge or grids.
 		return
 
 	# --- Build list of clone nodes
-	clone_nodes = [x for x in selected_nodes if x.type() == "clonelayer"]
-	# Retrieve clones in groups as well
-	for node in selected_nodes:
-		clone_nodes += node.findChildNodes("", True, False, "clonelayer")
-	partial_clones_list = {}
-	for node in clone_nodes:
-		partial_clones_list = get_clone_sources(node, selected_nodes, partial_clones_list, [], 0)
-	clone_nodes = partial_clones_list
+	profiler.mark("clone graph")
+	clone_nodes = CloneGraph(snap, find_clone_nodes(snap, selected_nodes))
+
+	# --- Calculate new coordinates along the axis
+	profiler.mark("plan")
+	units = [selected_nodes[prop["idx"]] for o, prop in nodes_props]
+	if placement == "grid":
+		# Both axes move, rebuild the rects of layers in sorted order
+		rects = []
+		for o, prop in nodes_props:
+			if axis == "horizontal":
+				rects.append((prop["bounds"], prop["alt_bounds"], prop["size"], prop["alt_size"]))
+			else:
+				rects.append((prop["alt_bounds"], prop["bounds"], prop["alt_size"], prop["size"]))
+		corners = plan_grid([(r[2], r[3]) for r in rects], columns, rows, gutter)
+
+		# Grid starts at the top left of the selection
+		origin_x = min(r[0] for r in rects)
+		origin_y = min(r[1] for r in rects)
+		translations = {}
+		for node, r, (x, y) in zip(units, rects, corners):
+			translations[node.uid] = (origin_x + x - r[0], origin_y + y - r[1])
+
+		return plan_moves(snap, units, translations, clone_nodes)
+
+	# Layers distributed together. When clustering, layers overlapping on the
+	# 	other axis form rows (or columns) and each one is distributed on its own.
+	groups = [list(range(nodes_count))]
+	if clusters and not overlaps:
+		groups = cluster_spans([(prop["alt_bounds"], prop["alt_size"]) for o, prop in nodes_props])
+		profiler.note(f"{len(groups)} {'rows' if axis == 'horizontal' else 'columns'}")
+
+	translations = {}
+	for group in groups:
+		if len(group) < 2 or len(group) < 3 and placement != "gaps":
+			# Same minimums as the whole selection, smaller rows stay in place
+			continue
 
-	is_moving_clones = bool(len(clone_nodes))
+		props = [nodes_props[idx][1] for idx in group]
+		if overlaps:
+			# Sweep through layers in order, only moving those overlapping others
+			targets = plan_overlaps(
+				[prop["bounds"] for prop in props],
+				[prop["size"] for prop in props],
+				[prop["position"] for prop in props],
+				[(prop["alt_bounds"], prop["alt_size"]) for prop in props],
+				spacing or 0
+			)
+		else:
+			targets = plan_distribute(
+				placement,
+				[prop["bounds"] for prop in props],
+				[prop["size"] for prop in props],
+				[prop["position"] for prop in props],
+				spacing,
+				reverse
+			)
+
+		for idx, prop, co in zip(group, props, targets):
+			if axis == "horizontal":
+				translations[units[idx].uid] = (co - prop["position"], 0)
+			else:
+				translations[units[idx].uid] = (0, co - prop["position"])
+	# Layers of rows too small to distribute don't move
+	units = [node for node in units if node.uid in translations]
 
-	start_co = nodes_props[0][1]["bounds"]  # Coord of first element
-	end_co = nodes_props[-1][1]["bounds"]  # Left edge
-
-	# --- Calculate spacing of nodes
-	# Get combined width or height of elements only, ignoring gaps
-	combined_size = 0
-	for entry in nodes_props:
-		combined_size += entry[1]["size"]
-
-	# Skip first and last elements. They don't need to be moved unless spaces will be removed.
-	# 	When removing spaces in edge-to-edge modedecide which node to skip (first or last)
-	# 	based on direction.
-	nodes_range = (nodes_props[:-1] if reverse else nodes_props[1:]) if spacing is not None else nodes_props[1:-1]
-
-	# Determine correct spacing based on aligning by fixed spacing size or edges
-	if placement == "gaps":
-		''' Move nodes so their edges touch (method supports custom even spacing too, it's just 0 here) '''
-		end_co += nodes_props[-1][1]["size"]  # Takes fill combined width into account
-		# Space that will be either just removed from between nodes so they align left/top
-		# 	or will be removed then added to the start to align them to the right/bottom.
-		excess_space = abs(end_co - start_co) - combined_size
-		# Spacing = predetermined spacing or escess of space / nodes - 1 (number of gaps)
-		spacing = spacing if spacing is not None else round(excess_space / (len(nodes_props)-1))
-
-		# Either add width of first node when skipping it (align left/top) or
-		# 	the space that was removed from the end when aligning to rigth/bottom.
-		initial_padding = nodes_props[0][1]["size"] if not reverse else excess_space
-
-		next_co = start_co + initial_padding + spacing
-	elif placement in ("left", "top"):
-		''' Evenly distribute space while aligning by edges, default direction '''
-		# Align by edge = Total width - last el width / number of nodes - 1
-		spacing = round(abs(end_co - start_co) / (len(nodes_props) - 1))
-		next_co = start_co + spacing
-	elif placement in ("right", "bottom"):
-		''' Evenly distribute space while aligning by edges, default reversed direction '''
-		# Coordinates calculation happens backwards in this case
-		backwards = True
-		# Full width of combined elements
-		total_width = (end_co + nodes_props[-1][1]["size"]) - start_co
-		# Working width for co calculation disregards first element
-		working_width = total_width - nodes_props[0][1]["size"]
-		# Spacing is working width / len - 1
-		spacing = round(working_width / (len(nodes_props) - 1))
-
-		# Starting coodinate is total width - working width
-		start_co += total_width - working_width
-
-		next_co = start_co + spacing
-	else:
-		''' Evenly distribute space, aligned by centers '''
-		center = True
-
-		# The total width coords will start at the half width of
-		# first element and end at half width of last
-		# It starts in the middle of the first node
-		start_co += nodes_props[0][1]["size"]/2
-		# And ends in the middle of the last
-		end_co += nodes_props[-1][1]["size"]/2
-
-		# Spacing = total width (from centers) /  number of nodes -1
-		spacing = round(abs(end_co - start_co) / (len(nodes_props)-1))
-		# Spacing is between centers here, hence to x/y
-		# you need to subtract half width
-		next_co = start_co + spacing
-
-	# Initialize coordinates with position of first element
-	co = start_co
-
-	# --- Move nodes
-	for entry in nodes_range:
-		o, prop = entry
-		p = prop["position"]
-		b = prop["bounds"]
-		rel_pos = b - p
-		idx = prop["idx"]
-		alt_p = prop["alt_position"]
-		size = prop["size"]
-
-		# --- Get node...
-		node = selected_nodes[idx]
-		node_type = node.type()
-		parent = node.parentNode()
+	return plan_moves(snap, units, translations, clone_nodes)
 
-		# --- Check for excluding charactertics
-		# Explicitly exlude clone layers from this check
 
-		# Already performed visbility etc checks in sort_selected_layers_positions()
-		if node_type != "clonelayer" and (parent in selected_nodes or
-			# node_type in relative_layers_list or
-			node_type in masks_list or
-			node.locked() or
-			not node.visible() or
+@profiler.profiled("pack")
+def pack_nodes(width=None, **params):
+	""" Pack selected layers into a compact sheet, like a contact sheet or a
+		sprite atlas. The sheet starts at the top left of the selection.
+		@param width: Width of the sheet in pixels, default None (about square).
+		@param params: padding between layers in pixels, default 0,
+			visible True to pack visible pixels instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds """
+
+	padding = 0 if "padding" not in params else params["padding"]
+	visible = False if "visible" not in params else params["visible"]
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
+
+	app = Krita.instance()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view =  profiler.instrument(app.activeWindow().activeView())
+	selected_nodes = view.selectedNodes()
+
+	if len(selected_nodes) < 2:
+		return False
+
+	# Read every layer involved only once, the binding is slow
+	snap = read_selection(doc, selected_nodes, visible)
+
+	plan = pack_plan(snap, width, padding)
+	if plan is None:
+		return False
+
+	# --- Move layers, their children and clones into place
+	apply_plan(snap, plan, doc)
+
+
+def pack_plan(snap, width=None, padding=0):
+	""" Calculate target positions packing the selected layers of a snapshot into a sheet.
+		@param snap: GeometrySnapshot of the selection, see read_selection().
+		@param width: Width of the sheet in pixels, default None (about square).
+		@param padding: Space between layers in pixels, default 0.
+		@return: List of (uid, x, y) target positions, None when there are too few layers. """
+	selected_nodes = snap.selection()
+
+	# --- Collect layers packed as a whole
+	selection_index = SelectionIndex(snap, selected_nodes)
+	units = []
+	bounds = []
+	for node in selected_nodes:
+		node_type = node.type
+		if (selection_index.has_selected_ancestor(node) or
+			node.locked or
+			not node.visible or
 			node_type in exclusion_list_with_masks):
-			# Don't move nodes when their parents (masks or groups) are also selected.
-			# Never move masks on their own.
-			# Don't move edition locked nodes.
-			# Don't move invisble nodes.
-			# Don't move nodes in unsupported list (fills, filters etc).
-			# Only ever move a mask with its parent, never by itself.
+			# Same exclusions as aligning
 			continue
 
-		# Adjust position relative to target
-		# position determined by previous element
-		co = next_co - rel_pos
-
-		if backwards:
-			# When spacing something backwards (right, bottom),
-			# discount their full width/height
-			co -= size
-		elif center:
-			# Spacing is between centers here, hence to x/y
-			# you need to subtract half width
-			co = round(co - size / 2)
-
-		# Prepare next position
-		if placement == "gaps":
-			next_co += size + spacing
+		if node_type == "clonelayer":
+			b = correct_clone_bounds(node.bounds, node.position)
+		elif node_type == "grouplayer":
+			b = snap.group_bounds(node)
 		else:
-			next_co += spacing
+			b = node.bounds
 
-		# --- Only run clone check to skip here because we need to store coords
-		if node_type == "clonelayer":
-			# Store target position in dict but don't move yet.
-			uid = node.uniqueId()
-			clone_nodes[uid]["p"] = p
-			clone_nodes[uid]["alt_p"] = alt_p
-			clone_nodes[uid]["co"] = co  # Relative move...
+		if b[2] <= 0 or b[3] <= 0:
+			# Nothing to pack in empty layers
 			continue
+		units.append(node)
+		bounds.append(b)
 
-		# --- Process masks and layers in groups
-		stack = node.findChildNodes("", True)
+	if len(units) < 2:
+		return None
 
-		# Node has masks or is a group with children.
-		# Move them with parent regardless of their visibility.
-		if len(stack) > 0:
-			# Calculate translation done by parent
-			if axis == "horizontal":
-				translate_x = co - p
-				translate_y = 0
-			else:
-				translate_x = 0
-				translate_y = co - p
-
-			for child in stack:
-				if (child.locked()):
-					# Only skip locked layers, move invisible ones
-					continue
-
-				pchild = child.position()
-
-				# --- Repeat translation of parent so they move as one
-				x = pchild.x() + translate_x
-				y = pchild.y() + translate_y
-				# Move child the same amount parent moves
-				child.move(x, y)
-
-				# When there are clones in layer selection check if this child node is a source
-				# 	and if yes, store translation to apply in child clones calculations.
-				if is_moving_clones:
-					uid = child.uniqueId()
-					if uid in clone_nodes:
-						clone_nodes[uid]["move_with_group"] = True
-						b = clone_nodes[uid]["real_bounds"]
-						# Update properties
-						clone_nodes[uid]["position"] = QPoint(x, y)
-						clone_nodes[uid]["real_bounds"] = QRect(
-								b.x() + translate_x,
-								b.y() + translate_y,
-								b.width(),
-								b.height()
-							)
-						clone_nodes[uid]["translation"] += translate_x if axis == "horizontal" else translate_y
-
-		# When there are clones to be moved check if this node is a source
-		# 	and if yes, store translation to apply in child clones calculations.
-		if is_moving_clones:
-			uid = node.uniqueId()
-			if uid in clone_nodes:
-				clone_nodes[uid]["translation"] = co - p
-
-		# --- Move node into place
-		if axis == "horizontal":
-			node.move(co, alt_p)
+	profiler.mark("clone graph")
+	clone_nodes = CloneGraph(snap, find_clone_nodes(snap, selected_nodes))
+
+	# --- Place every layer in the sheet
+	profiler.mark("plan")
+	origin_x = min(b[0] for b in bounds)
+	origin_y = min(b[1] for b in bounds)
+	corners = plan_pack([(b[2], b[3]) for b in bounds], width, padding)
+
+	translations = {}
+	for node, b, (x, y) in zip(units, bounds, corners):
+		translations[node.uid] = (origin_x + x - b[0], origin_y + y - b[1])
+
+	return plan_moves(snap, units, translations, clone_nodes)
+
+
+@profiler.profiled("snap")
+def snap_nodes(axis="both", **params):
+	""" Move selected layers together until one of their edges meets the nearest
+		edge of another layer or the canvas.
+		@param axis: horizontal, vertical or both, default both.
+		@param params: reach maximum distance to snap in pixels, default any,
+			visible True to snap visible pixels instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds """
+
+	reach = None if "reach" not in params else params["reach"]
+	visible = False if "visible" not in params else params["visible"]
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
+
+	app = Krita.instance()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view =  profiler.instrument(app.activeWindow().activeView())
+	selected_nodes = view.selectedNodes()
+
+	if not selected_nodes:
+		return False
+
+	# Read every layer involved only once, the binding is slow
+	snap = read_selection(doc, selected_nodes, visible)
+	selected_nodes = snap.selection()
+
+	# --- Edges of the whole document, only read on first use
+	profiler.mark("index")
+	index = spatial.document_index(doc)
+	# Selected layers may have been moved by hand since
+	index.sync(snap)
+	if index.outdated:
+		# Layers were added since the document was read
+		index = spatial.document_index(doc)
+	profiler.note(f"{len(index.rects)} layers indexed")
+
+	# --- Collect layers moving as a whole and their combined bounds
+	profiler.mark("plan")
+	selection_index = SelectionIndex(snap, selected_nodes)
+	units = []
+	inf = float('inf')
+	x, y, x_out, y_out = inf, inf, -inf, -inf
+	for node in selected_nodes:
+		node_type = node.type
+		if (selection_index.has_selected_ancestor(node) or
+			node.locked or
+			not node.visible or
+			node_type in exclusion_list_with_masks):
+			# Same exclusions as aligning
+			continue
+
+		if node_type == "clonelayer":
+			b = correct_clone_bounds(node.bounds, node.position)
+		elif node_type == "grouplayer":
+			b = snap.group_bounds(node)
 		else:
-			node.move(alt_p, co)
-
-	# --- Process clone layers after their parents already were moved
-	if is_moving_clones:
-		# Retrieve first and/or last nodes positions when they're clones and
-		# 	not supposed to move because they'll not have been saved in loop above.
-		if nodes_props[0][1]["type"] == "clonelayer":
-			''' First node '''
-			# Get properties of first node
-			o, prop = nodes_props[0]
-			# Find index @ selected_nodes and retrieve node
-			node = selected_nodes[prop["idx"]]
-			# So uid can be found to select correct node in clone lists
-			entry = clone_nodes[node.uniqueId()]
-
-			entry["p"] = prop["position"]
-			# Sometimes co will have been saved when working with gaps
-			# 	and it'll not be the original position.
-			entry["co"] = entry.get("co", entry["p"])
-			entry["alt_p"] = prop["alt_position"]
-
-		if nodes_props[-1][1]["type"] == "clonelayer":
-			''' Last node '''
-			o, prop = nodes_props[-1]
-			node = selected_nodes[prop["idx"]]
-			entry = clone_nodes[node.uniqueId()]
-
-			entry["p"] = prop["position"]
-			entry["co"] = entry.get("co", entry["p"])
-			entry["alt_p"] = prop["alt_position"]
-
-		for uid in clone_nodes:
-			entry = clone_nodes[uid]
-
-			# Skip ancestral nodes. They're not clones and have been already moved.
-			if entry["is_ancestral"]:
-				continue
-
-			node = entry["node"]
-
-			# Was already checked for visibility and such when building list,
-			# 	no need for additional checks here.
-
-			# A non-selected source or child in group won't have a target co,
-			# 	they should only have their original positions restored.
-			if "co" not in entry:
-				if axis == "horizontal":
-					entry["p"] = entry["co"] = entry["position"].x()
-					entry["alt_p"] = entry["position"].y()
-				else:
-					entry["p"] = entry["co"] = entry["position"].y()
-					entry["alt_p"] = entry["position"].x()
-
-
-			co = entry["co"]
-			alt_p = entry["alt_p"]
-
-			# Calculate sources movements. This node must make the inverse
-			# 	translation to remain in place and make use of the calculated co.
-			translation = 0
-
-			for source_uid in entry["ancestors"]:
-				# translation += clone_nodes[source_uid]["translation"] if source_uid in clone_nodes else 0
-				translation += clone_nodes[source_uid]["translation"]
-
-
-			# Apply sources' translations to node movement
-			co = co - translation
-			translation_x = translation_y = 0
-			if axis == "horizontal":
-				x = co
-				y = alt_p
-				translation_x += translation
-			else:
-				x = alt_p
-				y = co
-				translation_y += translation
+			b = node.bounds
+
+		units.append(node)
+		if b[2] > 0 and b[3] > 0:
+			x = min(x, b[0])
+			y = min(y, b[1])
+			x_out = max(x_out, b[0] + b[2])
+			y_out = max(y_out, b[1] + b[3])
+
+	if not units or x_out < x:
+		return False
 
-			# --- Move any masks with clone node
-			translation_x += x - entry["position"].x()
-			translation_y += y - entry["position"].y()
-			move_masks_with_node(node, translation_x, translation_y)
+	# Edges of what's moving don't count, neither do groups holding it
+	exclude = index.related(units)
 
-			# --- Move clone
-			node.move(x, y)
+	translation = [0, 0]
+	for i, (key, start, end) in enumerate((("x", x, x_out), ("y", y, y_out))):
+		if axis != "both" and axis != ("horizontal", "vertical")[i]:
+			continue
+		found = index.find(key, (start, end), exclude, reach)
+		if found is not None:
+			distance, co, edge, uid = found
+			translation[i] = edge - co
+
+	translations = {node.uid: tuple(translation) for node in units}
+
+	clone_nodes = CloneGraph(snap, find_clone_nodes(snap, selected_nodes))
+
+	# --- Move layers, their children and clones into place
+	apply_plan(snap, plan_moves(snap, units, translations, clone_nodes), doc)
+
+
+def plan_operation(snap, doc, action, mode, params):
+	""" Calculate target positions of an operation from a snapshot, reading and
+		moving nothing. Snapping has no plan, it works with the document's edges
+		as they are.
+		@param snap: GeometrySnapshot of the selection, see read_selection().
+		@param doc: Document, for the canvas and pixel selection anchors.
+		@param action: Operator, like align_nodes.
+		@param mode: Operator mode, its first argument.
+		@param params: Operator parameters, the anchor being its value, not a function.
+		@return: List of (uid, x, y) target positions, None when there's nothing to do. """
+	if action is align_nodes:
+		anchor = None if "anchor" not in params else params["anchor"]
+		return align_plan(snap, doc, mode, anchor)
+	elif action is distribute_nodes:
+		return distribute_plan(snap, mode, **params)
+	elif action is pack_nodes:
+		padding = 0 if "padding" not in params else params["padding"]
+		return pack_plan(snap, mode, padding)
+	return None
+
+
+# Operators plan_operation() can plan
+planned_operators = (align_nodes, distribute_nodes, pack_nodes)
+
+
+######################## Repeat Last Operation ##########################
+
+def repeat_operation(action, mode, **params):
+	""" Run an operation again on the current selection, skipping as much work as
+		possible when the selection and its geometry didn't change:
+		- Where the last run left it: nothing would move, nothing is done.
+		- Where the last run found it (cancelled or moved back): the cached
+		snapshot and plan are applied again, without reading nor planning.
+		Otherwise the operation runs as usual, and always when it uses visible
+		pixels: painting changes them without moving any layer.
+		@param action: Operator, like align_nodes.
+		@param mode: Operator mode, its first argument.
+		@param params: Operator parameters. """
+	global _repeat, last_applied
+
+	# Layers still moving from a previous operation must be in place first
+	finish_pending()
+
+	if "visible" in params and params["visible"]:
+		# Nothing cheap tells if pixels changed, same as speculative.poll()
+		_repeat = None
+		action(mode, **params)
+		return
 
-			# Take note of movement to apply to clones of this if needed
-			clone_nodes[uid]["translation"] += co - entry["p"]
+	app = Krita.instance()
+	doc = app.activeDocument()
+	view = app.activeWindow().activeView()
 
-	# Refresh canvas (will lose active layer outline, but it's worth it)
-	doc.refreshProjection()
-	# When using move() on layers with a visible active outline in canvas
-	# the outline won't update with the refresh and the layers themselves
-	# will jump to the previous position once moved manually by the user.
-	# waitForDone() fixes the coordinates problem. How? It's a mystery ~!
-	doc.waitForDone()
+	key = operation_key(action, mode, params)
+	anchor = key[3]
+	selected_nodes = view.selectedNodes()
+
+	if _repeat is not None and _repeat["key"] == key:
+		# Every layer the cached plan reads or moves, as it is now
+		fingerprint = snapshot_fingerprint(_repeat["snap"], doc, anchor, selected_nodes)
+		if _repeat["settled"] == fingerprint:
+			# Already arranged
+			return
+		if _repeat["before"] == fingerprint and _repeat["plan"]:
+			# Same layers where the cached plan was computed from
+			apply_plan(_repeat["snap"], _repeat["plan"], doc)
+			_moved_by_repeat(doc, selected_nodes)
+			return
+
+	last_applied = None
+	action(mode, **params)
+
+	applied = last_applied
+	if applied is None:
+		# Nothing was read, nothing to compare with next time
+		_repeat = None
+		return
+
+	snap = applied["snap"]
+	# Nothing moved yet, the snapshot still has the layers as they were
+	fingerprint = snapshot_fingerprint(snap, doc, anchor)
+	if not applied["moved"]:
+		# Nothing moved, the layers are already where this operation puts them
+		_repeat = {"key": key, "settled": fingerprint, "before": None, "snap": snap, "plan": None}
+	else:
+		_repeat = {
+			"key": key,
+			"settled": None,
+			"before": fingerprint,
+			"snap": snap,
+			"plan": applied["plan"],
+			"action": action,
+			"mode": mode,
+			"params": params,
+		}
+		_moved_by_repeat(doc, selected_nodes)
+
+
+def _moved_by_repeat(doc, selected_nodes):
+	""" Settle the repeated operation once its layers are in place, right away
+		or when the last chunk of a chunked batch is moved. """
+	_repeat["settled"] = None
+	_repeat["moving"] = applier.running
+	_repeat["doc"] = doc
+	_repeat["selected"] = selected_nodes
+	if applier.running is None:
+		_settle()
+
+
+def _repeat_progress(done, total, rollback):
+	if _repeat is None or _repeat["settled"] is not None or applier.running is not None:
+		return
+	batch = _repeat.get("moving")
+	if batch is None:
+		return
+	_repeat["moving"] = None
+	if not batch.rollback and batch.done >= len(batch.moves):
+		# Cancelled batches stay where they were found, "before" still applies
+		_settle()
+
+
+def _settle():
+	""" Remember where the operation left layers, so repeating it right away does
+		nothing. Only when planning again from the snapshot moved in memory
+		wouldn't move anything: grids may order cells differently, centers may
+		round the other way... Snapping has no plan to check, it runs again. """
+	r = _repeat
+	if r["action"] not in planned_operators:
+		return
+
+	params = dict(r["params"])
+	anchor = r["key"][3]
+	if "anchor" in params:
+		params["anchor"] = anchor
+
+	snap = r["snap"]
+	state = snap.state()
+	snap.translate(r["plan"])
+	again = plan_operation(snap, r["doc"], r["action"], r["mode"], params)
+	records = snap.records
+	moves_again = again and any(records[uid].position != (x, y) for uid, x, y in again)
+	snap.restore(state)
+
+	if not moves_again:
+		r["settled"] = snapshot_fingerprint(snap, r["doc"], anchor, r["selected"])
+
+
+def operation_key(action, mode, params):
+	""" Identify an operation run with given parameters.
+		@param action: Operator, like align_nodes.
+		@param mode: Operator mode, its first argument.
+		@param params: Operator parameters, the anchor function is read now.
+		@return: (operator name, mode, parameters, anchor) hashable tuple. """
+	# Anchors are functions read at runtime, what matters is their value now
+	anchor = params["anchor"]() if "anchor" in params else None
+	return (action.__name__, repr(mode), repr(sorted((k, v) for k, v in params.items() if k != "anchor")), anchor)
+
+
+def snapshot_fingerprint(snap, doc, anchor=None, selected_nodes=None):
+	""" Summary of everything a plan computed from a snapshot depends on or moves:
+		the selected and active layers with their bounds, the position, visibility
+		and lock of every layer read with them (descendants of selected groups,
+		clones and clone sources included), the canvas and the anchor's geometry.
+		@param snap: GeometrySnapshot the plan was computed from.
+		@param doc: Document holding the layers.
+		@param anchor: Anchor of the operation, default None.
+		@param selected_nodes: Selected layers to read everything from Krita now,
+			default None (the layers as read in the snapshot).
+		@return: tuple, equal when the plan is still right. """
+	if selected_nodes is None:
+		selected = tuple((record.uid, *record.bounds) for record in snap.selected)
+		active = snap.active
+		if active is not None:
+			active = (active.uid, *active.bounds)
+		layers = tuple((uid, *record.position, record.visible, record.locked) for uid, record in snap.records.items())
+	else:
+		selected = []
+		for node in selected_nodes:
+			b = node.bounds()
+			selected.append((node.uniqueId(), b.x(), b.y(), b.width(), b.height()))
+		selected = tuple(selected)
+
+		active = doc.activeNode()
+		if active is not None:
+			# The active layer may be the anchor without being selected
+			b = active.bounds()
+			active = (active.uniqueId(), b.x(), b.y(), b.width(), b.height())
+
+		layers = []
+		for uid, record in snap.records.items():
+			node = record.node
+			p = node.position()
+			# Hidden and locked layers don't move
+			layers.append((uid, p.x(), p.y(), node.visible(), node.locked()))
+		layers = tuple(layers)
+
+	b = doc.bounds()
+	anchor_rect = selection_bounds(doc) if anchor == "selection" else None
+
+	return (
+		selected,
+		active,
+		(b.x(), b.y(), b.width(), b.height()),
+		anchor_rect,
+		layers,
+	)
 
 
 ######################## Operator Utils ##########################
 
+def read_selection(doc, selected_nodes, visible=False):
+	""" Read selected layers and the active layer once, for planning.
+		@param doc: Document holding the layers.
+		@param selected_nodes: List of selected layers.
+		@param visible: True to use visible pixels bounds instead of layer bounds,
+			or "estimate" for fast approximate visible pixels bounds, default False.
+		@return: GeometrySnapshot """
+	profiler.mark("snapshot")
+	snap = GeometrySnapshot(selected_nodes, doc.activeNode())
+	if visible:
+		profiler.mark("pixels")
+		report = use_visible_bounds(snap, estimate=(visible == "estimate"))
+		profiler.note(f"{report['scanned']} visible bounds, {'exact' if report['exact'] else 'estimated'}")
+
+	return snap
+
+
+def apply_plan(snap, plan, doc):
+	""" Move layers to their planned positions in a single batch.
+		Layers already in place are skipped, canvas is refreshed once.
+		@param snap: GeometrySnapshot the plan was computed from.
+		@param plan: List of (uid, x, y) target positions.
+		@param doc: Document to refresh. """
+	global last_applied
+	# Reading and planning are done
+	profiler.note(f"{len(snap.records)} layers read in {snap.binding_calls} binding calls, {snap.served} reads served from memory instead")
+	batch = MoveBatch(snap)
+	batch.add(plan)
+	moved = batch.apply(doc)
+	last_applied = {"snap": snap, "plan": plan, "moved": moved}
+
+
 def calculate_group_bounds(stack):
 	""" Calculate bounds of group of layers in stack, correcting for clones bounds.
-		@param stack list of layers.
-		@return QRect bounds of group of layers. """
+		@param stack list of layer records.
+		@return (x, y, width, height) bounds of group of layers. """
 	# Dummy values for comparisions
 	inf = float('inf')
 	rect = {
@@ -555,24 +748,24 @@ def calculate_group_bounds(stack):
 	}
 
 	for node in stack:
-		node_type = node.type()
+		node_type = node.type
 		if node_type in exclusion_list_with_masks:
 			# Skip masks and boundless layer types (fill, filter, ...)
 			# 	They don't have dimensions to contribute to size.
 			continue
 
 		# BUG FIX: A hopefully temporary fix for clone layer buggy bounds.
-		b = node.bounds() if node_type != "clonelayer" else correct_clone_bounds(node, node.bounds(), node.position())
+		b = node.bounds if node_type != "clonelayer" else correct_clone_bounds(node.bounds, node.position)
 
 		# Starting coordinates will be the lowest x/y
-		rect["x"] = min(rect["x"], b.x())
-		rect["y"] = min(rect["y"], b.y())
+		rect["x"] = min(rect["x"], b[0])
+		rect["y"] = min(rect["y"], b[1])
 		# Get outer bounds by comparing right/bottom edges of elements
-		rect["x_out"] = max(rect["x_out"], b.x() + b.width())
-		rect["y_out"] = max(rect["y_out"], b.y() + b.height())
+		rect["x_out"] = max(rect["x_out"], b[0] + b[2])
+		rect["y_out"] = max(rect["y_out"], b[1] + b[3])
 
 	# Build boundaries, subtracting positional coords from width and height
-	rect = QRect(
+	rect = (
 		rect["x"],
 		rect["y"],
 		rect["x_out"] - rect["x"],
@@ -582,55 +775,10 @@ def calculate_group_bounds(stack):
 	return rect
 
 
-def calculate_layer_position(mode, rect, node, node_type=None, contains_clones=False):
-	""" Calculate given a node new position relative to rect.
-		@param mode Direction of alignment.
-		@param rect QRect to which layers will be aligned.
-		@param node Layer for which new position is being calculated
-		@param node_type Only relevant for clone layers (BUG FIX), default None.
-		@param contains_clones Flag to fix bounds of group layers that could contain clone layers, default False.
-		@return Target position for alignment. """
-
-	if contains_clones and node_type == "grouplayer":
-		''' Group layers in a layer selection containing clones '''
-		stack = node.findChildNodes("", True)
-		p = node.position()
-		# BUG FIX: Fix bounds of groups with clone children >(
-		b = calculate_group_bounds(stack)
-	elif node_type != "clonelayer":
-		''' Regular layers that aren't evil '''
-		b = node.bounds()
-		p = node.position()
-	else:
-		''' Clone layers are special (and evil) '''
-		entry = node
-		node = entry["node"]
-		# BUG FIX: Use fixed bounds calculated before any movement happend.
-		# 	Because sometimes the doc updates bounds in the middle
-		# 	of math (breaking formulas!), sometimes it doesn't.
-		b = entry["real_bounds"]
-		p = entry["position"]
-		# b = correct_clone_bounds(node, b, p)
-
-	pos_x, pos_y = (b.x() - p.x()), (b.y() - p.y())
-
-	if mode == "left":
-		return (rect.x() - pos_x, p.y())
-	elif mode == "right":
-		return ( (rect.x() - pos_x) + (rect.width() - b.width()), p.y())
-	elif mode == "top":
-		return (p.x(), rect.y() - pos_y)
-	elif mode == "bottom":
-		return (p.x(), ((rect.y() + rect.height()) - b.height() ) - pos_y)
-	elif mode == "v_center":
-		return (p.x(), rect.y() +  round(( rect.height() - b.height() )/2) - pos_y)
-	elif mode == "h_center":
-		return (rect.x() + round(( rect.width() - b.width() )/2) - pos_x, p.y())
-
-
-def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
+def sort_selected_layers_positions(snap, selected_nodes, axis="x", gaps=False):
 	""" Return a list of layers containing their properties ordered by their positions.
-		@param selected_nodes: List of selected layers.
+		@param snap: GeometrySnapshot of the selection.
+		@param selected_nodes: List of selected layer records.
 		@param axis: Axis being sorted, default x.
 		@return: List of layers sorted by position. """
 
@@ -639,14 +787,14 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 
 	nodes_list = {}
 	sorted_positions = {}
+	selection_index = SelectionIndex(snap, selected_nodes)
 
 	for idx, node in enumerate(selected_nodes):
-		node_type = node.type()
-		parent = node.parentNode()
+		node_type = node.type
 
 		if (node_type in exclusion_list or
-			node.locked() or
-			not node.visible() or
+			node.locked or
+			not node.visible or
 			node_type in exclusion_list_with_masks):
 			# Skip masks.
 			# Skip edition locked nodes.
@@ -654,34 +802,34 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 			# Skip nodes in unsupported list (fills, filters etc).
 			continue
 
-		b = node.bounds()
-		p = node.position()
+		b = node.bounds
+		p = node.position
 
 		# Order by bounds x or y
-		sorting_x = b_x = b.x()
-		sorting_y = b_y = b.y()
+		sorting_x = b_x = b[0]
+		sorting_y = b_y = b[1]
 		# Extra data
-		p_x = p.x()
-		p_y = p.y()
-
-		if node_type == "clonelayer" and parent not in selected_nodes:
-			# --- BUG FIX: Fix clone bad bounds, but only clones not in group
-			b = correct_clone_bounds(node, b, p)
-			sorting_x = b_x = b.x()
-			sorting_y = b_y = b.y()
+		p_x = p[0]
+		p_y = p[1]
+
+		if selection_index.has_selected_ancestor(node):
+			# Don't move nodes when their parents (masks or groups) or any
+			# 	further ancestor are also selected, they move with them
+			continue
+		elif node_type == "clonelayer":
+			# --- BUG FIX: Fix clone bad bounds
+			b = correct_clone_bounds(b, p)
+			sorting_x = b_x = b[0]
+			sorting_y = b_y = b[1]
 		elif node_type == "grouplayer":
 			# Unfortunately groups may also contain clones, they need
-			# 	correction too, but as a whole.
-			stack = node.findChildNodes("", True)
-			b = calculate_group_bounds(stack)
-			sorting_x = b_x = b.x()
-			sorting_y = b_y = b.y()
-		elif parent in selected_nodes: # Should this be here?
-			# Don't move nodes when their parents (masks or groups) are also selected
-			continue
+			# 	correction too, but as a whole. Nested groups are only aggregated once.
+			b = snap.group_bounds(node)
+			sorting_x = b_x = b[0]
+			sorting_y = b_y = b[1]
 
-		width = b.width()
-		height = b.height()
+		width = b[2]
+		height = b[3]
 		rel_pos_x = b_x - p_x
 		rel_pos_y = b_y - p_y
 
@@ -709,6 +857,8 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 					position: (int: node.position() x or y),
 					alt_position: (int: node.position() x or y, axis that won't move),
 					bounds: (int: node.bounds() x or y),
+					alt_bounds: (int: node.bounds() x or y, axis that won't move),
+					alt_size: (int: height or width, axis that won't move),
 					name: (str: debug)
 				},
 			(...) : { ... }
@@ -725,7 +875,9 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 				"type": node_type,
 				"position": p_x,
 				"bounds": b_x,
-				"alt_position": p_y  # To complete move parameters
+				"alt_position": p_y,  # To complete move parameters
+				"alt_bounds": b_y,  # To find overlapping layers
+				"alt_size": height
 			})
 		else:
 			# Positions list
@@ -738,7 +890,9 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 				"type": node_type,
 				"position": p_y,
 				"bounds": b_y,
-				"alt_position": p_x
+				"alt_position": p_x,
+				"alt_bounds": b_x,
+				"alt_size": width
 			})
 
 	# Order by position
@@ -765,6 +919,8 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 					position: (int: node.position() x or y),
 					alt_position: (int: node.position() x or y, axis that won't move),
 					bounds: (int: node.bounds() x or y),
+					alt_bounds: (int: node.bounds() x or y, axis that won't move),
+					alt_size: (int: height or width, axis that won't move),
 					name: (str: debug)
 				}
 		),
@@ -774,125 +930,19 @@ def sort_selected_layers_positions(selected_nodes, axis="x", gaps=False):
 
 	return nodes_by_position
 
-def move_masks_with_node(parent_node, translate_x, translate_y):
-	""" Process masks of a given node (clone only for now) """
-	stack = parent_node.findChildNodes("", True)
-
-	# Move masks with parent regardless of their visibility
-	for child in stack:
-		if (child.locked()):
-			# Only skip locked layers, move invisible ones
-			continue
-
-		pchild = child.position()
-
-		# --- Repeat translation of parent so they move as one
-		x = pchild.x() + translate_x
-		y = pchild.y() + translate_y
-		child.move(x, y)
-
 ######################## Clone Layer Methods ##########################
 
-def get_clone_sources(clone_node, selected_nodes, sources_list={}, ancestors=[], descendant_level=0):
-	""" Recusive method to get a clone's sources list, sorted from source to child, no duplicates.
-		@param clone_node: Clone node for which source is being retrieved.
-		@param selected_nodes: List of selected layers.
-		@param sources_list: List containg all sources found, sorted by seniority.
-		@param ancestors: List of ancestors (layer uniqueIds) of this layer.
-		@param descendant_level: How far up the descendant tree this layer is.
-		@return: sources_list """
-
-	source = clone_node.sourceNode()
-	uid = clone_node.uniqueId()
-	suid = source.uniqueId()
-	if suid not in ancestors:
-		ancestors.append(suid)
-
-	# Always investigate full source chain in case some are in selection
-	if source.type() == "clonelayer":
-		# Add to desdants level while it's recursive.
-		descendant_level += 1
-		# Inception!
-		sources_list = get_clone_sources(source, selected_nodes, sources_list, ancestors, descendant_level)
-		# Recursion ended, start removing levels. We're climbing back up the ancestor tree now.
-		descendant_level -= 1
-
-	elif uid not in sources_list:
-		# Always append major ancestors
-		sources_list[suid] = {
-			"node" : source,
-			"bounds" : source.bounds(),  # Align nodes
-			"is_ancestral" : True,
-			"translation" : 0,  # Distribute nodes
-			"translation_x" : 0,  # Align nodes
-			"translation_y" : 0,
-			"ancestors" : None
-
-		}
+def find_clone_nodes(snap, selected_nodes):
+	""" Retrieve all clone layers in selection, including clones inside groups.
+		@param snap: GeometrySnapshot of the selection.
+		@param selected_nodes: List of selected layer records.
+		@return: List of clone layer records. """
+	clone_nodes = [x for x in selected_nodes if x.type == "clonelayer"]
+	# Retrieve clones in groups as well
+	for node in selected_nodes:
+		clone_nodes += [x for x in snap.descendants(node) if x.type == "clonelayer"]
 
-	if uid not in sources_list:
-		# Is a layer being moved.
-		# Not yet on sources list.
-		# Editable and visible.
-		# Store node, position and bounds (for dimensions)
-
-		# Store position, calculate fixed bounds at this point to ensure
-		# 	the properties used aren't affected by any source's movement.
-		# 	Because sometimes the doc updates clones bounds in the middle of math,
-		# 	sometimes it doesn't. WHY you'd do that to me Krita?! <o>
-
-		sources_list[uid] = {
-			"node" : clone_node,
-			"position" : clone_node.position(),  # Align nodes
-			# BUG FIX for clone bounds
-			"real_bounds" : correct_clone_bounds(clone_node, clone_node.bounds(), clone_node.position()),
-			"bounds" : source.bounds(), # obsolete
-			"is_ancestral" : False,
-			"move_with_group": False,
-			"translation" : 0,  # Distribute nodes
-			"translation_x" : 0,  # Align nodes
-			"translation_y" : 0,
-			"ancestors" : ancestors[descendant_level:], # Remove descendants not belonging to this lvl
+	return clone_nodes
 
-		}
 
-	return sources_list
-
-
-def correct_clone_bounds(node, b=None, p=None):
-	""" Retrieve corrected clone layer bounds for positioning calculations.
-		@param node: Clone layer being corrected.
-		@param b: Bounds if it was already retrieved, default None.
-		@param p: Position if it was already retrieved, default None.
-		@return: Corrected layer bounds (QRect). """
-	b = b or node.bounds()
-	p = p or node.position()
-
-	# BUG FIX: Clone layers positions are relative to their source layers, however:
-	# 	- As of 5.2.2 bounds are buggy. They don't inform the actual layer
-	# 	boundaries nor their correct dimensions.
-	# 	- Their sources might be clone layers themselves, also making these
-	# 	sources relative to their sources, which can also be relative...
-	# 	When a source moves any clones and clones of clones will move. It's easier
-	# 	to account for that movement during align or distribution operations than
-	# 	to try to calculate the layers relativity here.
-
-	# Extract data
-	width, height = b.width(), b.height()
-	b_x, b_y = b.x(), b.y()
-	p_x, p_y = p.x(), p.y()
-
-	# --- Correct bounds bug. IMPORTANT: Might be removed if their calculation method is fixed!
-	# Dimensions are always wrong
-	width = width - abs(p_x)
-	height = height - abs(p_y)
-	# Bounds coordinates are correct when position is negative, but not when positive
-	if p_x > 0:
-		b_x = p_x + b_x
-	if p_y > 0:
-		b_y = p_y + b_y
-
-	# Recreate bounds for calculations
-	b = QRect(b_x, b_y, width, height)
-
-	return b
+applier.progress_listeners.append(_repeat_progress)
@@ -0,0 +1,547 @@
+######################## Visible Pixels ##########################
+
+# Layer bounds include every pixel holding data, even fully transparent ones
+# 	(erased areas, soft brush tails cut by the eraser...). Aligning to visible
+# 	pixels scans the alpha channel of layers for their tight, visible bounds.
+
+import collections
+import concurrent.futures
+import os
+from .snapshot import depth
+
+try:
+	import numpy
+except ImportError:
+	# NumPy isn't always available in Krita's Python, plain Python is used instead
+	numpy = None
+
+# Layer types with pixels of their own to scan. Clones follow their sources
+# 	and groups their children.
+SCANNED_TYPES = {"paintlayer", "vectorlayer", "filelayer"}
+
+# Channels by color model, alpha is always the last one in Krita
+CHANNELS = {"RGBA": 4, "GRAYA": 2, "CMYKA": 5, "LABA": 4, "XYZA": 4, "YCbCrA": 4}
+# NumPy type and size in bytes of a channel by color depth
+DEPTHS = {"U8": ("u1", 1), "U16": ("=u2", 2), "F16": ("=f2", 2), "F32": ("=f4", 4)}
+
+# Layers bigger than this, in bytes, are read in bands instead of all at once
+STREAM_THRESHOLD = 64 * 1024 * 1024
+# Size of a band in bytes, peak memory of a streamed scan
+BAND_BYTES = 8 * 1024 * 1024
+
+# Rows between samples of fast estimates
+ESTIMATE_STRIDE = 16
+
+# Checking a cached scan reads what's outside its rect, beyond this fraction
+# 	of the layer scanning it again costs about the same
+VERIFY_LIMIT = 0.5
+
+# Threads scanning layers at once, None for one per CPU
+workers = None
+# Smallest number of layers worth scanning in threads
+PARALLEL_THRESHOLD = 8
+
+# uid: (key, tight bounds relative to the layer bounds origin or None), see _cached()
+_cache = {}
+# (selection rect, tight bounds) of the last pixel selection
+_selection_cache = None
+# Selection masks are single channel, 8 bit
+SELECTION_PIXEL = (1, "u1", 1)
+
+
+def pixel_format(node):
+	""" Pixel layout of a layer.
+		@return: (channels, dtype, channel size) or None when unsupported. """
+	channels = CHANNELS.get(node.colorModel())
+	depth = DEPTHS.get(node.colorDepth())
+	if channels is None or depth is None:
+		return None
+	return (channels, depth[0], depth[1])
+
+
+def _buffer(data):
+	# QByteArray or bytes, avoid copying when the buffer can be shared
+	try:
+		return memoryview(data)
+	except TypeError:
+		return bytes(data)
+
+
+def scan_alpha(data, width, height, pixel):
+	""" Tight bounds of the pixels with some opacity in raw pixel data.
+		@param data: Pixels as returned by pixelData(), rows of width pixels.
+		@param width: Width of the data in pixels.
+		@param height: Height of the data in pixels.
+		@param pixel: (channels, dtype, channel size) from pixel_format().
+		@return: (x, y, width, height) relative to the data, None if fully transparent. """
+	if numpy is not None:
+		return _scan_alpha_numpy(data, width, height, pixel)
+	return _scan_alpha_python(data, width, height, pixel)
+
+
+def _scan_alpha_numpy(data, width, height, pixel):
+	channels, dtype, size = pixel
+	alpha = numpy.frombuffer(data, dtype=dtype, count=width * height * channels).reshape(height, width, channels)[:, :, -1]
+	opaque = alpha > 0
+	rows = numpy.flatnonzero(opaque.any(axis=1))
+	if not len(rows):
+		return None
+	# Columns only need checking between the first and last opaque rows
+	cols = numpy.flatnonzero(opaque[rows[0]:rows[-1] + 1].any(axis=0))
+
+	return (int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1))
+
+
+def _scan_alpha_python(data, width, height, pixel):
+	""" Plain Python version of scan_alpha(), the work is done by bytes methods in C. """
+	channels, dtype, size = pixel
+	data = bytes(data)
+	stride = channels * size
+	offset = (channels - 1) * size
+
+	# One byte per pixel, zero where alpha is zero
+	mask = data[offset::stride]
+	if size > 1:
+		# Merge every byte of the alpha channel
+		count = width * height
+		merged = 0
+		for i in range(size):
+			merged |= int.from_bytes(data[offset + i::stride], "little")
+		mask = merged.to_bytes(count, "little")
+
+	top = bottom = None
+	left, right = width, 0
+	for y in range(height):
+		row = mask[y * width:(y + 1) * width]
+		stripped = row.lstrip(b"\0")
+		if not stripped:
+			continue
+		if top is None:
+			top = y
+		bottom = y
+		left = min(left, width - len(stripped))
+		right = max(right, len(row.rstrip(b"\0")))
+
+	if top is None:
+		return None
+
+	return (left, top, right - left, bottom - top + 1)
+
+
+def _is_huge(record, pixel):
+	b = record.bounds
+	return b[2] * b[3] * pixel[0] * pixel[2] > STREAM_THRESHOLD
+
+
+def _scannable(record):
+	""" Pixel format of a layer with pixels to scan.
+		@return: (channels, dtype, channel size) or None when there's nothing to scan. """
+	b = record.bounds
+	if b[2] <= 0 or b[3] <= 0:
+		return None
+	return pixel_format(record.node)
+
+
+def _read(record, pixel):
+	""" Fetch the pixels of a layer. Talks to Krita, so only from the main thread.
+		@return: (record, pixel format, data) job for _scan(). """
+	b = record.bounds
+	return (record, pixel, _buffer(record.node.pixelData(b[0], b[1], b[2], b[3])))
+
+
+def _key(record, pixel, kind):
+	b = record.bounds
+	return (kind, b[2], b[3], pixel)
+
+
+def _cached(record, pixel, stride=None):
+	""" Cached scan of a layer, when its pixels still give the same result. The
+		inside of the cached rect is never read: the rect is still tight when
+		nothing around it has any opacity and each of its four edges has some.
+		Fully transparent layers and rects leaving most of the layer around them
+		aren't checked, scanning again costs about the same.
+		Talks to Krita, so only from the main thread.
+		@param stride: Rows between samples above and below the rect when an
+			estimate is enough, default None (exact, every row is read).
+		@return: (key, tight rect relative to bounds) or None when it must be scanned. """
+	cached = _cache.get(record.uid)
+	if cached is None or cached[1] is None:
+		return None
+	if cached[0] != _key(record, pixel, "exact") and (stride is None or cached[0] != _key(record, pixel, "estimate")):
+		return None
+
+	width, height = record.bounds[2], record.bounds[3]
+	x, y, w, h = cached[1]
+	outside = width * (height - h) // (stride or 1) + (width - w) * h
+	if outside > width * height * VERIFY_LIMIT:
+		return None
+
+	reads = _Reads(record, pixel)
+	rows = _band_rows(record, pixel)
+	if stride is None:
+		# Nothing above nor below
+		for top, bottom in ((0, y), (y + h, height)):
+			for row in range(top, bottom, rows):
+				if reads.scan(0, row, width, min(rows, bottom - row)) is not None:
+					return None
+	else:
+		# Nothing on sampled rows, from the edges outwards like estimates find them
+		for row in list(range(y - 1, -1, -stride)) + list(range(y + h, height, stride)):
+			if reads.scan(0, row, width, 1) is not None:
+				return None
+	# Nothing left nor right
+	for row in range(y, y + h, rows):
+		band = min(rows, y + h - row)
+		if x > 0 and reads.scan(0, row, x, band) is not None:
+			return None
+		if x + w < width and reads.scan(x + w, row, width - x - w, band) is not None:
+			return None
+	# Something on every edge
+	for edge in ((x, y, w, 1), (x, y + h - 1, w, 1), (x, y, 1, h), (x + w - 1, y, 1, h)):
+		if reads.scan(*edge) is None:
+			return None
+
+	return cached
+
+
+class _Reads:
+	""" Scans of parts of a layer, for streamed scans, estimates and cache checks.
+		@param record: NodeRecord of the layer.
+		@param pixel: (channels, dtype, channel size) from pixel_format(). """
+
+	def __init__(self, record, pixel):
+		self.record = record
+		self.pixel = pixel
+
+	def scan(self, x, y, w, h):
+		""" Read and scan a rect relative to the layer bounds.
+			@return: Tight rect relative to the read rect, or None. """
+		b = self.record.bounds
+		data = _buffer(self.record.node.pixelData(b[0] + x, b[1] + y, w, h))
+		return scan_alpha(data, w, h, self.pixel)
+
+	def sides(self, top, bottom, left, right, rows):
+		""" Widen columns with content between top and bottom rows, reading only
+			strips left and right of them, until content reaches both edges.
+			@return: (left, right) """
+		width = self.record.bounds[2]
+		for y in range(top, bottom, rows):
+			if left == 0 and right == width:
+				break
+			h = min(rows, bottom - y)
+			if left > 0:
+				rect = self.scan(0, y, left, h)
+				if rect is not None:
+					left = rect[0]
+			if right < width:
+				rect = self.scan(right, y, width - right, h)
+				if rect is not None:
+					right = right + rect[0] + rect[2]
+
+		return left, right
+
+
+def _band_rows(record, pixel):
+	# Rows read at once, so a band weights about BAND_BYTES
+	return max(1, BAND_BYTES // (record.bounds[2] * pixel[0] * pixel[2]))
+
+
+def stream_bounds(record, pixel):
+	""" Tight bounds of a huge layer, read in horizontal bands so memory stays
+		bounded by BAND_BYTES. Transparent bands are read from the top and the
+		bottom until opaque rows are found, then only the strips left and right
+		of the known columns are read, stopping once content reaches both edges.
+		The result is exact, its cache is checked like any other, see _cached().
+		@param record: NodeRecord of the layer.
+		@param pixel: (channels, dtype, channel size) from pixel_format().
+		@return: (key, tight rect relative to bounds or None) """
+	width, height = record.bounds[2], record.bounds[3]
+	rows = _band_rows(record, pixel)
+	reads = _Reads(record, pixel)
+
+	# Top, first band with opaque pixels
+	for y in range(0, height, rows):
+		rect = reads.scan(0, y, width, min(rows, height - y))
+		if rect is not None:
+			first = y
+			top = y + rect[1]
+			bottom = top + rect[3]
+			left = rect[0]
+			right = rect[0] + rect[2]
+			break
+	else:
+		return (_key(record, pixel, "exact"), None)
+
+	# Bottom, last band with opaque pixels
+	last = first
+	for y in range(first + ((height - 1 - first) // rows) * rows, first, -rows):
+		rect = reads.scan(0, y, width, min(rows, height - y))
+		if rect is not None:
+			last = y
+			bottom = y + rect[1] + rect[3]
+			left = min(left, rect[0])
+			right = max(right, rect[0] + rect[2])
+			break
+
+	# Sides of the bands in between
+	left, right = reads.sides(first + rows, last, left, right, rows)
+
+	return (_key(record, pixel, "exact"), (left, top, right - left, bottom - top))
+
+
+def estimate_bounds(record, stride=None):
+	""" Fast, approximate bounds of a layer's visible pixels. Content is first
+		located reading one row every stride rows, then the rows between the
+		outer samples and their neighbors are read in full to find the exact top
+		and bottom, and strips left and right of the content for exact columns.
+		Content sitting entirely between two skipped sample rows may be missed.
+		A cached estimate or exact scan is checked sampling rows the same way.
+		@param record: NodeRecord of the layer.
+		@param stride: Rows between samples, default ESTIMATE_STRIDE.
+		@return: ((x, y, width, height) or None, whether the result is exact) """
+	stride = stride or ESTIMATE_STRIDE
+	b = record.bounds
+	if b[2] <= 0 or b[3] <= 0:
+		return (None, True)
+	pixel = pixel_format(record.node)
+	if pixel is None:
+		return (None, True)
+	if b[3] <= stride * 4:
+		# Too small to be worth estimating
+		return (visible_bounds(record), True)
+
+	result = _cached(record, pixel, stride)
+	if result is None:
+		result = _estimate(record, pixel, stride)
+
+	return (_store(record, result), False)
+
+
+def _estimate(record, pixel, stride):
+	width, height = record.bounds[2], record.bounds[3]
+	reads = _Reads(record, pixel)
+
+	# Coarse, sampled rows
+	samples = list(range(0, height, stride))
+	if samples[-1] != height - 1:
+		samples.append(height - 1)
+	hits = []
+	for i, y in enumerate(samples):
+		rect = reads.scan(0, y, width, 1)
+		if rect is not None:
+			hits.append((i, y, rect))
+	if not hits:
+		return (_key(record, pixel, "estimate"), None)
+
+	left = min(rect[0] for i, y, rect in hits)
+	right = max(rect[0] + rect[2] for i, y, rect in hits)
+
+	# Fine, rows between the outer hits and the samples next to them
+	i, top, rect = hits[0]
+	start = samples[i - 1] + 1 if i > 0 else 0
+	if start < top:
+		rect = reads.scan(0, start, width, top - start)
+		if rect is not None:
+			top = start + rect[1]
+			left = min(left, rect[0])
+			right = max(right, rect[0] + rect[2])
+
+	i, y, rect = hits[-1]
+	bottom = y + 1
+	end = samples[i + 1] if i + 1 < len(samples) else height
+	if bottom < end:
+		rect = reads.scan(0, bottom, width, end - bottom)
+		if rect is not None:
+			bottom = bottom + rect[1] + rect[3]
+			left = min(left, rect[0])
+			right = max(right, rect[0] + rect[2])
+
+	left, right = reads.sides(top, bottom, left, right, _band_rows(record, pixel))
+
+	return (_key(record, pixel, "estimate"), (left, top, right - left, bottom - top))
+
+
+def _scan(job):
+	""" Scan fetched pixels. Safe from any thread, NumPy reductions release the
+		GIL on large buffers.
+		@return: (key, tight rect relative to bounds or None) """
+	record, pixel, data = job
+	return (_key(record, pixel, "exact"), scan_alpha(data, record.bounds[2], record.bounds[3], pixel))
+
+
+def _store(record, result):
+	# Cache a scan and convert it to canvas coordinates
+	_cache[record.uid] = result
+	rect = result[1]
+	if rect is None:
+		return None
+
+	b = record.bounds
+	return (b[0] + rect[0], b[1] + rect[1], rect[2], rect[3])
+
+
+def visible_bounds(record):
+	""" Tight bounds of a layer's visible pixels, cached until its content changes.
+		Moving a layer keeps its cache, results are relative to its bounds.
+		@param record: NodeRecord of the layer.
+		@return: (x, y, width, height) or None when unsupported or fully transparent. """
+	pixel = _scannable(record)
+	if pixel is None:
+		return None
+
+	result = _cached(record, pixel)
+	if result is None:
+		if _is_huge(record, pixel):
+			result = stream_bounds(record, pixel)
+		else:
+			result = _scan(_read(record, pixel))
+
+	return _store(record, result)
+
+
+def visible_bounds_many(records, threads=None):
+	""" Tight bounds of the visible pixels of many layers. Cached scans are checked
+		and pixels fetched one layer after another while previous layers are
+		scanned in threads.
+		@param records: List of NodeRecord.
+		@param threads: Number of threads, default None (workers setting, or one
+			per CPU). Selections under PARALLEL_THRESHOLD are scanned serially.
+		@return: dict of uid: (x, y, width, height) for layers with visible pixels. """
+	threads = threads or workers or os.cpu_count() or 1
+	found = {}
+
+	if numpy is None or threads < 2 or len(records) < PARALLEL_THRESHOLD:
+		# Thread overhead isn't worth it, and plain Python holds the GIL anyway
+		for record in records:
+			rect = visible_bounds(record)
+			if rect is not None:
+				found[record.uid] = rect
+		return found
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+		# Fetched buffers waiting for a thread stay in memory, keep them few
+		pending = collections.deque()
+
+		def add(record, result):
+			rect = _store(record, result)
+			if rect is not None:
+				found[record.uid] = rect
+
+		def collect():
+			record, future = pending.popleft()
+			add(record, future.result())
+
+		for record in records:
+			pixel = _scannable(record)
+			if pixel is None:
+				continue
+			# Checking caches and streaming read Krita, it can't be read from threads
+			result = _cached(record, pixel)
+			if result is None and _is_huge(record, pixel):
+				result = stream_bounds(record, pixel)
+			if result is not None:
+				add(record, result)
+				continue
+			pending.append((record, executor.submit(_scan, _read(record, pixel))))
+			if len(pending) > threads * 2:
+				collect()
+
+		while pending:
+			collect()
+
+	return found
+
+
+def selection_bounds(doc):
+	""" Bounds of the pixels selected in a document, partially selected ones
+		included. Krita's selection rect is normally tight already, the mask is
+		only read and scanned when that rect changes.
+		@param doc: Krita Document.
+		@return: (x, y, width, height) or None when nothing is selected. """
+	global _selection_cache
+
+	selection = doc.selection()
+	if selection is None:
+		return None
+	x, y, width, height = selection.x(), selection.y(), selection.width(), selection.height()
+	if width <= 0 or height <= 0:
+		return None
+
+	key = (x, y, width, height)
+	if _selection_cache is None or _selection_cache[0] != key:
+		data = _buffer(selection.pixelData(x, y, width, height))
+		_selection_cache = (key, scan_alpha(data, width, height, SELECTION_PIXEL))
+
+	rect = _selection_cache[1]
+	if rect is None:
+		return None
+
+	return (x + rect[0], y + rect[1], rect[2], rect[3])
+
+
+def use_visible_bounds(snap, estimate=False):
+	""" Replace bounds of layers in a snapshot by the bounds of their visible pixels.
+		Clones and groups are updated from their sources and children, keeping the
+		clone bounds quirk so correct_clone_bounds() still applies.
+		@param snap: Freshly read GeometrySnapshot.
+		@param estimate: Use fast estimates instead of exact scans, default False.
+		@return: dict with number of layers scanned and whether bounds are exact. """
+	records = snap.records
+	scanned_records = [record for record in records.values() if record.type in SCANNED_TYPES]
+	exact = True
+	if estimate:
+		# uid: real visible rect of layers whose bounds changed
+		visible = {}
+		for record in scanned_records:
+			rect, is_exact = estimate_bounds(record)
+			exact = exact and is_exact
+			if rect is not None:
+				visible[record.uid] = rect
+	else:
+		visible = visible_bounds_many(scanned_records)
+
+	for uid, rect in visible.items():
+		records[uid].bounds = rect
+	report = {"scanned": len(visible), "exact": exact}
+
+	# Clones show their source's pixels at their own offset
+	for record in records.values():
+		if record.type == "clonelayer":
+			_clone_visible_bounds(snap, record, visible)
+
+	# Groups, deepest first so outer groups aggregate updated children
+	groups = [record for record in records.values() if record.type == "grouplayer" and record.children]
+	groups.sort(key=lambda record: depth(records, record.uid), reverse=True)
+	for record in groups:
+		b = snap.group_bounds(record)
+		if b[2] >= 0 and b[3] >= 0:
+			record.bounds = b
+
+	return report
+
+
+def _clone_visible_bounds(snap, record, visible):
+	# Climb the chain to a source with known visible bounds
+	chain = []
+	current = record
+	while current is not None and current.uid not in visible and current.type == "clonelayer":
+		chain.append(current)
+		current = snap.source(current)
+	if current is None or current.uid not in visible:
+		return
+
+	rect = visible[current.uid]
+	for clone in reversed(chain):
+		x, y = clone.position
+		moved = (rect[0] + x, rect[1] + y, rect[2], rect[3])
+		# Clone bounds quirk: union of the source's and the clone's own rect
+		left = min(rect[0], moved[0])
+		top = min(rect[1], moved[1])
+		clone.bounds = (
+			left,
+			top,
+			max(rect[0] + rect[2], moved[0] + moved[2]) - left,
+			max(rect[1] + rect[3], moved[1] + moved[3]) - top,
+		)
+		visible[clone.uid] = moved
+		rect = moved
@@ -0,0 +1,504 @@
+######################## Layout Planner ##########################
+
+# Pure geometry. Everything here works on plain tuples and records and never
+# 	touches Krita, so plans can be computed, cached and profiled outside of it.
+# 	Bounds are (x, y, width, height) and positions are (x, y).
+
+try:
+	import numpy
+except ImportError:
+	# NumPy isn't always available in Krita's Python, plain Python is used instead
+	numpy = None
+
+# Smallest number of layers for which building arrays pays off
+BATCH_THRESHOLD = 200
+
+
+def use_batch(count, batch=None):
+	""" Decide whether a plan should be computed with NumPy arrays.
+		@param count: Number of layers in the plan.
+		@param batch: True or False to force a mode, default None (automatic).
+		@return: bool """
+	if numpy is None:
+		return False
+	if batch is None:
+		return count >= BATCH_THRESHOLD
+	return batch
+
+
+def calculate_layer_position(mode, rect, b, p):
+	""" Calculate given a node new position relative to rect.
+		@param mode Direction of alignment.
+		@param rect (x, y, width, height) to which layers will be aligned.
+		@param b (x, y, width, height) bounds of the layer being aligned.
+			Clone layers and groups containing them need corrected bounds (BUG FIX).
+		@param p (x, y) position of the layer being aligned.
+		@return Target position for alignment. """
+
+	pos_x, pos_y = (b[0] - p[0]), (b[1] - p[1])
+
+	if mode == "left":
+		return (rect[0] - pos_x, p[1])
+	elif mode == "right":
+		return ( (rect[0] - pos_x) + (rect[2] - b[2]), p[1])
+	elif mode == "top":
+		return (p[0], rect[1] - pos_y)
+	elif mode == "bottom":
+		return (p[0], ((rect[1] + rect[3]) - b[3] ) - pos_y)
+	elif mode == "v_center":
+		return (p[0], rect[1] +  round(( rect[3] - b[3] )/2) - pos_y)
+	elif mode == "h_center":
+		return (rect[0] + round(( rect[2] - b[2] )/2) - pos_x, p[1])
+
+
+def plan_align(mode, rect, bounds, positions, batch=None):
+	""" Calculate target positions aligning every layer to rect.
+		@param mode: Edge to which layers will be aligned.
+		@param rect: (x, y, width, height) anchor bounds.
+		@param bounds: List of layers bounds.
+		@param positions: List of layers positions, same order as bounds.
+		@param batch: Force NumPy on or off, default None (automatic).
+		@return: List of target positions, same order as bounds. """
+	if use_batch(len(bounds), batch):
+		return _plan_align_batch(mode, rect, bounds, positions)
+
+	return [calculate_layer_position(mode, rect, b, p) for b, p in zip(bounds, positions)]
+
+
+def _plan_align_batch(mode, rect, bounds, positions):
+	""" NumPy version of plan_align(), same results in a few array operations. """
+	b = numpy.array(bounds, dtype=numpy.int64).reshape(-1, 4)
+	p = numpy.array(positions, dtype=numpy.int64).reshape(-1, 2)
+	x = p[:, 0]
+	y = p[:, 1]
+	pos_x = b[:, 0] - x
+	pos_y = b[:, 1] - y
+
+	# numpy.round() rounds halves to even like round() does
+	if mode == "left":
+		x = rect[0] - pos_x
+	elif mode == "right":
+		x = (rect[0] - pos_x) + (rect[2] - b[:, 2])
+	elif mode == "top":
+		y = rect[1] - pos_y
+	elif mode == "bottom":
+		y = ((rect[1] + rect[3]) - b[:, 3]) - pos_y
+	elif mode == "v_center":
+		y = rect[1] + numpy.round((rect[3] - b[:, 3]) / 2).astype(numpy.int64) - pos_y
+	elif mode == "h_center":
+		x = rect[0] + numpy.round((rect[2] - b[:, 2]) / 2).astype(numpy.int64) - pos_x
+
+	return list(zip(x.tolist(), y.tolist()))
+
+
+def plan_distribute(placement, starts, sizes, positions, spacing=None, reverse=False, batch=None):
+	""" Calculate target coordinates distributing layers along a single axis.
+		@param placement: gaps, left, top, right, bottom, h_center or v_center.
+		@param starts: Bounds x or y of every layer, sorted.
+		@param sizes: Width or height of every layer, same order as starts.
+		@param positions: Position x or y of every layer, same order as starts.
+		@param spacing: Fixed spacing between layers when placing them by gaps,
+			default None (even spacing).
+		@param reverse: Keep the last layer in place instead of the first one
+			when using fixed spacing, default False.
+		@param batch: Force NumPy on or off, default None (automatic).
+		@return: List of target positions x or y, same order as starts. """
+
+	nodes_count = len(starts)
+	targets = list(positions)
+	backwards = False
+	center = False
+
+	start_co = starts[0]  # Coord of first element
+	end_co = starts[-1]  # Left edge
+
+	# --- Calculate spacing of nodes
+	# Get combined width or height of elements only, ignoring gaps
+	combined_size = sum(sizes)
+
+	# Skip first and last elements. They don't need to be moved unless spaces will be removed.
+	# 	When removing spaces in edge-to-edge modedecide which node to skip (first or last)
+	# 	based on direction.
+	nodes_range = (range(0, nodes_count - 1) if reverse else range(1, nodes_count)) if spacing is not None else range(1, nodes_count - 1)
+
+	# Determine correct spacing based on aligning by fixed spacing size or edges
+	if placement == "gaps":
+		''' Move nodes so their edges touch (method supports custom even spacing too, it's just 0 here) '''
+		end_co += sizes[-1]  # Takes fill combined width into account
+		# Space that will be either just removed from between nodes so they align left/top
+		# 	or will be removed then added to the start to align them to the right/bottom.
+		excess_space = abs(end_co - start_co) - combined_size
+		# Spacing = predetermined spacing or escess of space / nodes - 1 (number of gaps)
+		spacing = spacing if spacing is not None else round(excess_space / (nodes_count - 1))
+
+		# Either add width of first node when skipping it (align left/top) or
+		# 	the space that was removed from the end when aligning to rigth/bottom.
+		initial_padding = sizes[0] if not reverse else excess_space
+
+		next_co = start_co + initial_padding + spacing
+	elif placement in ("left", "top"):
+		''' Evenly distribute space while aligning by edges, default direction '''
+		# Align by edge = Total width - last el width / number of nodes - 1
+		spacing = round(abs(end_co - start_co) / (nodes_count - 1))
+		next_co = start_co + spacing
+	elif placement in ("right", "bottom"):
+		''' Evenly distribute space while aligning by edges, default reversed direction '''
+		# Coordinates calculation happens backwards in this case
+		backwards = True
+		# Full width of combined elements
+		total_width = (end_co + sizes[-1]) - start_co
+		# Working width for co calculation disregards first element
+		working_width = total_width - sizes[0]
+		# Spacing is working width / len - 1
+		spacing = round(working_width / (nodes_count - 1))
+
+		# Starting coodinate is total width - working width
+		start_co += total_width - working_width
+
+		next_co = start_co + spacing
+	else:
+		''' Evenly distribute space, aligned by centers '''
+		center = True
+
+		# The total width coords will start at the half width of
+		# first element and end at half width of last
+		# It starts in the middle of the first node
+		start_co += sizes[0]/2
+		# And ends in the middle of the last
+		end_co += sizes[-1]/2
+
+		# Spacing = total width (from centers) /  number of nodes -1
+		spacing = round(abs(end_co - start_co) / (nodes_count - 1))
+		# Spacing is between centers here, hence to x/y
+		# you need to subtract half width
+		next_co = start_co + spacing
+
+	if use_batch(len(nodes_range), batch):
+		_distribute_batch(targets, nodes_range, placement, starts, sizes, positions,
+			next_co, spacing, backwards, center)
+		return targets
+
+	for idx in nodes_range:
+		size = sizes[idx]
+		# Adjust position relative to target
+		# position determined by previous element
+		co = next_co - (starts[idx] - positions[idx])
+
+		if backwards:
+			# When spacing something backwards (right, bottom),
+			# discount their full width/height
+			co -= size
+		elif center:
+			# Spacing is between centers here, hence to x/y
+			# you need to subtract half width
+			co = round(co - size / 2)
+
+		# Prepare next position
+		if placement == "gaps":
+			next_co += size + spacing
+		else:
+			next_co += spacing
+
+		targets[idx] = co
+
+	return targets
+
+
+def _distribute_batch(targets, nodes_range, placement, starts, sizes, positions,
+		next_co, spacing, backwards, center):
+	""" NumPy version of the stepping in plan_distribute(). Coordinates are a
+		prefix sum of sizes plus spacing, or plain multiples of spacing. """
+	first, last = nodes_range.start, nodes_range.stop
+	size = numpy.array(sizes[first:last], dtype=numpy.int64)
+	rel_pos = (numpy.array(starts[first:last], dtype=numpy.int64) -
+		numpy.array(positions[first:last], dtype=numpy.int64))
+
+	if placement == "gaps":
+		# Exclusive prefix sum, each layer starts where the previous ended
+		steps = numpy.cumsum(size + spacing)
+		offsets = numpy.concatenate(([0], steps[:-1]))
+	else:
+		offsets = numpy.arange(last - first, dtype=numpy.int64) * spacing
+
+	co = (next_co + offsets) - rel_pos
+	if backwards:
+		co = co - size
+	elif center:
+		co = numpy.round(co - size / 2)
+
+	targets[first:last] = co.astype(numpy.int64).tolist()
+
+
+def cluster_spans(spans):
+	""" Group layers into rows or columns, layers whose spans on the other axis
+		overlap directly or through other layers end in the same group.
+		@param spans: (y, height) or (x, width) of every layer on the other axis.
+		@return: List of clusters, each a list of indexes in ascending order,
+			clusters ordered by their start on the other axis. """
+	order = sorted(range(len(spans)), key=lambda i: spans[i][0])
+
+	# Sweep along the other axis, a gap closes the current cluster
+	clusters = []
+	end = None
+	for i in order:
+		start, size = spans[i]
+		if end is None or start >= end:
+			clusters.append([])
+			end = start + size
+		else:
+			end = max(end, start + size)
+		clusters[-1].append(i)
+
+	for cluster in clusters:
+		cluster.sort()
+
+	return clusters
+
+
+def plan_overlaps(starts, sizes, positions, spans, spacing=0):
+	""" Calculate target coordinates pushing apart overlapping layers along a
+		single axis, by the minimum needed and keeping their order. Layers with
+		room around them stay where they are.
+		@param starts: Bounds x or y of every layer, sorted.
+		@param sizes: Width or height of every layer, same order as starts.
+		@param positions: Position x or y of every layer, same order as starts.
+		@param spans: (y, height) or (x, width) of every layer on the other axis,
+			layers only overlap when these intersect. Same order as starts.
+		@param spacing: Minimum gap left between overlapping layers, default 0.
+		@return: List of target positions x or y, same order as starts. """
+
+	# Sweep along the axis in order. Layers already placed leave their end
+	# 	coordinate on the other axis span they cover, each layer starts after
+	# 	the furthest end found over its own span.
+	edges = sorted({co for start, size in spans if size > 0 for co in (start, start + size)})
+	index = {co: i for i, co in enumerate(edges)}
+	reach = SpanMax(max(len(edges) - 1, 1))
+
+	targets = list(positions)
+	for i, (start, size, (span_start, span_size)) in enumerate(zip(starts, sizes, spans)):
+		if span_size <= 0 or size <= 0:
+			# Empty layers can't overlap anything
+			continue
+		first, last = index[span_start], index[span_start + span_size]
+
+		end = reach.query(first, last)
+		if end is not None and start < end + spacing:
+			shift = end + spacing - start
+			targets[i] += shift
+			start += shift
+		reach.update(first, last, start + size)
+
+	return targets
+
+
+class SpanMax:
+	""" Segment tree of maximums over slots, raising whole ranges of slots at once.
+		Both updates and queries take O(log n).
+		@param count: Number of slots. """
+
+	def __init__(self, count):
+		self.count = count
+		self.maximum = [None] * (4 * count)  # Highest value in the node's range
+		self.raised = [None] * (4 * count)  # Value raising the node's whole range
+
+	def update(self, first, last, value, node=1, low=0, high=None):
+		""" Raise slots first to last (excluded) to value when lower. """
+		high = self.count if high is None else high
+		if last <= low or high <= first:
+			return
+		if self.maximum[node] is None or value > self.maximum[node]:
+			self.maximum[node] = value
+		if first <= low and high <= last:
+			if self.raised[node] is None or value > self.raised[node]:
+				self.raised[node] = value
+			return
+		middle = (low + high) // 2
+		self.update(first, last, value, node * 2, low, middle)
+		self.update(first, last, value, node * 2 + 1, middle, high)
+
+	def query(self, first, last, node=1, low=0, high=None):
+		""" Highest value among slots first to last (excluded), None when unset. """
+		high = self.count if high is None else high
+		if last <= low or high <= first or self.maximum[node] is None:
+			return None
+		if first <= low and high <= last:
+			return self.maximum[node]
+		middle = (low + high) // 2
+		found = [self.raised[node],
+			self.query(first, last, node * 2, low, middle),
+			self.query(first, last, node * 2 + 1, middle, high)]
+		found = [value for value in found if value is not None]
+		return max(found) if found else None
+
+
+def plan_pack(sizes, width=None, padding=0):
+	""" Pack rectangles into a sheet with a skyline packer: tallest rectangles
+		first, each one at the lowest spot it fits, leftmost on ties.
+		@param sizes: List of (width, height) of every layer.
+		@param width: Width of the sheet, default None (about as wide as tall).
+			Never narrower than the widest layer.
+		@param padding: Gap between layers, default 0.
+		@return: List of (x, y) top left corners relative to the sheet's, same order as sizes. """
+	if not sizes:
+		return []
+
+	# Padding goes right and below each layer, only gaps between layers count
+	padded = [(w + padding, h + padding) for w, h in sizes]
+	widest = max(w for w, h in padded)
+	if not width:
+		width = round(sum(w * h for w, h in padded) ** 0.5)
+	width = max(width + padding, widest)
+
+	# Skyline: [x, y, width] segments covering the sheet width, left to right
+	skyline = [[0, 0, width]]
+	corners = [None] * len(sizes)
+
+	order = sorted(range(len(sizes)), key=lambda i: (-padded[i][1], -padded[i][0]))
+	for i in order:
+		w, h = padded[i]
+
+		# --- Lowest spot where the rectangle fits, leftmost on ties
+		best = None
+		for first in range(len(skyline)):
+			x = skyline[first][0]
+			if x + w > width:
+				break
+			# Rests on the highest segment below it
+			y = 0
+			last = first
+			covered = 0
+			while covered < w:
+				segment = skyline[last]
+				y = max(y, segment[1])
+				covered = segment[0] + segment[2] - x
+				last += 1
+			if best is None or y < best[1]:
+				best = (x, y, first, last)
+
+		x, y, first, last = best
+		corners[i] = (x, y)
+
+		# --- Raise the skyline under the rectangle
+		end = x + w
+		tail = skyline[last - 1]
+		tail_end = tail[0] + tail[2]
+		replaced = [[x, y + h, w]]
+		if tail_end > end:
+			# Part of the last segment is still uncovered
+			replaced.append([end, tail[1], tail_end - end])
+		skyline[first:last] = replaced
+
+		# Merge neighbours at the same height, keeping the skyline short
+		merged = []
+		for segment in skyline:
+			if merged and merged[-1][1] == segment[1]:
+				merged[-1][2] += segment[2]
+			else:
+				merged.append(segment)
+		skyline = merged
+
+	return corners
+
+
+def plan_grid(sizes, columns=None, rows=None, gutter=0):
+	""" Place rectangles in a grid of uniform cells, each one centered in its
+		cell. Cells are as big as the widest and tallest rectangles.
+		@param sizes: List of (width, height) of every layer, in placing order.
+		@param columns: Number of columns, filling rows first.
+		@param rows: Number of rows, filling columns first. Only used without columns.
+		@param gutter: Space between cells, default 0.
+		@return: List of (x, y) top left corners relative to the grid's, same order as sizes. """
+	count = len(sizes)
+	if not count:
+		return []
+
+	by_rows = bool(columns) or not rows
+	if not columns and not rows:
+		# Auto fit, about as many columns as rows
+		columns = -(-count // max(1, round(count ** 0.5)))
+	lines = columns if by_rows else rows
+
+	cell_w = max(w for w, h in sizes)
+	cell_h = max(h for w, h in sizes)
+
+	corners = []
+	for i, (w, h) in enumerate(sizes):
+		line, slot = divmod(i, lines)
+		column, row = (slot, line) if by_rows else (line, slot)
+		corners.append((
+			column * (cell_w + gutter) + round((cell_w - w) / 2),
+			row * (cell_h + gutter) + round((cell_h - h) / 2)
+		))
+
+	return corners
+
+
+def plan_moves(snap, units, translations, clone_graph):
+	""" Turn translations of whole layers into target positions for every layer
+		that has to move, including children and clone layers.
+		@param snap: GeometrySnapshot of the layers.
+		@param units: Records of layers moving as a single unit, with their children.
+		@param translations: dict of uid: (x, y) translation of every unit.
+		@param clone_graph: CloneGraph of the clones in the operation.
+		@return: List of (uid, x, y) target positions. """
+
+	# --- Translation every layer should visually end up with
+	desired = {}
+	for unit in units:
+		translation = translations[unit.uid]
+		desired[unit.uid] = translation
+
+		# Node has masks or is a group with children.
+		#  Move them with parent regardless of their visibility.
+		for child in snap.descendants(unit):
+			if child.locked:
+				# Only skip locked layers, move invisible ones
+				continue
+			desired[child.uid] = translation
+
+	# Clones in the operation that aren't moving with anything must stay in place,
+	# 	otherwise they'd drift along with their sources.
+	for uid in clone_graph.order():
+		entry = clone_graph[uid]
+		if not (entry["is_ancestral"] or entry["node"].locked or uid in desired):
+			desired[uid] = (0, 0)
+
+	clone_graph.reset()
+	plan = []
+
+	# --- Regular layers simply repeat their translation
+	for uid, (translate_x, translate_y) in desired.items():
+		record = snap.records[uid]
+		if record.type == "clonelayer" and uid in clone_graph:
+			# Process later
+			continue
+
+		p = record.position
+		plan.append((uid, p[0] + translate_x, p[1] + translate_y))
+
+		# Store translation done by sources of clone layers
+		if uid in clone_graph:
+			clone_graph[uid]["translation_x"] = translate_x
+			clone_graph[uid]["translation_y"] = translate_y
+
+	# -- Clones move relative to their sources. Counter translation of sources
+	# 	so they end in correct position, processing sources first.
+	for uid in clone_graph.order():
+		entry = clone_graph[uid]
+		if entry["is_ancestral"] or uid not in desired:
+			# Ancestral nodes aren't clones and have been already moved.
+			# 	Clones not being moved just follow their sources.
+			continue
+
+		translate_x, translate_y = desired[uid]
+		translate_x -= clone_graph.ancestors_translation(uid, "translation_x")
+		translate_y -= clone_graph.ancestors_translation(uid, "translation_y")
+
+		p = entry["position"]
+		plan.append((uid, p[0] + translate_x, p[1] + translate_y))
+
+		# Take note of movement to apply to clones of this if needed
+		entry["translation_x"] = translate_x
+		entry["translation_y"] = translate_y
+
+	return plan
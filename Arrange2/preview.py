@@ -0,0 +1,176 @@
+######################## Hover Preview ##########################
+
+# Outlines of where layers will end up, drawn over the canvas while the pointer
+# 	is on an Arrange 2 button. They come from the plans computed ahead (see
+# 	speculative), so nothing moves and the canvas isn't refreshed. Targets are
+# 	packed in a flat array once per plan, painting is a single drawRects() call
+# 	with the canvas transform, whatever the number of layers.
+
+from array import array
+from krita import Krita, Qt, QObject, QEvent, QWidget, QPainter, QPen, QColor, QRect, QOpenGLWidget, QAbstractScrollArea, QMdiArea
+from .snapshot import BOUNDLESS_TYPES, correct_clone_bounds
+from . import speculative
+from . import applier
+
+
+def target_rects(snap, plan):
+	""" Rects of the layers that visibly move, where the plan puts them. Layers
+		moving with their parent aren't outlined on their own.
+		@param snap: GeometrySnapshot the plan was computed from.
+		@param plan: List of (uid, x, y) target positions.
+		@return: array of x, y, width, height of every rect, one after another. """
+	records = snap.records
+	planned = {uid for uid, x, y in plan}
+	# Outlined layers, what's inside them moves along
+	uids = [uid for uid in planned if records[uid].parent not in planned and records[uid].type not in BOUNDLESS_TYPES]
+
+	state = snap.state()
+	before = [_visual_rect(snap, records[uid]) for uid in uids]
+	snap.translate(plan)
+	after = [_visual_rect(snap, records[uid]) for uid in uids]
+	snap.restore(state)
+
+	rects = array("i")
+	for b, a in zip(before, after):
+		if a is not None and a != b:
+			rects.extend(a)
+	return rects
+
+
+def _visual_rect(snap, record):
+	if record.type == "grouplayer":
+		b = snap.group_bounds(record)
+	elif record.type == "clonelayer":
+		# BUG FIX: Clone layers report buggy bounds
+		b = correct_clone_bounds(record.bounds, record.position)
+	else:
+		b = record.bounds
+	if not (b[2] > 0 and b[3] > 0):
+		return None
+	return tuple(int(co) for co in b)
+
+
+def canvas_widget(window):
+	""" Widget the active view's canvas is drawn in, None without a view. """
+	mdi = window.qwindow().findChild(QMdiArea)
+	subwindow = mdi.currentSubWindow() if mdi else None
+	if not subwindow:
+		return None
+	canvas = subwindow.findChild(QOpenGLWidget)
+	if not canvas:
+		# Canvas acceleration is off, the canvas is the scroll area viewport
+		scroll = subwindow.findChild(QAbstractScrollArea)
+		canvas = scroll.viewport() if scroll else None
+	return canvas or None
+
+
+def image_to_canvas(view):
+	""" Transform from image pixels to canvas widget coordinates, following zoom,
+		scrolling, rotation and mirroring. None on Krita versions without it. """
+	if not hasattr(view, "flakeToCanvasTransform"):
+		return None
+	to_image, invertible = view.flakeToImageTransform().inverted()
+	if not invertible:
+		return None
+	return to_image * view.flakeToCanvasTransform()
+
+
+class Overlay(QWidget):
+	""" Transparent widget over the canvas outlining target rects.
+		@param parent: Canvas widget. """
+
+	def __init__(self, parent):
+		super().__init__(parent)
+		self.setAttribute(Qt.WA_TransparentForMouseEvents)
+		self.setAttribute(Qt.WA_NoSystemBackground)
+		self.rects = []  # QRect of every target, in image pixels
+		self.transform = None
+
+	def paintEvent(self, event):
+		if not self.rects or self.transform is None:
+			return
+
+		color = self.palette().highlight().color()
+		# Cosmetic pen, same width at any zoom
+		pen = QPen(color, 0)
+		pen.setCosmetic(True)
+		pen.setStyle(Qt.DashLine)
+		fill = QColor(color)
+		fill.setAlpha(40)
+
+		painter = QPainter(self)
+		painter.setTransform(self.transform)
+		painter.setPen(pen)
+		painter.setBrush(fill)
+		painter.drawRects(self.rects)
+		painter.end()
+
+
+class HoverPreview(QObject):
+	""" Show targets of the operation of the button the pointer is on.
+		@param parent: Owner of the preview, the docker. """
+
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self.buttons = {}  # button: function returning (operator, mode, params)
+		self.overlay = None
+		# Rects of plans already shown, hovering a button again reuses them
+		self._snap = None  # GeometrySnapshot the plans were computed from
+		self._rects = {}  # id(plan): (plan, list of QRect)
+
+		# Clicking moves layers, targets are reached
+		applier.move_listeners.append(lambda snap, moves: self.hide())
+
+	def watch(self, button, operation):
+		""" Preview an operation while the pointer is on a button.
+			@param button: Docker button running the operation.
+			@param operation: Function returning (operator, mode, params) as the
+				button would run it right now. """
+		self.buttons[button] = operation
+		button.installEventFilter(self)
+
+	def eventFilter(self, obj, event):
+		kind = event.type()
+		if kind == QEvent.Enter and obj in self.buttons:
+			self.show(*self.buttons[obj]())
+		elif kind in (QEvent.Leave, QEvent.Hide, QEvent.MouseButtonPress):
+			self.hide()
+		return False
+
+	def show(self, action, mode, params):
+		""" Outline where an operation would put layers, when its plan is ready. """
+		found = speculative.ready(action, mode, **params)
+		if found is None or not found[1]:
+			self.hide()
+			return
+		snap, plan = found
+
+		window = Krita.instance().activeWindow()
+		canvas = canvas_widget(window)
+		transform = image_to_canvas(window.activeView())
+		if canvas is None or transform is None:
+			return
+
+		if self._snap is not snap:
+			# Planned again, earlier rects are outdated
+			self._snap = snap
+			self._rects = {}
+		if id(plan) not in self._rects:
+			packed = target_rects(snap, plan)
+			rects = [QRect(packed[i], packed[i + 1], packed[i + 2], packed[i + 3]) for i in range(0, len(packed), 4)]
+			self._rects[id(plan)] = (plan, rects)
+
+		if self.overlay is None or self.overlay.parent() is not canvas:
+			# First preview, or the canvas changed
+			if self.overlay is not None:
+				self.overlay.deleteLater()
+			self.overlay = Overlay(canvas)
+		self.overlay.rects = self._rects[id(plan)][1]
+		self.overlay.transform = transform
+		self.overlay.setGeometry(canvas.rect())
+		self.overlay.show()
+		self.overlay.raise_()
+
+	def hide(self):
+		if self.overlay is not None:
+			self.overlay.hide()
@@ -0,0 +1,202 @@
+######################## Operation Profiler ##########################
+
+# Opt-in profiling of operators. While an operation is profiled, documents and
+# 	layers are wrapped so every call to the Krita API is counted and timed under
+# 	the phase the operation is in (snapshot, anchor, sort, move, refresh...).
+
+import functools
+import os
+import tempfile
+import time
+
+# Turned on and off from the docker
+enabled = False
+# Reports are appended to this file
+log_path = os.path.join(tempfile.gettempdir(), "arrange2_profile.log")
+# Functions called with every finished Profiler, used to show reports in the docker
+listeners = []
+
+# Krita API calls worth counting
+PROFILED_CALLS = {
+	"bounds", "position", "move", "findChildNodes", "childNodes", "parentNode", "sourceNode",
+	"type", "uniqueId", "locked", "visible", "refreshProjection", "waitForDone",
+	"selectedNodes", "activeNode", "pixelData", "colorModel", "colorDepth", "selection",
+}
+
+# Profiler of the operation running right now, if any
+_active = None
+
+
+class Profiler:
+	""" Counts and times Krita API calls made during an operation, by phase.
+		@param name: Operation name for the report. """
+
+	def __init__(self, name):
+		self.name = name
+		self.phases = {}  # phase: {"seconds": float, "calls": {call: [count, seconds]}}
+		self._phase = None
+		self._phase_start = None
+		self._start = time.perf_counter()
+		self.seconds = 0.0
+		self.finished = False
+		self.notes = []
+
+	def mark(self, phase):
+		""" End the current phase and start a new one. """
+		now = time.perf_counter()
+		if self._phase is not None:
+			self.phases[self._phase]["seconds"] += now - self._phase_start
+		self._phase = phase
+		self._phase_start = now
+		if phase is not None and phase not in self.phases:
+			self.phases[phase] = {"seconds": 0.0, "calls": {}}
+
+	def finish(self):
+		self.mark(None)
+		self.seconds = time.perf_counter() - self._start
+		self.finished = True
+
+	def record(self, call, seconds):
+		if self.finished:
+			# Wrapped layers can outlive the operation, chunked moves for one
+			return
+		if self._phase is None:
+			self.mark("setup")
+		entry = self.phases[self._phase]["calls"].setdefault(call, [0, 0.0])
+		entry[0] += 1
+		entry[1] += seconds
+
+	def wrap(self, obj):
+		""" Wrap a document, view, layer or list of layers so their calls get recorded. """
+		if isinstance(obj, list):
+			return [self.wrap(item) for item in obj]
+		if obj is None or isinstance(obj, (_Instrumented, bool, int, float, str)):
+			return obj
+		if (hasattr(obj, "uniqueId") or hasattr(obj, "refreshProjection") or
+			hasattr(obj, "selectedNodes") or hasattr(obj, "pixelData")):
+			return _Instrumented(obj, self)
+		return obj
+
+	def note(self, text):
+		""" Add a remark to the report. """
+		self.notes.append(text)
+
+	def totals(self):
+		""" Calls made during the whole operation.
+			@return: dict of call: [count, seconds] """
+		totals = {}
+		for phase in self.phases.values():
+			for call, (count, seconds) in phase["calls"].items():
+				entry = totals.setdefault(call, [0, 0.0])
+				entry[0] += count
+				entry[1] += seconds
+		return totals
+
+	def summary(self):
+		""" One line summary of where the time went. """
+		parts = []
+		for phase, data in self.phases.items():
+			calls = sum(count for count, seconds in data["calls"].values())
+			parts.append(f"{phase} {data['seconds'] * 1000:.0f} ms ({calls} calls)")
+		notes = f" ({', '.join(self.notes)})" if self.notes else ""
+		return f"{self.name}{notes}: {self.seconds * 1000:.0f} ms | " + ", ".join(parts)
+
+	def report(self):
+		""" Detailed multi-line report. """
+		lines = [f"=== {time.strftime('%Y-%m-%d %H:%M:%S')} {self.name}: {self.seconds * 1000:.1f} ms"]
+		lines += [f"  note: {text}" for text in self.notes]
+		for phase, data in self.phases.items():
+			lines.append(f"  {phase:<12} {data['seconds'] * 1000:>10.1f} ms")
+			for call, (count, seconds) in sorted(data["calls"].items(), key=lambda item: -item[1][1]):
+				lines.append(f"    {call:<20} {count:>8} calls {seconds * 1000:>10.1f} ms")
+		lines.append("  totals")
+		for call, (count, seconds) in sorted(self.totals().items(), key=lambda item: -item[1][1]):
+			lines.append(f"    {call:<20} {count:>8} calls {seconds * 1000:>10.1f} ms")
+		return "\n".join(lines)
+
+
+class _Instrumented:
+	""" Proxy recording calls made to the wrapped Krita object. """
+
+	__slots__ = ("_target", "_profiler")
+
+	def __init__(self, target, profiler):
+		self._target = target
+		self._profiler = profiler
+
+	def __getattr__(self, name):
+		attr = getattr(self._target, name)
+		if name not in PROFILED_CALLS:
+			return attr
+
+		profiler = self._profiler
+
+		def call(*args, **kwargs):
+			start = time.perf_counter()
+			result = attr(*args, **kwargs)
+			profiler.record(name, time.perf_counter() - start)
+			return profiler.wrap(result)
+
+		return call
+
+	def __eq__(self, other):
+		if isinstance(other, _Instrumented):
+			other = other._target
+		return self._target == other
+
+	def __hash__(self):
+		return hash(self._target)
+
+
+def mark(phase):
+	""" Start a new phase of the operation being profiled, if any. """
+	if _active is not None:
+		_active.mark(phase)
+
+
+def note(text):
+	""" Add a remark to the report of the operation being profiled, if any. """
+	if _active is not None:
+		_active.note(text)
+
+
+def instrument(obj):
+	""" Wrap Krita objects while an operation is profiled, otherwise return them untouched. """
+	if _active is not None:
+		return _active.wrap(obj)
+	return obj
+
+
+def profiled(name):
+	""" Decorator profiling an operator when profiling is enabled.
+		@param name: Operation name, the first argument (mode) is appended to it. """
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			global _active
+			if not enabled or _active is not None:
+				return func(*args, **kwargs)
+
+			label = f"{name} {args[0]}" if args else name
+			_active = Profiler(label)
+			try:
+				return func(*args, **kwargs)
+			finally:
+				profiler = _active
+				_active = None
+				profiler.finish()
+				_publish(profiler)
+
+		return wrapper
+	return decorator
+
+
+def _publish(profiler):
+	try:
+		with open(log_path, "a") as f:
+			f.write(profiler.report() + "\n")
+	except OSError:
+		pass
+
+	for listener in listeners:
+		listener(profiler)
@@ -0,0 +1,612 @@
+######################## Geometry Snapshot ##########################
+
+# Every property read from a Node goes through the PyQt/Krita binding, which is
+# 	slow enough to dominate operations on documents with hundreds of layers.
+# 	The snapshot reads each layer once and serves every later read from memory.
+
+import time
+
+# Layer types without dimensions of their own, they never add to a group's bounds
+BOUNDLESS_TYPES = {"filterlayer", "filllayer", "transparencymask", "filtermask", "colorizemask", "transformmask", "selectionmask"}
+
+class NodeRecord:
+	""" Properties of a single layer, read once from Krita.
+		Bounds are stored as (x, y, width, height) and positions as (x, y). """
+
+	__slots__ = (
+		"node",  # Krita Node, only needed to move it
+		"uid",
+		"type",
+		"bounds",
+		"position",
+		"locked",
+		"visible",
+		"parent",  # Parent uid, None when unknown
+		"children",  # Tuple of children uids, None when subtree wasn't read
+		"source",  # Source uid for clone layers
+	)
+
+	def __init__(self, node, uid, node_type, bounds, position, locked, visible):
+		self.node = node
+		self.uid = uid
+		self.type = node_type
+		self.bounds = bounds
+		self.position = position
+		self.locked = locked
+		self.visible = visible
+		self.parent = None
+		self.children = None
+		self.source = None
+
+	def __repr__(self):
+		return f"<NodeRecord {self.type} {self.uid} {self.bounds}>"
+
+
+class GeometrySnapshot:
+	""" Read the selected layers, their descendants and clone sources once.
+		@param selected_nodes: List of selected layers.
+		@param active_node: Active layer, default None.
+		@param stepped: Don't read anything yet, read_step() reads a slice of
+			time at a time, default False (everything is read right away). """
+
+	def __init__(self, selected_nodes, active_node=None, stepped=False):
+		self.records = {}  # uid: NodeRecord
+		self.selected = []  # Records in selection order
+		self.active = None
+
+		# uid: (x, y, x_out, y_out) union of a layer's descendants, see group_bounds()
+		self._group_bounds = {}
+		# Uids of layers moved since they were read, re-read on demand
+		self._stale = set()
+		# Source uid: uids of its clones
+		self._clones = {}
+
+		# Binding calls made, see _call(), and reads answered from the records
+		# 	instead, see apply_plan()
+		self.binding_calls = 0
+		self.served = 0
+
+		self._reading = self._read_all(selected_nodes, active_node)
+		if not stepped:
+			for _ in self._reading:
+				pass
+
+	# --- Reading from Krita
+
+	def _call(self, method):
+		""" Call the binding, counting it. """
+		self.binding_calls += 1
+		return method()
+
+	def read_step(self, deadline):
+		""" Read layers until a deadline, when created stepped.
+			@param deadline: time.perf_counter() value to stop at.
+			@return: True when everything was read. """
+		for _ in self._reading:
+			if time.perf_counter() >= deadline:
+				return False
+		return True
+
+	def _read_all(self, selected_nodes, active_node):
+		# Generator reading everything, pausing after every layer
+		for node in selected_nodes:
+			record = yield from self._read_tree(node)
+			self._read_parent(record)
+			self.selected.append(record)
+
+		if active_node is not None:
+			self.active = yield from self._read_tree(active_node)
+			self._read_parent(self.active)
+
+	def _read_node(self, node, uid=None):
+		""" Read a single layer, reusing its record when already known.
+			@return: NodeRecord """
+		if uid is None:
+			uid = self._call(node.uniqueId)
+
+		record = self.records.get(uid)
+		if record is not None:
+			self.served += 1
+			return record
+
+		b = self._call(node.bounds)
+		p = self._call(node.position)
+		record = NodeRecord(
+			node,
+			uid,
+			self._call(node.type),
+			(b.x(), b.y(), b.width(), b.height()),
+			(p.x(), p.y()),
+			self._call(node.locked),
+			self._call(node.visible)
+		)
+		self.records[uid] = record
+
+		if record.type == "clonelayer":
+			self._read_sources(record)
+
+		return record
+
+	def _read_sources(self, record):
+		""" Read the whole source chain of a clone layer. """
+		while record.type == "clonelayer" and record.source is None:
+			source = self._call(record.node.sourceNode)
+			if source is None:
+				break
+			source_record = self._read_node(source)
+			record.source = source_record.uid
+			self._clones.setdefault(source_record.uid, []).append(record.uid)
+			record = source_record
+
+	def _read_tree(self, node):
+		""" Read a layer and all its descendants, walking the tree without recursion.
+			Generator pausing after every layer read, see _read_all().
+			@return: NodeRecord of node. """
+		root = self._read_node(node)
+		stack = [root]
+		while stack:
+			record = stack.pop()
+			if record.children is not None:
+				# Subtree was already read
+				self.served += 1
+				continue
+
+			children = self._call(record.node.childNodes)
+			uids = []
+			for child in children:
+				child_record = self._read_node(child)
+				child_record.parent = record.uid
+				uids.append(child_record.uid)
+				stack.append(child_record)
+				yield
+			record.children = tuple(uids)
+
+		return root
+
+	def _read_parent(self, record):
+		""" Retrieve the parent uid of a layer when not already known. """
+		if record.parent is not None:
+			self.served += 1
+			return
+		parent = self._call(record.node.parentNode)
+		if parent is not None:
+			record.parent = self._call(parent.uniqueId)
+
+	def refresh(self, record):
+		""" Re-read bounds and position of a layer invalidated since it was read.
+			@return: The same NodeRecord, up to date. """
+		if record.uid in self._stale:
+			self._stale.discard(record.uid)
+			b = self._call(record.node.bounds)
+			p = self._call(record.node.position)
+			record.bounds = (b.x(), b.y(), b.width(), b.height())
+			record.position = (p.x(), p.y())
+		else:
+			self.served += 1
+		return record
+
+	def invalidate(self, uid):
+		""" Forget what a move changed: the layer, its ancestors and any clones of it.
+			They get re-read from Krita next time their bounds are needed.
+			@param uid: Uid of the layer that moved. """
+		records = self.records
+		group_bounds = self._group_bounds
+		stale = self._stale
+		pending = [uid]
+		while pending:
+			uid = pending.pop()
+			if uid in stale:
+				# Already invalidated along with everything depending on it
+				continue
+
+			# Clones show their source's pixels, they change with it
+			pending.extend(self._clones.get(uid, ()))
+
+			# Bounds of every ancestor group may change, nothing above them does
+			while uid is not None and uid not in stale:
+				stale.add(uid)
+				group_bounds.pop(uid, None)
+				record = records.get(uid)
+				uid = record.parent if record is not None else None
+
+	def translate(self, moves):
+		""" Move layers in memory only, as if the moves had been applied in Krita,
+			so another plan can be computed from where they'd end up. Clones follow
+			their sources and groups their children, clone bounds keep their quirk.
+			@param moves: List of (uid, x, y) target positions. """
+		records = self.records
+		shifts = {}
+		previous = {}  # uid: position before moving
+		for uid, x, y in moves:
+			p = records[uid].position
+			if p != (x, y):
+				shifts[uid] = (x - p[0], y - p[1])
+				previous[uid] = p
+				records[uid].position = (x, y)
+
+		# Moved layers and every clone showing them, sources before their clones
+		affected = []
+		seen = set()
+		pending = list(shifts)
+		while pending:
+			uid = pending.pop()
+			if uid in seen:
+				continue
+			seen.add(uid)
+			affected.append(records[uid])
+			pending.extend(self._clones.get(uid, ()))
+		affected.sort(key=self._chain_length)
+
+		ancestors = set()
+		for record in affected:
+			# Translation on canvas: its own move, plus its sources' for clones
+			dx, dy = 0, 0
+			current = record
+			while current is not None:
+				shift = shifts.get(current.uid)
+				if shift is not None:
+					dx += shift[0]
+					dy += shift[1]
+				current = records.get(current.source) if current.type == "clonelayer" else None
+
+			if record.type == "clonelayer" and record.source in records:
+				# Clone bounds quirk: union of the source's and the clone's own rect
+				source = records[record.source]
+				s = source.bounds
+				if source.type == "clonelayer":
+					s = correct_clone_bounds(s, source.position)
+				b = correct_clone_bounds(record.bounds, previous.get(record.uid, record.position))
+				b = (b[0] + dx, b[1] + dy, b[2], b[3])
+				left, top = min(s[0], b[0]), min(s[1], b[1])
+				record.bounds = (
+					left,
+					top,
+					max(s[0] + s[2], b[0] + b[2]) - left,
+					max(s[1] + s[3], b[1] + b[3]) - top,
+				)
+			elif record.type != "grouplayer" and (dx or dy):
+				b = record.bounds
+				record.bounds = (b[0] + dx, b[1] + dy, b[2], b[3])
+
+			uid = record.parent
+			while uid in records and uid not in ancestors:
+				ancestors.add(uid)
+				uid = records[uid].parent
+
+		# Groups are the union of their children, deepest first
+		for uid in ancestors:
+			self._group_bounds.pop(uid, None)
+		for uid in sorted(ancestors, key=lambda uid: depth(records, uid), reverse=True):
+			record = records[uid]
+			if record.type == "grouplayer":
+				b = self.group_bounds(record)
+				if b[2] >= 0 and b[3] >= 0:
+					record.bounds = b
+
+	def _chain_length(self, record):
+		length = 0
+		while record is not None and record.type == "clonelayer":
+			length += 1
+			record = self.records.get(record.source)
+		return length
+
+	def state(self):
+		""" Bounds and positions of every layer, to go back to after translate().
+			@return: dict of uid: (bounds, position) """
+		return {uid: (record.bounds, record.position) for uid, record in self.records.items()}
+
+	def restore(self, state):
+		""" Put back bounds and positions saved by state(). """
+		for uid, (bounds, position) in state.items():
+			record = self.records[uid]
+			record.bounds = bounds
+			record.position = position
+		self._group_bounds.clear()
+
+	# --- Reading from memory
+
+	def __getitem__(self, uid):
+		return self.records[uid]
+
+	def __contains__(self, uid):
+		return uid in self.records
+
+	def source(self, record):
+		""" Retrieve the source record of a clone layer, or None. """
+		if record.source is None:
+			return None
+		return self.records[record.source]
+
+	def selection(self):
+		""" Records of the selected layers, in selection order.
+			@return: New list of NodeRecord that can be freely modified. """
+		return list(self.selected)
+
+	def clones(self, record):
+		""" Clone layers of a layer that were read in the snapshot, not clones of clones.
+			@return: List of NodeRecord. """
+		records = self.records
+		return [records[uid] for uid in self._clones.get(record.uid, ())]
+
+	def descendants(self, record):
+		""" Descendants of a layer, in the same order as findChildNodes("", True).
+			@return: List of NodeRecord. """
+		records = self.records
+		found = []
+		stack = list(reversed(record.children or ()))
+		while stack:
+			child = records[stack.pop()]
+			found.append(child)
+			if child.children:
+				stack.extend(reversed(child.children))
+
+		return found
+
+	def group_bounds(self, record):
+		""" Bounds of all descendants of a layer, correcting clones bounds. Same as
+			calculating the bounds of descendants(record) but every group is only
+			aggregated once, bottom-up, and kept until something inside it moves.
+			@param record: NodeRecord of a group, or any layer with children.
+			@return: (x, y, width, height) """
+		cache = self._group_bounds
+		records = self.records
+
+		if record.uid in cache:
+			self.served += 1
+		else:
+			# Post-order walk, children are aggregated before their parents
+			stack = [(record, False)]
+			while stack:
+				current, ready = stack.pop()
+				if current.uid in cache:
+					continue
+				children = [self.refresh(records[uid]) for uid in current.children or ()]
+				if not ready:
+					stack.append((current, True))
+					stack.extend((child, False) for child in children if child.children and child.uid not in cache)
+					continue
+
+				inf = float('inf')
+				x, y, x_out, y_out = inf, inf, -inf, -inf
+				for child in children:
+					if child.type not in BOUNDLESS_TYPES:
+						b = child.bounds
+						if child.type == "clonelayer":
+							b = correct_clone_bounds(b, child.position)
+						x = min(x, b[0])
+						y = min(y, b[1])
+						x_out = max(x_out, b[0] + b[2])
+						y_out = max(y_out, b[1] + b[3])
+					if child.children:
+						# Grandchildren count too, even under masks
+						c = cache[child.uid]
+						x = min(x, c[0])
+						y = min(y, c[1])
+						x_out = max(x_out, c[2])
+						y_out = max(y_out, c[3])
+				cache[current.uid] = (x, y, x_out, y_out)
+
+		x, y, x_out, y_out = cache[record.uid]
+		return (x, y, x_out - x, y_out - y)
+
+
+class SelectionIndex:
+	""" Selection membership by uid, including whether any ancestor of a layer
+		is selected. Answers are memoized, so checking a whole tree is linear.
+		@param snap: GeometrySnapshot holding the records.
+		@param records: Records of the selected layers. """
+
+	def __init__(self, snap, records):
+		self.records = snap.records
+		self.uids = {record.uid for record in records}
+		# uid: whether the layer is selected or inside a selected layer
+		self._covered = {}
+
+	def __contains__(self, uid):
+		return uid in self.uids
+
+	def __len__(self):
+		return len(self.uids)
+
+	def has_selected_ancestor(self, record):
+		""" Check if a parent, grandparent etc of a layer is selected.
+			@param record: NodeRecord of the layer.
+			@return: bool """
+		covered = self._covered
+		path = []
+		uid = record.parent
+		result = False
+
+		while uid is not None:
+			known = covered.get(uid)
+			if known is not None:
+				result = known
+				break
+			if uid in self.uids:
+				result = True
+				break
+			path.append(uid)
+			# Parents outside the snapshot can't have a selected ancestor, every
+			# 	selected layer had its whole subtree read.
+			parent = self.records.get(uid)
+			uid = parent.parent if parent is not None else None
+
+		for uid in path:
+			covered[uid] = result
+
+		return result
+
+
+class CloneGraph:
+	""" Dependency graph of clone layers and their sources, built once per operation.
+		Entries are kept in topological order: sources always come before their clones.
+		@param snap: GeometrySnapshot holding the clones and their source chains.
+		@param clone_records: Records of the clone layers being moved. """
+
+	def __init__(self, snap, clone_records):
+		self.entries = {}  # uid: entry dict, sources first
+		# (uid, key): sum of translations done by all sources of a clone
+		self._ancestors_translation = {}
+
+		for record in clone_records:
+			self._add_chain(snap, record)
+
+	def _add_chain(self, snap, record):
+		""" Walk up a clone's source chain without recursion, adding unknown layers. """
+		chain = []
+		current = record
+		while (current is not None and current.type == "clonelayer" and
+			current.uid not in self.entries):
+			chain.append(current)
+			current = snap.source(current)
+
+		if current is not None and current.uid not in self.entries:
+			# Major ancestor, the source that isn't a clone
+			self.entries[current.uid] = self._entry(current, None, True)
+
+		# Add from source to clone so the order stays topological
+		source = current.uid if current is not None else None
+		for clone in reversed(chain):
+			self.entries[clone.uid] = self._entry(clone, source, False)
+			source = clone.uid
+
+	def _entry(self, record, source, is_ancestral):
+		# Store position, calculate fixed bounds at this point to ensure
+		# 	the properties used aren't affected by any source's movement.
+		# 	Because sometimes the doc updates clones bounds in the middle of math,
+		# 	sometimes it doesn't. WHY you'd do that to me Krita?! <o>
+		bounds = record.bounds
+		if not is_ancestral:
+			# BUG FIX for clone bounds
+			bounds = correct_clone_bounds(bounds, record.position)
+
+		return {
+			"node" : record,
+			"source" : source,  # Source uid, None for major ancestors
+			"position" : record.position,
+			"real_bounds" : bounds,
+			"is_ancestral" : is_ancestral,
+			"translation_x" : 0,  # Position change done by the layer
+			"translation_y" : 0,
+		}
+
+	def __contains__(self, uid):
+		return uid in self.entries
+
+	def __getitem__(self, uid):
+		return self.entries[uid]
+
+	def __len__(self):
+		return len(self.entries)
+
+	def reset(self):
+		""" Forget translations, so the graph can be reused for another plan. """
+		for entry in self.entries.values():
+			entry["translation_x"] = 0
+			entry["translation_y"] = 0
+		self._ancestors_translation.clear()
+
+	def order(self):
+		""" Uids of every layer in the graph, sources before clones.
+			@return: list of uids. """
+		return list(self.entries)
+
+	def ancestors_translation(self, uid, key="translation_x"):
+		""" Sum of the translations done by every source up a clone's chain.
+			Sums are memoized, so call it while walking order() after every
+			source of the clone was moved.
+			@param uid: Clone layer uid.
+			@param key: Translation being summed, translation_x or translation_y.
+			@return: int """
+		memo = self._ancestors_translation
+		known = memo.get((uid, key))
+		if known is not None:
+			return known
+
+		# Climb until a known sum or the major ancestor is found
+		chain = []
+		current = uid
+		total = 0
+		while current is not None:
+			source = self.entries[current]["source"]
+			if source is None:
+				break
+			known = memo.get((source, key))
+			chain.append(current)
+			if known is not None:
+				total = known
+				break
+			current = source
+
+		# Come back down, storing sums for every clone along the way
+		for current in reversed(chain):
+			source = self.entries[current]["source"]
+			total += self.entries[source][key]
+			memo[(current, key)] = total
+
+		return memo.get((uid, key), 0)
+
+
+def depth(records, uid):
+	""" Number of layers from a layer up to the top of the tree, itself included,
+		counting only the ones read.
+		@param records: dict of uid: NodeRecord, like GeometrySnapshot.records.
+		@param uid: Uid of the layer.
+		@return: int, deeper layers get higher numbers. """
+	depth = 0
+	while uid in records:
+		uid = records[uid].parent
+		depth += 1
+	return depth
+
+
+def visual_shift(records, record, shifts):
+	""" Translation of a layer on canvas: its own move, plus its sources' for clones.
+		@param records: dict of uid: NodeRecord, like GeometrySnapshot.records.
+		@param record: NodeRecord of the layer.
+		@param shifts: dict of uid: (dx, dy) of the layers moved.
+		@return: (dx, dy) """
+	dx, dy = 0, 0
+	while record is not None:
+		shift = shifts.get(record.uid)
+		if shift is not None:
+			dx += shift[0]
+			dy += shift[1]
+		record = records.get(record.source) if record.type == "clonelayer" else None
+
+	return (dx, dy)
+
+
+def correct_clone_bounds(b, p):
+	""" Retrieve corrected clone layer bounds for positioning calculations.
+		@param b: Bounds (x, y, width, height) as informed by the clone layer.
+		@param p: Position (x, y) of the clone layer.
+		@return: Corrected layer bounds (x, y, width, height). """
+
+	# BUG FIX: Clone layers positions are relative to their source layers, however:
+	# 	- As of 5.2.2 bounds are buggy. They don't inform the actual layer
+	# 	boundaries nor their correct dimensions.
+	# 	- Their sources might be clone layers themselves, also making these
+	# 	sources relative to their sources, which can also be relative...
+	# 	When a source moves any clones and clones of clones will move. It's easier
+	# 	to account for that movement during align or distribution operations than
+	# 	to try to calculate the layers relativity here.
+
+	# Extract data
+	b_x, b_y, width, height = b
+	p_x, p_y = p
+
+	# --- Correct bounds bug. IMPORTANT: Might be removed if their calculation method is fixed!
+	# Dimensions are always wrong
+	width = width - abs(p_x)
+	height = height - abs(p_y)
+	# Bounds coordinates are correct when position is negative, but not when positive
+	if p_x > 0:
+		b_x = p_x + b_x
+	if p_y > 0:
+		b_y = p_y + b_y
+
+	# Recreate bounds for calculations
+	b = (b_x, b_y, width, height)
+
+	return b
@@ -0,0 +1,377 @@
+######################## Spatial Index ##########################
+
+# Edges of every layer in a document kept in sorted lists, one per axis, so the
+# 	edge closest to a coordinate is found with a binary search instead of
+# 	reading every layer on each click. The document is walked once, then the
+# 	index follows the moves done by operators and fixes itself when it finds
+# 	layers changed outside of them.
+
+from bisect import bisect_left, bisect_right
+from .snapshot import GeometrySnapshot, correct_clone_bounds, depth, visual_shift, BOUNDLESS_TYPES
+from . import applier
+
+# Key of the canvas rect in the index, it has edges too
+CANVAS = "canvas"
+# Outdated neighbours found in a single query before reading the whole document again
+MAX_STALE_HITS = 8
+
+# Index of the last document used, see document_index()
+_index = None
+
+
+class EdgeIndex:
+	""" Left/right and top/bottom edges of every visible layer in a document,
+		plus the canvas edges, in sorted lists.
+		@param doc: Document to index. """
+
+	def __init__(self, doc):
+		root = doc.rootNode()
+		self.key = root.uniqueId()
+		# Whole document, read once. Records give the layers tree and clone sources.
+		self.snap = GeometrySnapshot(root.childNodes())
+		# uids of the top level layers, adding or removing one needs a new read
+		self.top = tuple(record.uid for record in self.snap.selected)
+
+		self.rects = {}  # uid: (x, y, width, height) real rect, None when empty
+		self.positions = {}  # uid: (x, y) position when the rect was stored
+		self.shown = set()  # uids of layers whose edges are indexed
+		# axis: (sorted coordinates, uid owning each coordinate)
+		self.edges = {"x": ([], []), "y": ([], [])}
+		# Set when moves hit layers the index doesn't know, rebuild before next use
+		self.outdated = False
+
+		records = self.snap.records
+		# Parents before children, hidden groups hide everything inside
+		stack = [(record, True) for record in self.snap.selected]
+		order = []
+		while stack:
+			record, visible = stack.pop()
+			visible = visible and record.visible
+			order.append(record)
+			if visible and record.type not in BOUNDLESS_TYPES:
+				self.shown.add(record.uid)
+			stack.extend((records[uid], visible) for uid in record.children or ())
+
+		# Children before parents, so groups add up their children
+		for record in reversed(order):
+			self.positions[record.uid] = record.position
+			self._set(record.uid, self._rect(record))
+
+		self.resize(doc)
+
+	# --- Building and updating
+
+	def _rect(self, record):
+		""" Real rect of a layer, or the union of its children for groups. """
+		if record.type in BOUNDLESS_TYPES:
+			return None
+		if record.type == "grouplayer":
+			return self._union(record)
+		return _layer_rect(record.type, record.bounds, record.position)
+
+	def _union(self, record):
+		""" Union of the rects of a group's children already in the index. """
+		inf = float('inf')
+		x, y, x_out, y_out = inf, inf, -inf, -inf
+		for uid in record.children or ():
+			rect = self.rects.get(uid)
+			if rect is None:
+				continue
+			x = min(x, rect[0])
+			y = min(y, rect[1])
+			x_out = max(x_out, rect[0] + rect[2])
+			y_out = max(y_out, rect[1] + rect[3])
+
+		if x_out < x:
+			return None
+		return (x, y, x_out - x, y_out - y)
+
+	def _set(self, uid, rect):
+		""" Store the rect of a layer, moving its edges in the sorted lists. """
+		old = self.rects.get(uid)
+		if old == rect and uid in self.rects:
+			return
+		if old is not None and uid in self.shown:
+			self._edges(uid, old, remove=True)
+		self.rects[uid] = rect
+		if rect is not None and uid in self.shown:
+			self._edges(uid, rect)
+
+	def _edges(self, uid, rect, remove=False):
+		for axis, start, size in (("x", rect[0], rect[2]), ("y", rect[1], rect[3])):
+			coords, owners = self.edges[axis]
+			for co in (start, start + size):
+				if not remove:
+					i = bisect_left(coords, co)
+					coords.insert(i, co)
+					owners.insert(i, uid)
+					continue
+				# Same coordinate may be shared by many layers
+				i = bisect_left(coords, co)
+				while owners[i] != uid:
+					i += 1
+				del coords[i]
+				del owners[i]
+
+	def resize(self, doc):
+		""" Update the canvas edges, the document may have been resized or cropped. """
+		b = doc.bounds()
+		self.shown.add(CANVAS)
+		self._set(CANVAS, (b.x(), b.y(), b.width(), b.height()))
+
+	def move(self, moves):
+		""" Follow layers moved to new positions. Clones move with their sources
+			and groups are updated from their children.
+			@param moves: List of (uid, x, y) new positions. """
+		records = self.snap.records
+		positions = self.positions
+
+		shifts = {}
+		for uid, x, y in moves:
+			p = positions.get(uid)
+			if p is None:
+				# Layer added since the document was read
+				self.outdated = True
+				continue
+			if p != (x, y):
+				shifts[uid] = (x - p[0], y - p[1])
+				positions[uid] = (x, y)
+
+		# Clones show their source's pixels, their rects move along with it
+		changed = []
+		seen = set()
+		pending = list(shifts)
+		while pending:
+			uid = pending.pop()
+			if uid in seen:
+				continue
+			seen.add(uid)
+			changed.append(uid)
+			pending.extend(clone.uid for clone in self.snap.clones(records[uid]))
+
+		groups = set()
+		for uid in changed:
+			record = records[uid]
+			if record.type != "grouplayer":
+				dx, dy = visual_shift(records, record, shifts)
+				rect = self.rects.get(uid)
+				if rect is not None and (dx or dy):
+					self._set(uid, (rect[0] + dx, rect[1] + dy, rect[2], rect[3]))
+
+			# Every group above may have changed
+			parent = record.parent
+			while parent in records and parent not in groups:
+				groups.add(parent)
+				parent = records[parent].parent
+
+		self._update_groups(groups)
+
+	def _update_groups(self, groups):
+		""" Recompute the rects of groups from their children.
+			@param groups: uids of the groups, and of their ancestors. """
+		records = self.snap.records
+		# Deepest groups first, their parents include them. Layers holding
+		# 	masks were moved with them.
+		for uid in sorted(groups, key=lambda uid: -depth(records, uid)):
+			if records[uid].type == "grouplayer":
+				self._set(uid, self._union(records[uid]))
+
+	def _ancestors(self, uid):
+		""" uids of the groups holding a layer. """
+		records = self.snap.records
+		ancestors = []
+		parent = records[uid].parent
+		while parent in records:
+			ancestors.append(parent)
+			parent = records[parent].parent
+		return ancestors
+
+	def sync(self, snap):
+		""" Catch up with layers read in a fresh snapshot, in case they were moved
+			outside of Arrange 2.
+			@param snap: GeometrySnapshot read just now from the same document. """
+		moves = []
+		for uid, record in snap.records.items():
+			p = self.positions.get(uid)
+			if p is None:
+				self.outdated = True
+			elif p != record.position:
+				moves.append((uid, *record.position))
+		if moves:
+			self.move(moves)
+
+	def verify(self, uid):
+		""" Read a layer again to check the index is right about it: where it is
+			and its bounds, painting or transforming changes them without moving it.
+			Groups are checked through their children, their rect is the union.
+			@return: True when the index was right. """
+		if uid == CANVAS:
+			return True
+		record = self.snap.records[uid]
+		node = record.node
+		if node.parentNode() is None:
+			# Removed from the document
+			self._set(uid, None)
+			self.shown.discard(uid)
+			self._update_groups(self._ancestors(uid))
+			return False
+		p = node.position()
+		p = (p.x(), p.y())
+		if p != self.positions[uid]:
+			self.move([(uid, *p)])
+			return False
+
+		if record.type == "grouplayer":
+			right = True
+			for child in record.children or ():
+				right = self.verify(child) and right
+			return right
+
+		b = node.bounds()
+		rect = _layer_rect(record.type, (b.x(), b.y(), b.width(), b.height()), p)
+		if rect != self.rects[uid]:
+			self._set(uid, rect)
+			self._update_groups(self._ancestors(uid))
+			return False
+		return True
+
+	# --- Queries
+
+	def nearest(self, axis, coords, exclude=(), reach=None):
+		""" Closest edge to any of the given coordinates along an axis. Layers
+			lined up share coordinates, edges at the same one are skipped all at
+			once when none of them counts.
+			@param axis: "x" or "y".
+			@param coords: Coordinates looking for an edge, the edges of the selection.
+			@param exclude: uids of layers that don't count, the ones being moved.
+			@param reach: Maximum distance, default None (any).
+			@return: (distance, coordinate it applies to, edge, uid) or None. """
+		if not isinstance(exclude, (set, frozenset)):
+			exclude = frozenset(exclude)
+		edge_coords, owners = self.edges[axis]
+		count = len(edge_coords)
+		best = None
+		for co in coords:
+			below = bisect_left(edge_coords, co) - 1
+			above = below + 1
+			# Coordinates whose edges don't all get skipped, walked one by one
+			mixed_below = mixed_above = None
+			# Walk both ways from the coordinate until a layer that counts
+			while below >= 0 or above < count:
+				down = above >= count or (below >= 0 and co - edge_coords[below] <= edge_coords[above] - co)
+				if down:
+					i = below
+					below -= 1
+				else:
+					i = above
+					above += 1
+				edge = edge_coords[i]
+				distance = abs(edge - co)
+				if best is not None and distance >= best[0] or reach is not None and distance > reach:
+					break
+				if owners[i] not in exclude:
+					best = (distance, co, edge, owners[i])
+					break
+
+				if down:
+					if below >= 0 and edge_coords[below] == edge and mixed_below != edge:
+						start = bisect_left(edge_coords, edge, 0, below)
+						if exclude.issuperset(owners[start:below + 1]):
+							below = start - 1
+						else:
+							mixed_below = edge
+				elif above < count and edge_coords[above] == edge and mixed_above != edge:
+					end = bisect_right(edge_coords, edge, above, count)
+					if exclude.issuperset(owners[above:end]):
+						above = end
+					else:
+						mixed_above = edge
+
+		return best
+
+	def find(self, axis, coords, exclude=(), reach=None):
+		""" Same as nearest() but checking the layer found wasn't changed outside of
+			Arrange 2, looking again when it was. """
+		for i in range(MAX_STALE_HITS):
+			found = self.nearest(axis, coords, exclude, reach)
+			if found is None or self.verify(found[3]):
+				return found
+
+		# Too much changed since the document was read
+		self.outdated = True
+		return self.nearest(axis, coords, exclude, reach)
+
+	def related(self, records):
+		""" Layers moving along with the given ones: their descendants, ancestors
+			and clones. Their edges can't be snapped to.
+			@param records: NodeRecord of the layers being moved.
+			@return: set of uids. """
+		index_records = self.snap.records
+		related = set()
+		pending = [record.uid for record in records]
+		while pending:
+			uid = pending.pop()
+			if uid in related or uid not in index_records:
+				continue
+			related.add(uid)
+			record = index_records[uid]
+			pending.extend(record.children or ())
+			pending.extend(clone.uid for clone in self.snap.clones(record))
+
+		# Ancestors contain the moving layers
+		for record in records:
+			parent = record.parent
+			while parent is not None and parent not in related:
+				related.add(parent)
+				parent = index_records[parent].parent if parent in index_records else None
+
+		return related
+
+
+def _layer_rect(node_type, b, p):
+	""" Real rect of a layer that isn't a group.
+		@param node_type: Krita layer type name.
+		@param b: Bounds (x, y, width, height) as Krita reports them.
+		@param p: Position (x, y) of the layer.
+		@return: (x, y, width, height), None when it has no pixels or no bounds. """
+	if node_type in BOUNDLESS_TYPES:
+		return None
+	if node_type == "clonelayer":
+		# BUG FIX: Clone layers report buggy bounds
+		b = correct_clone_bounds(b, p)
+	if b[2] <= 0 or b[3] <= 0:
+		return None
+	return b
+
+
+def document_index(doc):
+	""" Index of a document, read only when it's a different document than last
+		time, its top level layers changed or too much changed in it since.
+		@return: EdgeIndex """
+	global _index
+	root = doc.rootNode()
+	if (
+		_index is None
+		or _index.outdated
+		or _index.key != root.uniqueId()
+		or _index.top != tuple(node.uniqueId() for node in root.childNodes())
+	):
+		_index = EdgeIndex(doc)
+	else:
+		_index.resize(doc)
+	return _index
+
+
+def forget():
+	""" Drop the index, the next query reads the document again. """
+	global _index
+	_index = None
+
+
+def moved(snap, moves):
+	""" Keep the index in step with layers moved by any operator. """
+	if _index is not None:
+		_index.move(moves)
+
+
+applier.move_listeners.append(moved)
@@ -0,0 +1,220 @@
+######################## Speculative Plans ##########################
+
+# Plans of the docker operations computed ahead of time. When the layer
+# 	selection stops changing, layers are read once, a slice of time per turn of
+# 	the event loop, and every align, distribute, pack and grid operation is
+# 	planned from that read, one per turn so Krita stays responsive. A click then
+# 	checks the selected layers didn't change since and applies the plan that's
+# 	ready, instead of reading and planning everything again.
+
+import time
+from krita import Krita, QTimer
+from .snapshot import GeometrySnapshot
+from . import operators as op
+from . import macros
+from . import applier
+from . import profiler
+
+# Milliseconds between checks of the layer selection
+POLL_INTERVAL = 300
+# Checks get further apart while nothing changes, up to this
+POLL_MAX_INTERVAL = 2400
+
+# Plans for the current selection, see PlanCache
+_cache = None
+# Selection seen on the last check, planning waits until it stays the same
+_candidate = None
+
+
+class PlanCache:
+	""" Plans of several operations for one selection, computed a step at a time.
+		@param key: Document, active layer, number of selected layers and
+			operations it was made for, see poll().
+		@param doc: Document holding the layers.
+		@param selected_nodes: List of selected layers.
+		@param operations: List of (operator, mode, params) to plan, params as
+			the operator gets them. """
+
+	def __init__(self, key, doc, selected_nodes, operations):
+		self.key = key
+		self.doc = doc
+		self.selected_nodes = selected_nodes
+		self.pending = list(operations)
+		self.plans = {}  # operation key: list of (uid, x, y) target positions, None when nothing to do
+		self.snap = None
+		self.fingerprint = None  # See operators.snapshot_fingerprint()
+		# Only align uses an anchor, every operation gets the same one
+		self.anchor = None
+		for action, mode, params in self.pending:
+			if "anchor" in params:
+				self.anchor = params["anchor"]()
+
+	def step(self):
+		""" Read layers for a slice of time or plan the next operation, then wait
+			for the next turn. """
+		if _cache is not self or applier.running is not None:
+			# Replaced, or layers are moving and the cache will be dropped
+			return
+
+		if self.fingerprint is None:
+			# Read every layer involved only once for all the plans, like chunked moves
+			if self.snap is None:
+				self.snap = GeometrySnapshot(self.selected_nodes, self.doc.activeNode(), stepped=True)
+			if self.snap.read_step(time.perf_counter() + applier.CHUNK_BUDGET):
+				# Nothing moved yet, layers are as read
+				self.fingerprint = op.snapshot_fingerprint(self.snap, self.doc, self.anchor)
+		elif self.pending:
+			action, mode, params = self.pending.pop(0)
+			self.plans[op.operation_key(action, mode, params)] = self.plan(action, mode, params)
+
+		if self.pending:
+			QTimer.singleShot(0, self.step)
+
+	def plan(self, action, mode, params):
+		""" Target positions of an operation, from the layers read. """
+		name = macros.step_name(action)
+		params = {key: value for key, value in params.items() if key != "visible"}
+		if "anchor" in params:
+			params["anchor"] = self.anchor
+			# Same minimum as align_nodes()
+			if not (self.anchor in ("canvas", "selection") or len(self.selected_nodes) > 1):
+				return None
+		return macros.plan_step(self.snap, self.doc, (name, mode, params))
+
+	def is_read(self):
+		""" Check layers were all read, plans can be taken. """
+		return self.fingerprint is not None
+
+	def valid(self, doc, selected_nodes):
+		""" Check every layer the plans read or move is still as it was read:
+			selected layers, their descendants, clones and clone sources. """
+		if doc.rootNode().uniqueId() != self.key[0]:
+			return False
+		return op.snapshot_fingerprint(self.snap, doc, self.anchor, selected_nodes) == self.fingerprint
+
+
+def poll(operations):
+	""" Check the layer selection, planning the operations once it stopped changing.
+		Called regularly while the docker is shown. Only the document, the active
+		layer and the number of selected layers are compared, the rest is checked
+		on click.
+		@param operations: List of (operator, mode, params) to plan.
+		@return: True when the selection changed since the last check. """
+	global _cache, _candidate
+
+	if applier.running is not None:
+		return False
+
+	app = Krita.instance()
+	doc = app.activeDocument()
+	window = app.activeWindow()
+	view = window.activeView() if window is not None else None
+	if doc is None or view is None:
+		forget()
+		return False
+
+	for action, mode, params in operations:
+		if "visible" in params and params["visible"]:
+			# Visible pixels can change without the layer moving, never plan ahead
+			forget()
+			return False
+
+	selected_nodes = view.selectedNodes()
+	if not selected_nodes:
+		forget()
+		return False
+
+	# Clicking a layer makes it active, adding or removing some changes the
+	# 	count, that's enough to notice without asking every layer its uid
+	active = doc.activeNode()
+	key = (
+		doc.rootNode().uniqueId(),
+		active.uniqueId() if active is not None else None,
+		len(selected_nodes),
+		tuple(op.operation_key(action, mode, params) for action, mode, params in operations),
+	)
+	if _cache is not None and _cache.key == key:
+		# Planned or being planned
+		return False
+	if key != _candidate:
+		# Still changing, wait for the next check
+		_candidate = key
+		return True
+
+	_cache = PlanCache(key, doc, selected_nodes, operations)
+	QTimer.singleShot(0, _cache.step)
+	return True
+
+
+def take(action, mode, **params):
+	""" Apply the plan of an operation computed ahead of time, when it's ready
+		and layers didn't change since.
+		@param action: Operator, like align_nodes.
+		@param mode: Operator mode, its first argument.
+		@param params: Operator parameters.
+		@return: True when applied, False when the operation must run as usual. """
+	cache = _cache
+	if cache is None or not cache.is_read():
+		return False
+	key = op.operation_key(action, mode, params)
+	if key not in cache.plans:
+		return False
+	return _apply_ready(mode, cache, key)
+
+
+def ready(action, mode, **params):
+	""" Plan of an operation computed ahead of time, when it's ready and layers
+		didn't change since. Only reads layers, nothing moves.
+		@param action: Operator, like align_nodes.
+		@param mode: Operator mode, its first argument.
+		@param params: Operator parameters.
+		@return: (GeometrySnapshot, list of (uid, x, y) target positions) or None. """
+	cache = _cache
+	if cache is None or not cache.is_read():
+		return None
+	key = op.operation_key(action, mode, params)
+	if key not in cache.plans:
+		return None
+
+	app = Krita.instance()
+	if not cache.valid(app.activeDocument(), app.activeWindow().activeView().selectedNodes()):
+		forget()
+		return None
+	return (cache.snap, cache.plans[key])
+
+
+@profiler.profiled("planned ahead")
+def _apply_ready(mode, cache, key):
+	# Layers still moving from a previous operation must be in place first
+	applier.finish_pending()
+
+	app = Krita.instance()
+	# Krita calls are only wrapped while profiling
+	doc = profiler.instrument(app.activeDocument())
+	view = profiler.instrument(app.activeWindow().activeView())
+
+	profiler.mark("check")
+	if not cache.valid(doc, view.selectedNodes()):
+		# Changed outside of Arrange 2, plans are wrong
+		forget()
+		return False
+
+	plan = cache.plans[key]
+	if plan:
+		op.apply_plan(cache.snap, plan, doc)
+	return True
+
+
+def forget():
+	""" Drop the plans, they're computed again on the next checks. """
+	global _cache, _candidate
+	_cache = None
+	_candidate = None
+
+
+def moved(snap, moves):
+	""" Layers moved, every plan is outdated. """
+	forget()
+
+
+applier.move_listeners.append(moved)
@@ -0,0 +1,160 @@
+""" Time every Arrange 2 align and distribute mode on synthetic scenes, outside Krita.
+
+	Usage:
+		python benchmarks/bench_operators.py [--sizes 10 100 1000 10000] [--repeat 3]
+			[--json results.json] [--baseline results.json] [--tolerance 1.5]
+
+	Scenes mix paint layers, nested groups, masks and clone-of-clone chains.
+	With --baseline the run fails when an operation got slower than tolerance
+	times its baseline, to catch scaling regressions before an upgrade. """
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# The krita stand-in lives next to this file, the plugin one level up
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.dirname(HERE))
+
+import krita
+import scenes
+from Arrange2 import operators as op
+from Arrange2 import macros
+from Arrange2 import speculative
+
+
+def _anchor():
+	# Align relative to all selected layers
+	return None
+
+
+def _planned(mode, **params):
+	# Click on a docker button with plans ready
+	speculative.take(op.distribute_nodes, mode, **params)
+
+
+def _plan_ahead():
+	# What the docker does while the selection doesn't change, not timed
+	operations = [(op.distribute_nodes, "horizontal", {"spacing": 0})]
+	speculative.poll(operations)
+	speculative.poll(operations)
+	krita.QTimer.run_pending()
+
+
+OPERATIONS = [
+	("align left", op.align_nodes, "left", {"anchor": _anchor}),
+	("align h_center", op.align_nodes, "h_center", {"anchor": _anchor}),
+	("align right", op.align_nodes, "right", {"anchor": _anchor}),
+	("align top", op.align_nodes, "top", {"anchor": _anchor}),
+	("align v_center", op.align_nodes, "v_center", {"anchor": _anchor}),
+	("align bottom", op.align_nodes, "bottom", {"anchor": _anchor}),
+	("distribute left", op.distribute_nodes, "left", {}),
+	("distribute h_center", op.distribute_nodes, "h_center", {}),
+	("distribute right", op.distribute_nodes, "right", {}),
+	("distribute top", op.distribute_nodes, "top", {}),
+	("distribute v_center", op.distribute_nodes, "v_center", {}),
+	("distribute bottom", op.distribute_nodes, "bottom", {}),
+	("spacing horizontal", op.distribute_nodes, "horizontal", {}),
+	("spacing vertical", op.distribute_nodes, "vertical", {}),
+	("edge-to-edge left", op.distribute_nodes, "horizontal", {"spacing": 0}),
+	("edge-to-edge right", op.distribute_nodes, "horizontal", {"spacing": 0, "reverse": True}),
+	("edge-to-edge top", op.distribute_nodes, "vertical", {"spacing": 0}),
+	("edge-to-edge bottom", op.distribute_nodes, "vertical", {"spacing": 0, "reverse": True}),
+	("spacing horiz. by rows", op.distribute_nodes, "horizontal", {"clusters": True}),
+	("remove overlaps horiz.", op.distribute_nodes, "horizontal", {"overlaps": True}),
+	("pack into sheet", op.pack_nodes, None, {"padding": 8}),
+	("grid", op.distribute_nodes, "grid", {"gutter": 8}),
+	("macro top+edges+center", macros.run_macro, "macro", {"steps": [
+		("align", "top", {}), ("distribute", "horizontal", {"spacing": 0}), ("align", "h_center", {"anchor": "canvas"})]}),
+	("snap both", op.snap_nodes, "both", {}),
+	("planned edge-to-edge", _planned, "horizontal", {"spacing": 0}),
+	("visible align left", op.align_nodes, "left", {"anchor": _anchor, "visible": True}),
+	("visible spacing horiz.", op.distribute_nodes, "horizontal", {"visible": True}),
+]
+
+# Untimed work done before some operations
+PREPARE = {
+	"planned edge-to-edge": _plan_ahead,
+}
+
+
+def run(sizes, repeat, seed=0):
+	""" Time every operation on every scene size.
+		@return: dict of "size/operation": {seconds, moves, calls} """
+	results = {}
+	for size in sizes:
+		for name, func, mode, params in OPERATIONS:
+			best = None
+			for i in range(repeat):
+				# Fresh scene every time, operations change it
+				scenes.build_scene(layers=size, seed=seed)
+				if name in PREPARE:
+					PREPARE[name]()
+				krita.Node.calls.clear()
+
+				start = time.perf_counter()
+				func(mode, **params)
+				# Large batches are moved in chunks from the event loop
+				krita.QTimer.run_pending()
+				elapsed = time.perf_counter() - start
+
+				if best is None or elapsed < best:
+					best = elapsed
+
+			calls = dict(krita.Node.calls)
+			moves = calls.pop("move", 0)
+			results[f"{size}/{name}"] = {
+				"seconds": best,
+				"moves": moves,
+				"calls": sum(calls.values()),
+			}
+			print(f"{size:>6} {name:<22} {best * 1000:>10.2f} ms {moves:>7} moves {sum(calls.values()):>8} calls")
+		sys.stdout.flush()
+
+	return results
+
+
+def compare(results, baseline, tolerance):
+	""" Print operations slower than tolerance times their baseline.
+		@return: Number of regressions. """
+	regressions = 0
+	for key, entry in results.items():
+		if key not in baseline:
+			continue
+		before = baseline[key]["seconds"]
+		ratio = entry["seconds"] / before if before else 1.0
+		if ratio > tolerance:
+			regressions += 1
+			print(f"REGRESSION {key}: {before * 1000:.2f} ms -> {entry['seconds'] * 1000:.2f} ms ({ratio:.2f}x)")
+
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--json", help="Write results to this file")
+	parser.add_argument("--baseline", help="Compare against results written by --json")
+	parser.add_argument("--tolerance", type=float, default=1.5)
+	args = parser.parse_args()
+
+	results = run(args.sizes, args.repeat, args.seed)
+
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(results, f, indent=1)
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
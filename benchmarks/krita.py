@@ -0,0 +1,553 @@
+""" Headless stand-in for the parts of Krita's `krita` module used by Arrange 2.
+
+	Only meant for benchmarks outside Krita. It models layer positions, bounds
+	and clone layers closely enough to run the operators, including the clone
+	bounds quirk worked around by correct_clone_bounds(). Every call to the
+	layer API is counted in Node.calls. """
+
+import itertools
+
+
+######################## Qt ##########################
+
+class QPoint:
+	__slots__ = ("_x", "_y")
+
+	def __init__(self, x=0, y=0):
+		self._x = int(x)
+		self._y = int(y)
+
+	def x(self):
+		return self._x
+
+	def y(self):
+		return self._y
+
+	def __eq__(self, other):
+		return isinstance(other, QPoint) and (self._x, self._y) == (other._x, other._y)
+
+	def __hash__(self):
+		return hash((self._x, self._y))
+
+	def __repr__(self):
+		return f"QPoint({self._x}, {self._y})"
+
+
+class QRect:
+	__slots__ = ("_x", "_y", "_w", "_h")
+
+	def __init__(self, x=0, y=0, width=0, height=0):
+		self._x = int(x)
+		self._y = int(y)
+		self._w = int(width)
+		self._h = int(height)
+
+	def x(self):
+		return self._x
+
+	def y(self):
+		return self._y
+
+	def width(self):
+		return self._w
+
+	def height(self):
+		return self._h
+
+	def isEmpty(self):
+		return self._w <= 0 or self._h <= 0
+
+	def isValid(self):
+		return not self.isEmpty()
+
+	def __bool__(self):
+		return self.isValid()
+
+	def translated(self, dx, dy):
+		return QRect(self._x + dx, self._y + dy, self._w, self._h)
+
+	def united(self, other):
+		if self.isEmpty():
+			return QRect(other._x, other._y, other._w, other._h)
+		if other.isEmpty():
+			return QRect(self._x, self._y, self._w, self._h)
+		x = min(self._x, other._x)
+		y = min(self._y, other._y)
+		x_out = max(self._x + self._w, other._x + other._w)
+		y_out = max(self._y + self._h, other._y + other._h)
+		return QRect(x, y, x_out - x, y_out - y)
+
+	def __eq__(self, other):
+		return isinstance(other, QRect) and (self._x, self._y, self._w, self._h) == (other._x, other._y, other._w, other._h)
+
+	def __hash__(self):
+		return hash((self._x, self._y, self._w, self._h))
+
+	def __repr__(self):
+		return f"QRect({self._x}, {self._y}, {self._w}, {self._h})"
+
+
+class _Signal:
+	def __init__(self):
+		self._slots = []
+
+	def connect(self, slot):
+		self._slots.append(slot)
+
+	def disconnect(self, slot=None):
+		if slot is None:
+			self._slots.clear()
+		elif slot in self._slots:
+			self._slots.remove(slot)
+
+	def emit(self, *args):
+		for slot in list(self._slots):
+			slot(*args)
+
+
+class _StubType(type):
+	# Class attributes too, like QSizePolicy.Minimum
+	def __getattr__(cls, name):
+		if name.startswith("__"):
+			raise AttributeError(name)
+		return _Stub()
+
+
+class _Stub(metaclass=_StubType):
+	""" Accepts any construction, call and attribute access. Stands in for GUI classes. """
+
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def __getattr__(self, name):
+		if name.startswith("__"):
+			raise AttributeError(name)
+		return _Stub()
+
+	def __call__(self, *args, **kwargs):
+		return _Stub()
+
+	def __bool__(self):
+		return False
+
+	def __iter__(self):
+		return iter(())
+
+
+class QTimer:
+	""" Single shots wait until run_pending(), which stands in for Qt's event
+		loop. Repeating timers never fire on their own, emit their timeout. """
+
+	_queue = []
+
+	def __init__(self, parent=None):
+		self._interval = 0
+		self._active = False
+		self.timeout = _Signal()
+
+	def setInterval(self, msec):
+		self._interval = msec
+
+	def interval(self):
+		return self._interval
+
+	def start(self, msec=None):
+		if msec is not None:
+			self._interval = msec
+		self._active = True
+
+	def stop(self):
+		self._active = False
+
+	def isActive(self):
+		return self._active
+
+	@staticmethod
+	def singleShot(msec, callback):
+		QTimer._queue.append(callback)
+
+	@staticmethod
+	def run_pending():
+		""" Not in Qt, run callbacks until none are left. """
+		queue = QTimer._queue
+		while queue:
+			queue.pop(0)()
+
+
+Qt = _Stub()
+QWidget = QDockWidget = QFrame = QHBoxLayout = QGridLayout = QRadioButton = QToolButton = _Stub
+QIcon = QLabel = QSpacerItem = QSizePolicy = QGraphicsOpacityEffect = QCheckBox = QProgressBar = QPushButton = QSpinBox = QAction = _Stub
+QObject = QEvent = QPainter = QPen = QColor = QOpenGLWidget = QAbstractScrollArea = QMdiArea = _Stub
+
+
+######################## Krita ##########################
+
+_uid_counter = itertools.count(1)
+
+# Layer types without dimensions, their bounds are the whole canvas
+_canvas_sized = {"filllayer", "filterlayer"}
+_masks = {"transparencymask", "filtermask", "colorizemask", "transformmask", "selectionmask"}
+
+
+def _counted(func):
+	""" Count calls to a Node method in Node.calls. """
+	name = func.__name__
+
+	def counted(self, *args, **kwargs):
+		Node.calls[name] = Node.calls.get(name, 0) + 1
+		return func(self, *args, **kwargs)
+
+	counted.__name__ = name
+	return counted
+
+
+class Node:
+	""" A layer or mask. Paint-like layers keep their content rect relative to
+		their position, so moving them moves their bounds like in Krita.
+		@param doc: Document the layer belongs to.
+		@param name: Layer name.
+		@param node_type: Krita layer type name.
+		@param content: (x, y, width, height) of the content, relative to position.
+			Only the opaque part of it is visible, all of it by default. """
+
+	# Count of calls made to the API, by method name
+	calls = {}
+
+	def __init__(self, doc, name, node_type, content=(0, 0, 0, 0)):
+		self._doc = doc
+		self._name = name
+		self._type = node_type
+		self._uid = "{%08d-0000-0000-0000-000000000000}" % next(_uid_counter)
+		self._x = 0
+		self._y = 0
+		self._content = content
+		self._opaque = content  # Visible part of content, relative to position
+		self._children = []
+		self._parent = None
+		self._source = None
+		self._locked = False
+		self._visible = True
+
+	# --- Tree
+	@_counted
+	def name(self):
+		return self._name
+
+	@_counted
+	def type(self):
+		return self._type
+
+	@_counted
+	def uniqueId(self):
+		return self._uid
+
+	@_counted
+	def parentNode(self):
+		return self._parent
+
+	@_counted
+	def childNodes(self):
+		return list(self._children)
+
+	@_counted
+	def findChildNodes(self, name="", recursive=False, partialMatch=False, type="", colorLabelIndex=0):
+		found = []
+		stack = list(reversed(self._children))
+		while stack:
+			child = stack.pop()
+			if ((not name or (name in child._name if partialMatch else name == child._name)) and
+				(not type or child._type == type)):
+				found.append(child)
+			if recursive:
+				stack.extend(reversed(child._children))
+		return found
+
+	@_counted
+	def sourceNode(self):
+		return self._source
+
+	def addChildNode(self, child, above=None):
+		child._parent = self
+		self._children.append(child)
+		return True
+
+	# --- State
+	@_counted
+	def locked(self):
+		return self._locked
+
+	def setLocked(self, value):
+		self._locked = value
+
+	@_counted
+	def visible(self):
+		return self._visible
+
+	def setVisible(self, value):
+		self._visible = value
+
+	# --- Geometry
+	def realBounds(self):
+		""" Actual extent of the layer on canvas, free of the clone quirk. Not in Krita. """
+		if self._type in _canvas_sized:
+			return self._doc.bounds()
+		if self._type == "grouplayer":
+			rect = QRect()
+			for child in self._children:
+				if child._type not in _masks:
+					rect = rect.united(child.realBounds())
+			return rect
+		if self._type == "clonelayer":
+			source = self._source.realBounds() if self._source is not None else QRect()
+			return source.translated(self._x, self._y) if not source.isEmpty() else source
+		cx, cy, w, h = self._content
+		if w <= 0 or h <= 0:
+			return QRect()
+		return QRect(cx + self._x, cy + self._y, w, h)
+
+	def _reported_bounds(self):
+		if self._type == "clonelayer":
+			# Krita 5.2 clones report the union of their source's and their own extent
+			source = self._source.realBounds() if self._source is not None else QRect()
+			return source.united(self.realBounds())
+		if self._type == "grouplayer":
+			rect = QRect()
+			for child in self._children:
+				if child._type not in _masks:
+					rect = rect.united(child._reported_bounds())
+			return rect
+		return self.realBounds()
+
+	@_counted
+	def bounds(self):
+		return self._reported_bounds()
+
+	@_counted
+	def colorModel(self):
+		return "RGBA"
+
+	@_counted
+	def colorDepth(self):
+		return "U8"
+
+	@_counted
+	def pixelData(self, x, y, w, h):
+		""" 8 bit BGRA pixels. Content outside the opaque rect is fully transparent. """
+		cx, cy, cw, ch = self._content
+		ox, oy, ow, oh = self._opaque
+		# Intersections with the requested rect, relative to it
+		def span(start, size, length):
+			first = min(max(start, 0), length)
+			return first, max(first, min(start + size, length))
+		content_x = span(cx + self._x - x, cw, w)
+		content_y = span(cy + self._y - y, ch, h)
+		opaque_x = span(ox + self._x - x, ow, w)
+		opaque_y = span(oy + self._y - y, oh, h)
+
+		empty = bytes(w * 4)
+		transparent = bytearray(w * 4)
+		transparent[content_x[0] * 4:content_x[1] * 4] = b"\x40" * ((content_x[1] - content_x[0]) * 4)
+		transparent[content_x[0] * 4 + 3:content_x[1] * 4:4] = bytes(content_x[1] - content_x[0])
+		opaque = bytearray(transparent)
+		opaque[opaque_x[0] * 4 + 3:opaque_x[1] * 4:4] = b"\xff" * (opaque_x[1] - opaque_x[0])
+		transparent = bytes(transparent)
+		opaque = bytes(opaque)
+
+		rows = []
+		for row in range(h):
+			if opaque_y[0] <= row < opaque_y[1]:
+				rows.append(opaque)
+			elif content_y[0] <= row < content_y[1]:
+				rows.append(transparent)
+			else:
+				rows.append(empty)
+		return b"".join(rows)
+
+	@_counted
+	def position(self):
+		return QPoint(self._x, self._y)
+
+	@_counted
+	def move(self, x, y):
+		# Like in Krita, moving a group doesn't move its children
+		self._x = int(x)
+		self._y = int(y)
+		return True
+
+
+class Selection:
+	""" Pixel selection of a rect. Pixels of the rect outside the selected part
+		are unselected but still reported in the selection bounds. """
+
+	def __init__(self, x, y, width, height, selected=None):
+		self._rect = (x, y, width, height)
+		self._selected = selected or self._rect
+
+	def x(self):
+		return self._rect[0]
+
+	def y(self):
+		return self._rect[1]
+
+	def width(self):
+		return self._rect[2]
+
+	def height(self):
+		return self._rect[3]
+
+	def pixelData(self, x, y, w, h):
+		sx, sy, sw, sh = self._selected
+		left, right = min(max(sx - x, 0), w), min(max(sx + sw - x, 0), w)
+		row = bytes(left) + b"\xff" * (right - left) + bytes(w - right)
+		empty = bytes(w)
+		return b"".join(row if sy <= y + i < sy + sh else empty for i in range(h))
+
+
+class Document:
+	def __init__(self, width=1920, height=1080):
+		self._width = width
+		self._height = height
+		self._root = Node(self, "root", "grouplayer")
+		self._active = None
+		self._selection = None
+
+	def bounds(self):
+		return QRect(0, 0, self._width, self._height)
+
+	def width(self):
+		return self._width
+
+	def height(self):
+		return self._height
+
+	def rootNode(self):
+		return self._root
+
+	def activeNode(self):
+		return self._active
+
+	def setActiveNode(self, node):
+		self._active = node
+
+	def selection(self):
+		return self._selection
+
+	def setSelection(self, selection):
+		self._selection = selection
+
+	def createNode(self, name, node_type, content=(0, 0, 0, 0)):
+		""" Create a layer. content is not in Krita, see Node. """
+		return Node(self, name, node_type, content)
+
+	def createCloneLayer(self, name, source):
+		node = Node(self, name, "clonelayer")
+		node._source = source
+		return node
+
+	def refreshProjection(self):
+		Node.calls["refreshProjection"] = Node.calls.get("refreshProjection", 0) + 1
+
+	def waitForDone(self):
+		Node.calls["waitForDone"] = Node.calls.get("waitForDone", 0) + 1
+
+
+class View:
+	def __init__(self, doc):
+		self._doc = doc
+		self._selected = []
+
+	def document(self):
+		return self._doc
+
+	def selectedNodes(self):
+		return list(self._selected)
+
+	def setSelectedNodes(self, nodes):
+		""" Not in Krita, used to set up scenes. """
+		self._selected = list(nodes)
+
+
+class Action:
+	def __init__(self, name, text):
+		self._name = name
+		self._text = text
+		self.triggered = _Signal()
+
+	def trigger(self):
+		self.triggered.emit()
+
+
+class Window:
+	def __init__(self):
+		self._view = None
+		self._actions = {}  # Not in Krita, actions by name
+		self.themeChanged = _Signal()
+
+	def createAction(self, name, text="", menu=""):
+		self._actions[name] = Action(name, text)
+		return self._actions[name]
+
+	def activeView(self):
+		return self._view
+
+	def qwindow(self):
+		return _Stub()
+
+
+class Notifier:
+	def __init__(self):
+		self.windowIsBeingCreated = _Signal()
+		self.windowCreated = _Signal()
+
+	def setActive(self, value):
+		pass
+
+
+class Extension:
+	def __init__(self, parent=None):
+		self._parent = parent
+
+
+class Krita:
+	_instance = None
+
+	def __init__(self):
+		self._window = Window()
+		self._doc = None
+		self._settings = {}
+		self._extensions = []
+		self._notifier = Notifier()
+
+	@classmethod
+	def instance(cls):
+		if cls._instance is None:
+			cls._instance = Krita()
+		return cls._instance
+
+	def activeDocument(self):
+		return self._doc
+
+	def activeWindow(self):
+		return self._window
+
+	def notifier(self):
+		return self._notifier
+
+	def addExtension(self, extension):
+		self._extensions.append(extension)
+
+	def icon(self, name):
+		return _Stub()
+
+	def readSetting(self, group, name, default):
+		return self._settings.get((group, name), default)
+
+	def writeSetting(self, group, name, value):
+		self._settings[(group, name)] = value
+
+	def setActiveDocument(self, doc):
+		""" Not in Krita, opens doc in the active window.
+			@return: View of the document. """
+		self._doc = doc
+		self._window._view = View(doc)
+		return self._window._view
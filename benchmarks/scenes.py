@@ -0,0 +1,98 @@
+""" Synthetic documents for benchmarking Arrange 2 with the headless krita stand-in. """
+
+import random
+
+import krita
+
+
+def build_scene(layers=100, seed=0, groups=0.15, clones=0.15, masks=0.1, chain=4,
+		selected=1.0, locked=0.0, hidden=0.0, margins=0.0, size=(8000, 8000)):
+	""" Build a document with random layers and select some of them.
+		@param layers: Approximate number of layers, masks and groups included.
+		@param seed: Random seed, same seed and parameters give the same scene.
+		@param groups: Chance of a top level item being a group of layers.
+		@param clones: Chance of a top level item being a clone layer.
+		@param masks: Chance of a paint layer getting a transparency mask.
+		@param chain: Maximum length of clone-of-clone chains.
+		@param selected: Chance of a top level item being selected.
+		@param locked: Chance of a top level item being edition locked.
+		@param hidden: Chance of a top level item being hidden.
+		@param margins: Chance of a paint layer having transparent margins around its pixels.
+		@param size: Canvas (width, height).
+		@return: (doc, view, top level nodes) """
+	rng = random.Random(seed)
+	doc = krita.Document(*size)
+	view = krita.Krita.instance().setActiveDocument(doc)
+	root = doc.rootNode()
+
+	top = []
+	sources = []
+	count = 0
+	while count < layers:
+		roll = rng.random()
+		if roll < groups:
+			group = doc.createNode(f"group{count}", "grouplayer")
+			root.addChildNode(group)
+			top.append(group)
+			count += 1
+			for i in range(rng.randint(1, 4)):
+				child = _paint_layer(doc, rng, f"child{count}", size, margins)
+				group.addChildNode(child)
+				sources.append(child)
+				count += 1
+				if rng.random() < 0.3:
+					# Nested group
+					subgroup = doc.createNode(f"subgroup{count}", "grouplayer")
+					group.addChildNode(subgroup)
+					leaf = _paint_layer(doc, rng, f"leaf{count}", size, margins)
+					subgroup.addChildNode(leaf)
+					sources.append(leaf)
+					count += 2
+		elif roll < groups + clones and sources:
+			# Chain of clones of clones
+			node = rng.choice(sources)
+			for i in range(rng.randint(1, chain)):
+				node = doc.createCloneLayer(f"clone{count}", node)
+				node.move(rng.randint(-300, 300), rng.randint(-300, 300))
+				root.addChildNode(node)
+				sources.append(node)
+				top.append(node)
+				count += 1
+		else:
+			node = _paint_layer(doc, rng, f"paint{count}", size, margins)
+			root.addChildNode(node)
+			sources.append(node)
+			top.append(node)
+			count += 1
+			if rng.random() < masks:
+				mask = doc.createNode(f"mask{count}", "transparencymask", (0, 0, 50, 50))
+				mask.move(node._x, node._y)
+				node.addChildNode(mask)
+				count += 1
+
+	for node in top:
+		if rng.random() < locked:
+			node.setLocked(True)
+		if rng.random() < hidden:
+			node.setVisible(False)
+
+	chosen = [node for node in top if rng.random() < selected]
+	if len(chosen) < 2:
+		chosen = top[:2]
+	view.setSelectedNodes(chosen)
+	doc.setActiveNode(chosen[0])
+
+	return doc, view, top
+
+
+def _paint_layer(doc, rng, name, size, margins=0.0):
+	width = rng.randint(10, 400)
+	height = rng.randint(10, 400)
+	node = doc.createNode(name, "paintlayer", (rng.randint(0, 50), rng.randint(0, 50), width, height))
+	if margins and rng.random() < margins:
+		# Erased borders, still part of the layer bounds
+		cx, cy, w, h = node._content
+		left, top = rng.randint(0, w // 3), rng.randint(0, h // 3)
+		node._opaque = (cx + left, cy + top, w - left - rng.randint(0, w // 3), h - top - rng.randint(0, h // 3))
+	node.move(rng.randint(0, size[0] - width), rng.randint(0, size[1] - height))
+	return node
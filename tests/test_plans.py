@@ -0,0 +1,102 @@
+""" Plans reused without reading layers again must notice edits made meanwhile.
+
+	Runs outside Krita on the stand-in from benchmarks/:
+		python -m unittest discover tests """
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(1, ROOT)
+
+import krita
+from Arrange2 import operators as op
+from Arrange2 import speculative
+
+ALIGN_LEFT = (op.align_nodes, "left", {"anchor": lambda: None})
+
+
+def build_group_scene():
+	""" A selected group holding a big and a small layer, the small one can move
+		without changing the group's bounds, and a selected layer left of it.
+		@return: (doc, small layer inside the group) """
+	doc = krita.Document(1000, 1000)
+	view = krita.Krita.instance().setActiveDocument(doc)
+	root = doc.rootNode()
+
+	group = doc.createNode("group", "grouplayer")
+	root.addChildNode(group)
+	big = doc.createNode("big", "paintlayer", (0, 0, 400, 400))
+	big.move(300, 300)
+	group.addChildNode(big)
+	small = doc.createNode("small", "paintlayer", (0, 0, 50, 50))
+	small.move(350, 350)
+	group.addChildNode(small)
+
+	left = doc.createNode("left", "paintlayer", (0, 0, 100, 100))
+	left.move(100, 500)
+	root.addChildNode(left)
+
+	view.setSelectedNodes([group, left])
+	doc.setActiveNode(group)
+	return doc, small
+
+
+class PlannedAheadTest(unittest.TestCase):
+
+	def setUp(self):
+		speculative.forget()
+		self.doc, self.small = build_group_scene()
+		operations = [ALIGN_LEFT]
+		# Planning starts once the selection is the same on two checks
+		speculative.poll(operations)
+		speculative.poll(operations)
+		krita.QTimer.run_pending()
+
+	def tearDown(self):
+		speculative.forget()
+		krita.QTimer.run_pending()
+
+	def test_unchanged_plan_is_applied(self):
+		action, mode, params = ALIGN_LEFT
+		self.assertTrue(speculative.take(action, mode, **params))
+		krita.QTimer.run_pending()
+		self.assertEqual(self.small.position().x(), 150)
+
+	def test_child_moved_in_selected_group_rejects_plan(self):
+		self.small.move(500, 500)
+		action, mode, params = ALIGN_LEFT
+		self.assertFalse(speculative.take(action, mode, **params))
+
+
+class RepeatTest(unittest.TestCase):
+
+	def setUp(self):
+		op._repeat = None
+		speculative.forget()
+		self.doc, self.small = build_group_scene()
+
+	def repeat(self):
+		action, mode, params = ALIGN_LEFT
+		op.repeat_operation(action, mode, **params)
+		krita.QTimer.run_pending()
+
+	def test_repeat_after_in_group_edit(self):
+		self.repeat()
+		self.assertEqual(self.small.position().x(), 150)
+
+		# Put every layer back where the operation found it, like an undo
+		nodes = self.doc.rootNode().findChildNodes("", True)
+		for node, x in zip(nodes, (0, 300, 350, 100)):
+			node.move(x, node.position().y())
+		# Then edit inside the group without changing its bounds
+		self.small.move(500, 500)
+
+		self.repeat()
+		self.assertEqual(self.small.position().x(), 300)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,56 @@
+""" The edge index must notice layers changed outside of Arrange 2.
+
+	Runs outside Krita on the stand-in from benchmarks/:
+		python -m unittest discover tests """
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(1, ROOT)
+
+import krita
+from Arrange2 import spatial
+
+
+def paint_layer(doc, parent, x, width):
+	node = doc.createNode("layer", "paintlayer", (0, 0, width, 100))
+	node.move(x, 0)
+	parent.addChildNode(node)
+	return node
+
+
+class EdgeIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		spatial.forget()
+		self.doc = krita.Document(2000, 1000)
+		krita.Krita.instance().setActiveDocument(self.doc)
+		root = self.doc.rootNode()
+		self.group = self.doc.createNode("group", "grouplayer")
+		root.addChildNode(self.group)
+		self.layer = paint_layer(self.doc, self.group, 500, 100)
+
+	def tearDown(self):
+		spatial.forget()
+
+	def test_painted_layer_is_read_again(self):
+		index = spatial.document_index(self.doc)
+		# Right half erased and cropped, it didn't move
+		self.layer._content = (0, 0, 50, 100)
+		self.layer._opaque = self.layer._content
+		found = index.find("x", [590], reach=50)
+		self.assertEqual(found[2], 550)
+		self.assertEqual(index.rects[self.group.uniqueId()], (500, 0, 50, 100))
+
+	def test_new_top_level_layer_reads_document_again(self):
+		index = spatial.document_index(self.doc)
+		paint_layer(self.doc, self.doc.rootNode(), 1200, 100)
+		self.assertIsNot(spatial.document_index(self.doc), index)
+		self.assertIs(spatial.document_index(self.doc), spatial.document_index(self.doc))
+
+
+if __name__ == "__main__":
+	unittest.main()